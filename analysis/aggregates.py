@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import io
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import DESTINATION_CATEGORIES, TRANSIT_GROUPS, build_features, categorize_destination
+from schema import DEFAULT_DATASET, WEEKDAYS, load_analysis_dataset, to_typed
+
+# Materialized price statistics of the analysis dataset. Every cell of the cube is one combination of
+# airline, route, weekday, transit group and crawl date and holds the count, sum, sum of squares, minimum and
+# maximum of the prices plus a quantile sketch. All of them can be merged, so new flights appended to
+# analysis_dataset.csv are added to the stored cube without reading the older rows again, and the tables of
+# the notebook are computed from the few thousand cells instead of all flights.
+
+KEY_COLUMNS = ['airline_name', 'departure_airport', 'destination_airport', 'weekday', 'transit_group', 'crawling_date']
+
+# Dimensions that can be queried in addition to the key columns
+DERIVED_DIMENSIONS = {
+    'route': lambda cells: cells['departure_airport'].astype(str) + '-' + cells['destination_airport'].astype(str),
+    'destination_category': lambda cells: categorize_destination(cells['destination_airport']),
+}
+ORDERED_DIMENSIONS = {
+    'weekday': WEEKDAYS,
+    'transit_group': TRANSIT_GROUPS,
+    'destination_category': DESTINATION_CATEGORIES,
+}
+
+# Relative accuracy of the quantile sketch: an estimated quantile is within 0.5 % of a price of the group
+SKETCH_ACCURACY = 0.005
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+# Bucket of prices of zero (and below), e.g. free seats or broken crawls
+ZERO_BUCKET = -(2 ** 31)
+
+STAT_COLUMNS = ['count', 'mean', 'std', 'min', 'q25', 'median', 'q75', 'max']
+
+# Bytes at the end of the consumed part of the CSV that are compared before new rows are appended
+CHECK_BYTES = 64 * 1024
+
+
+def cube_file(path):
+    """ Returns the file of the cube of a dataset, e.g. 'analysis_dataset_cube.pkl' """
+    return os.path.splitext(path)[0] + '_cube.pkl'
+
+
+def bucket_index(prices):
+    """ Returns the sketch bucket of every price: prices in bucket i lie in (gamma^(i-1), gamma^i] """
+    prices = np.asarray(prices, dtype='float64')
+    buckets = np.full(len(prices), ZERO_BUCKET, dtype='int64')
+    positive = prices > 0
+    buckets[positive] = np.ceil(np.log(prices[positive]) / math.log(SKETCH_GAMMA))
+    return buckets
+
+
+def bucket_value(buckets):
+    """ Returns the price that represents a bucket, with a relative error of at most SKETCH_ACCURACY """
+    buckets = np.asarray(buckets, dtype='int64')
+    values = 2 * np.power(SKETCH_GAMMA, buckets.astype('float64')) / (SKETCH_GAMMA + 1)
+    return np.where(buckets == ZERO_BUCKET, 0.0, values)
+
+
+def summarize(features):
+    """
+    Computes the cells and sketches of flights.
+
+    Parameters:
+        features (pandas.DataFrame): Flights as returned by features.load_features.
+
+    Returns:
+        tuple: The cells (KEY_COLUMNS with count, sum, sum_sq, min and max) and the sketches (KEY_COLUMNS with
+               bucket and count).
+    """
+    flights = pd.DataFrame({column: features[column].astype(object) for column in KEY_COLUMNS})
+    flights['crawling_date'] = features['crawling_date']
+    flights['price'] = features['price'].astype('float64')
+    flights = flights[flights['price'].notna()]
+    flights['price_sq'] = flights['price'] ** 2
+    flights['bucket'] = bucket_index(flights['price'])
+
+    cells = flights.groupby(KEY_COLUMNS, dropna=False, sort=False).agg(
+        count=('price', 'size'),
+        sum=('price', 'sum'),
+        sum_sq=('price_sq', 'sum'),
+        min=('price', 'min'),
+        max=('price', 'max')
+    ).reset_index()
+    sketches = flights.groupby(KEY_COLUMNS + ['bucket'], dropna=False, sort=False).size().rename('count').reset_index()
+    return cells, sketches
+
+
+class PriceCube:
+    """
+    Price statistics by airline, route, weekday, transit group and crawl date.
+
+    Parameters:
+        cells (pandas.DataFrame): The count, sum, sum of squares, minimum and maximum per cell.
+        sketches (pandas.DataFrame): The number of prices per cell and sketch bucket.
+        source (dict): The part of the dataset that is contained, see update_cube.
+    """
+
+    def __init__(self, cells=None, sketches=None, source=None):
+        empty = pd.DataFrame(columns=KEY_COLUMNS)
+        self.cells = cells if cells is not None else empty.assign(count=0, sum=0.0, sum_sq=0.0, min=0.0, max=0.0)
+        self.sketches = sketches if sketches is not None else empty.assign(bucket=0, count=0)
+        self.source = source or {}
+
+    def add(self, features):
+        """ Adds flights to the cube, e.g. the new rows of the dataset """
+        cells, sketches = summarize(features)
+        if self.cells.empty:
+            self.cells, self.sketches = cells, sketches
+            return
+        self.cells = pd.concat([self.cells, cells], ignore_index=True).groupby(KEY_COLUMNS, dropna=False, sort=False).agg(
+            count=('count', 'sum'), sum=('sum', 'sum'), sum_sq=('sum_sq', 'sum'), min=('min', 'min'), max=('max', 'max')
+        ).reset_index()
+        self.sketches = pd.concat([self.sketches, sketches], ignore_index=True).groupby(
+            KEY_COLUMNS + ['bucket'], dropna=False, sort=False)['count'].sum().reset_index()
+
+    def dimension(self, frame, name):
+        values = DERIVED_DIMENSIONS[name](frame) if name in DERIVED_DIMENSIONS else frame[name]
+        if name in ORDERED_DIMENSIONS:
+            values = pd.Categorical(values, categories=ORDERED_DIMENSIONS[name], ordered=True)
+        return values
+
+    def query(self, by, **filters):
+        """
+        Returns the price statistics of groups, like the agg tables of the notebook.
+
+        Parameters:
+            by (str or list): The dimensions to group by: key columns, 'route' or 'destination_category'.
+            filters: Dimension -> value or list of values, e.g. airline_name='Lufthansa'.
+
+        Returns:
+            pandas.DataFrame: count, mean, std, min, q25, median, q75 and max of the price per group. Count,
+                              mean, std, min and max are exact, the quartiles are estimated from the sketches.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        cells, sketches = self.cells, self.sketches
+        for name, values in filters.items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            cells = cells[np.asarray(pd.Series(self.dimension(cells, name)).isin(values))]
+            sketches = sketches[np.asarray(pd.Series(self.dimension(sketches, name)).isin(values))]
+
+        groups = {name: self.dimension(cells, name) for name in by}
+        grouped = cells[['count', 'sum', 'sum_sq', 'min', 'max']].groupby(
+            [groups[name] for name in by], observed=True, dropna=False).agg(
+            {'count': 'sum', 'sum': 'sum', 'sum_sq': 'sum', 'min': 'min', 'max': 'max'})
+        grouped.index.names = by
+
+        count = grouped['count'].astype('float64')
+        stats = pd.DataFrame(index=grouped.index)
+        stats['count'] = grouped['count'].astype('int64')
+        stats['mean'] = grouped['sum'] / count
+        variance = (grouped['sum_sq'] - grouped['sum'] ** 2 / count) / (count - 1)
+        stats['std'] = np.sqrt(variance.clip(lower=0)).where(count > 1)
+        stats['min'] = grouped['min']
+        stats['max'] = grouped['max']
+        quartiles = self.quantiles(sketches, by, [0.25, 0.5, 0.75]).reindex(stats.index)
+        for column, estimate in zip(['q25', 'median', 'q75'], quartiles.columns):
+            # The estimate never lies outside of the prices of the group
+            stats[column] = quartiles[estimate].clip(lower=stats['min'], upper=stats['max'])
+        return stats[STAT_COLUMNS]
+
+    def quantiles(self, sketches, by, qs):
+        """
+        Estimates quantiles per group from the merged sketches, interpolating between the two ranks around
+        q * (n - 1) like pandas does.
+
+        Returns:
+            pandas.DataFrame: One column per quantile, indexed by the groups.
+        """
+        counts = sketches[['bucket', 'count']].groupby(
+            [self.dimension(sketches, name) for name in by] + [sketches['bucket']], observed=True, dropna=False
+        )['count'].sum()
+        counts.index.names = by + ['bucket']
+        counts = counts[counts > 0].sort_index()
+        groups = counts.index.droplevel('bucket')
+        codes, uniques = pd.factorize(groups)
+        cumulative = counts.to_numpy().cumsum()
+        totals = np.bincount(codes, weights=counts.to_numpy())
+        offsets = np.cumsum(totals) - totals
+        buckets = counts.index.get_level_values('bucket').to_numpy()
+
+        def value_at(rank):
+            # Value of the first bucket whose cumulative count exceeds the 0-based rank
+            return bucket_value(buckets[np.searchsorted(cumulative, offsets + rank, side='right')])
+
+        estimates = {}
+        for q in qs:
+            rank = q * (totals - 1)
+            lower, upper = value_at(np.floor(rank)), value_at(np.ceil(rank))
+            estimates[q] = lower + (upper - lower) * (rank - np.floor(rank))
+        index = uniques if isinstance(uniques, pd.MultiIndex) else pd.Index(uniques, name=by[0])
+        if len(by) > 1 and not isinstance(index, pd.MultiIndex):
+            index = pd.MultiIndex.from_tuples(index, names=by)
+        return pd.DataFrame(estimates, index=index)
+
+    def save(self, path):
+        temporary = path + '.tmp'
+        pd.to_pickle({'cells': self.cells, 'sketches': self.sketches, 'source': self.source}, temporary)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        state = pd.read_pickle(path)
+        return cls(state['cells'], state['sketches'], state['source'])
+
+
+def tail_hash(path, offset):
+    """ Returns the hash of the CHECK_BYTES before an offset of a file """
+    with open(path, 'rb') as file:
+        file.seek(max(0, offset - CHECK_BYTES))
+        return hashlib.sha256(file.read(min(offset, CHECK_BYTES))).hexdigest()
+
+
+def read_rows(path, offset):
+    """
+    Reads the complete rows of the CSV from a byte offset on, with the header of the file.
+
+    Returns:
+        tuple: The rows as text and the offset after the last complete row.
+    """
+    with open(path, 'rb') as file:
+        header = file.readline()
+        offset = max(offset, len(header))
+        file.seek(offset)
+        data = file.read()
+    # A row that is still being written is read in the next update
+    end = data.rfind(b'\n') + 1
+    if end == 0:
+        return None, offset
+    names = pd.read_csv(io.BytesIO(header), dtype=str).columns
+    rows = pd.read_csv(io.BytesIO(data[:end]), header=None, names=names, dtype=str, keep_default_na=False)
+    return rows, offset + end
+
+
+def build_cube(path=DEFAULT_DATASET):
+    """ Builds the cube of a complete dataset """
+    cube = PriceCube()
+    cube.add(build_features(load_analysis_dataset(path)))
+    offset = os.path.getsize(path)
+    cube.source = {'offset': offset, 'check': tail_hash(path, offset)}
+    return cube
+
+
+def update_cube(path=DEFAULT_DATASET, rebuild=False):
+    """
+    Returns the cube of the dataset, with the rows appended since the last update added.
+
+    The cube remembers up to which byte the CSV is contained. If the file still has the same bytes before
+    that offset (the dataset is only appended to by enrichment.py), only the rows after it are read.
+    Otherwise, e.g. after python enrichment.py --rebuild, the cube is built again.
+
+    Parameters:
+        path (str): The analysis dataset as CSV.
+        rebuild (bool): Build the cube from the complete dataset.
+
+    Returns:
+        PriceCube: The cube, also stored next to the dataset.
+    """
+    cache = cube_file(path)
+    cube = None
+    if not rebuild and os.path.exists(cache):
+        cube = PriceCube.load(cache)
+        offset = cube.source.get('offset', 0)
+        if offset > os.path.getsize(path) or cube.source.get('check') != tail_hash(path, offset):
+            cube = None
+
+    if cube is None:
+        cube = build_cube(path)
+    else:
+        rows, offset = read_rows(path, cube.source['offset'])
+        if rows is None or rows.empty:
+            return cube
+        cube.add(build_features(to_typed(rows)))
+        cube.source = {'offset': offset, 'check': tail_hash(path, offset)}
+    cube.save(cache)
+    return cube
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Updates the price cube of the analysis dataset and prints a table.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_DATASET, help='The analysis dataset as CSV')
+    parser.add_argument('--by', nargs='+', default=['weekday'], help='Dimensions of the table (default: weekday)')
+    parser.add_argument('--rebuild', action='store_true', help='Build the cube from the complete dataset')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    cube = update_cube(args.path, rebuild=args.rebuild)
+    updated = time.monotonic()
+    table = cube.query(args.by)
+    print(table.to_string())
+    print(f"------------------ {len(cube.cells)} cells, updated in {updated - start:.2f}s, "
+          f"queried in {(time.monotonic() - updated) * 1000:.1f}ms ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import DEFAULT_DATASET
+
+# Price densities of many groups at once, as plotted in the KDE cells of analysis.ipynb. Instead of
+# evaluating scipy.stats.gaussian_kde at 1000 points per group (every point against every price), the prices
+# of all groups are spread onto one common fine grid (linear binning) and every row is smoothed with its
+# Gaussian kernel by FFT. The cost grows with the number of prices only through the binning.
+
+# Points of the curve of every group, as the np.linspace of the notebook
+DEFAULT_POINTS = 1000
+# Bins of the common grid, more are used if a bandwidth would be narrower than MIN_BINS_PER_BANDWIDTH bins
+DEFAULT_BINS = 4096
+MAX_BINS = 2 ** 18
+MIN_BINS_PER_BANDWIDTH = 4
+# The grid reaches this many bandwidths beyond the prices, so the FFT does not wrap density around
+PADDING_BANDWIDTHS = 5
+
+
+def grid_size(span, bandwidths, bins):
+    """ Returns the number of bins, a power of two, so the narrowest kernel spans enough bins """
+    needed = span * MIN_BINS_PER_BANDWIDTH / bandwidths.min()
+    size = max(bins, 2 ** int(np.ceil(np.log2(max(needed, 1)))))
+    return min(size, MAX_BINS)
+
+
+def linear_binning(codes, values, groups, lower, width, bins):
+    """
+    Spreads every value onto its two neighbouring grid points, weighted by distance.
+
+    Returns:
+        numpy.ndarray: groups x bins array of weights, every row sums to the number of values of its group.
+    """
+    position = (values - lower) / width
+    left = np.clip(np.floor(position).astype('int64'), 0, bins - 2)
+    fraction = position - left
+    flat = codes * bins + left
+    weights = np.bincount(flat, weights=1 - fraction, minlength=groups * bins)
+    weights += np.bincount(flat + 1, weights=fraction, minlength=groups * bins)
+    return weights.reshape(groups, bins)
+
+
+def group_densities(df, by, value='price', points=DEFAULT_POINTS, bandwidth=None, reflect=False, bins=DEFAULT_BINS):
+    """
+    Computes the density of the values of every group in one pass.
+
+    Parameters:
+        df (pandas.DataFrame): The data, e.g. the analysis dataset.
+        by (str): The column of the groups, e.g. 'weekday'.
+        value (str): The column of the values.
+        points (int): The number of points of every curve, from 0 to the maximum of the group.
+        bandwidth (float): A fixed bandwidth for all groups, Scott's rule per group (standard deviation
+                           * n^(-1/5), as gaussian_kde) if not given.
+        reflect (bool): Reflect the density at 0, so no density is lost below 0 for values that cannot be
+                        negative. Without it the curves match gaussian_kde of the notebook.
+        bins (int): The minimum number of bins of the common grid.
+
+    Returns:
+        dict: Group -> (x, density), ready for plt.plot(x, density, label=group). Groups with less than two
+              different values have no density and are left out.
+    """
+    data = df[[by, value]].dropna()
+    values = data[value].to_numpy(dtype='float64')
+    codes, uniques = pd.factorize(data[by], sort=True)
+
+    # Groups with a single value or equal values have no bandwidth (gaussian_kde fails for them)
+    counts = np.bincount(codes, minlength=len(uniques))
+    sums = np.bincount(codes, weights=values, minlength=len(uniques))
+    squares = np.bincount(codes, weights=values ** 2, minlength=len(uniques))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variances = (squares - sums ** 2 / counts) / (counts - 1)
+    if bandwidth is None:
+        bandwidths = np.sqrt(np.clip(variances, 0, None)) * counts.astype('float64') ** (-1 / 5)
+    else:
+        bandwidths = np.full(len(uniques), float(bandwidth))
+    valid = (counts > 1) & (variances > 0) & (bandwidths > 0)
+    if not valid.any():
+        return {}
+    keep = valid[codes]
+    values, codes = values[keep], np.cumsum(valid)[codes[keep]] - 1
+    uniques, counts, bandwidths = uniques[valid], counts[valid], bandwidths[valid]
+    maxima = np.full(len(uniques), -np.inf)
+    np.maximum.at(maxima, codes, values)
+
+    padding = PADDING_BANDWIDTHS * bandwidths.max()
+    # With reflect the curves also need the density at -x
+    lower = min(0.0, values.min(), -values.max() if reflect else 0.0) - padding
+    upper = values.max() + padding
+    size = grid_size(upper - lower, bandwidths, bins)
+    width = (upper - lower) / (size - 1)
+    grid = lower + width * np.arange(size)
+
+    weights = linear_binning(codes, values, len(uniques), lower, width, size)
+    # Gaussian kernel of every group in the frequency domain, with zero padding against wrap-around
+    length = 2 * size
+    frequencies = np.fft.rfftfreq(length, d=width)
+    kernels = np.exp(-0.5 * (2 * np.pi * frequencies[None, :] * bandwidths[:, None]) ** 2)
+    smoothed = np.fft.irfft(np.fft.rfft(weights, n=length, axis=1) * kernels, n=length, axis=1)[:, :size]
+    smoothed = np.clip(smoothed, 0, None) / (counts[:, None] * width)
+
+    densities = {}
+    for row, group in enumerate(uniques):
+        x = np.linspace(0, maxima[row], points)
+        density = np.interp(x, grid, smoothed[row])
+        if reflect:
+            density += np.interp(-x, grid, smoothed[row])
+        densities[group] = (x, density)
+    return densities
+
+
+def plot_densities(densities, ax=None, title=None, xlabel='Flugpreis (€)', legend_title=None):
+    """ Plots the curves of group_densities like the KDE cells of the notebook """
+    import matplotlib.pyplot as plt
+
+    ax = ax or plt.subplots(figsize=(12, 6))[1]
+    for group, (x, density) in densities.items():
+        ax.plot(x, density, label=group)
+    ax.set_title(title or '')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Dichte')
+    ax.legend(title=legend_title, bbox_to_anchor=(1.05, 1), loc='upper left')
+    return ax
+
+
+def scipy_densities(df, by, value='price', points=DEFAULT_POINTS):
+    """ The loop of the notebook with scipy.stats.gaussian_kde, for comparison """
+    from scipy.stats import gaussian_kde
+
+    densities = {}
+    for group, subset in df[[by, value]].dropna().groupby(by, observed=True)[value]:
+        if subset.nunique() > 1:
+            x = np.linspace(0, subset.max(), points)
+            densities[group] = (x, np.clip(gaussian_kde(subset)(x), 0, None))
+    return densities
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Computes the price densities of groups and compares them with gaussian_kde.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_DATASET, help='The analysis dataset as CSV')
+    parser.add_argument('--by', default='weekday', help='Column of the groups (default: weekday)')
+    parser.add_argument('--repeat', type=int, default=1, help='Repeat every flight this many times to time larger datasets')
+    args = parser.parse_args(argv)
+
+    from features import load_features
+
+    df = load_features(args.path)
+    df = df[df['price'] > 0]
+    if args.repeat > 1:
+        df = pd.concat([df] * args.repeat, ignore_index=True)
+
+    start = time.monotonic()
+    densities = group_densities(df, args.by)
+    binned = time.monotonic() - start
+    start = time.monotonic()
+    reference = scipy_densities(df, args.by)
+    exact = time.monotonic() - start
+
+    for group, (x, density) in densities.items():
+        difference = np.abs(density - reference[group][1]).max() / reference[group][1].max()
+        print(f"{group}: max. difference {difference:.2e} of the peak")
+    print(f"------------------ {len(df)} prices: binned FFT {binned * 1000:.1f}ms, gaussian_kde {exact * 1000:.1f}ms ------------------")
+
+
+if __name__ == "__main__":
+    main()
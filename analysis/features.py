@@ -0,0 +1,160 @@
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import DEFAULT_DATASET, load_analysis_dataset
+
+# Grouping features of analysis.ipynb, computed for all rows at once instead of with .apply per row. The
+# feature table is the typed dataset of schema.py plus these columns. It is stored next to the dataset
+# together with a fingerprint of the CSV, so it is only computed again when the dataset changes.
+
+DOMESTIC_AIRPORTS = ['BER', 'HAM', 'MUC']
+EUROPEAN_AIRPORTS = ['LHR', 'CDG', 'AMS']
+DESTINATION_CATEGORIES = ['Inland', 'Europa', 'International']
+
+TRANSIT_BINS = [-0.1, 0.1, 180, 360, float('inf')]
+TRANSIT_GROUPS = ['kein Transit', 'kurz (0-180 Min)', 'mittel (181-360 Min)', 'lang (>360 Min)']
+
+# Minutes since midnight: 00:00 - 05:59 Nacht, 06:00 - 11:59 Morgen, 12:00 - 17:59 Mittag/Nachmittag,
+# 18:00 - 23:59 Abend
+TIME_BINS = [-float('inf'), 359, 719, 1079, float('inf')]
+TIME_GROUPS = ['Nacht', 'Morgen', 'Mittag/Nachmittag', 'Abend']
+
+# Travel duration: up to 3 hours kurz, up to 6 hours mittel, longer lang
+DURATION_BINS = [-float('inf'), 180, 360, float('inf')]
+DURATION_GROUPS = ['kurz', 'mittel', 'lang']
+
+FEATURE_COLUMNS = [
+    'weekday_number', 'destination_category', 'transit_group', 'departure_time_group',
+    'arrival_time_group', 'travel_duration_group', 'days_to_departure'
+]
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def feature_file(path):
+    """ Returns the file of the feature table of a dataset, e.g. 'analysis_dataset_features.pkl' """
+    return os.path.splitext(path)[0] + '_features.pkl'
+
+
+def fingerprint(path, previous=None):
+    """
+    Returns the fingerprint of a file: its size, modification time and SHA-256 hash.
+
+    The hash is only computed if size or modification time differ from the previous fingerprint, so an
+    unchanged file costs one stat call.
+    """
+    stat = os.stat(path)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return previous
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+def categorize_destination(airports):
+    """ Vectorized categorize_destination of the notebook: 'Inland', 'Europa' or 'International' """
+    airports = airports.astype('string')
+    categories = np.select(
+        [airports.isin(DOMESTIC_AIRPORTS).to_numpy(dtype=bool), airports.isin(EUROPEAN_AIRPORTS).to_numpy(dtype=bool)],
+        ['Inland', 'Europa'],
+        'International'
+    )
+    return pd.Series(pd.Categorical(categories, categories=DESTINATION_CATEGORIES), index=airports.index)
+
+
+def group_minutes(minutes, bins, labels):
+    """ Assigns minutes to ordered groups, missing minutes stay missing """
+    return pd.cut(minutes.astype('float64'), bins=bins, labels=labels, ordered=True)
+
+
+def build_features(df):
+    """
+    Computes the grouping features of the notebook for a typed dataset.
+
+    Parameters:
+        df (pandas.DataFrame): The dataset as returned by schema.load_analysis_dataset.
+
+    Returns:
+        pandas.DataFrame: The dataset with the additional FEATURE_COLUMNS.
+    """
+    features = df.copy()
+    features['weekday_number'] = df['date'].dt.dayofweek.astype('Int8')
+    features['destination_category'] = categorize_destination(df['destination_airport'])
+    features['transit_group'] = group_minutes(df['transit_duration_minutes'], TRANSIT_BINS, TRANSIT_GROUPS)
+    features['departure_time_group'] = group_minutes(df['departure_time_minutes'], TIME_BINS, TIME_GROUPS)
+    features['arrival_time_group'] = group_minutes(df['arrival_time_minutes'], TIME_BINS, TIME_GROUPS)
+    features['travel_duration_group'] = group_minutes(df['travel_duration_minutes'], DURATION_BINS, DURATION_GROUPS)
+    features['days_to_departure'] = (df['date'] - df['crawling_date']).dt.days.astype('Int16')
+    return features
+
+
+def read_cached(cache):
+    """ Returns the cached feature table and the fingerprint of the dataset it was built from """
+    if not os.path.exists(cache):
+        return None, None
+    try:
+        features = pd.read_pickle(cache)
+    except Exception:
+        # A damaged or incompatible file is built again
+        return None, None
+    if not all(column in features.columns for column in FEATURE_COLUMNS):
+        return None, None
+    return features, features.attrs.get('source')
+
+
+def write_features(features, cache, source):
+    features.attrs['source'] = source
+    temporary = cache + '.tmp'
+    features.to_pickle(temporary)
+    os.replace(temporary, cache)
+
+
+def load_features(path=DEFAULT_DATASET, refresh=False):
+    """
+    Returns the feature table of the analysis dataset.
+
+    The table is read from the file next to the dataset if the dataset has not changed since it was built.
+    A dataset that was only touched (e.g. by a checkout) but has the same content does not invalidate it.
+
+    Parameters:
+        path (str): The analysis dataset as CSV.
+        refresh (bool): Compute the features even if the stored table is up to date.
+
+    Returns:
+        pandas.DataFrame: The typed dataset with the FEATURE_COLUMNS.
+    """
+    cache = feature_file(path)
+    features, built_from = (None, None) if refresh else read_cached(cache)
+    source = fingerprint(path, built_from)
+    if features is not None and built_from and source['sha256'] == built_from.get('sha256'):
+        if source is not built_from:
+            # Same content with a new modification time, remembered so the file is not hashed again
+            write_features(features, cache, source)
+        return features
+
+    features = build_features(load_analysis_dataset(path, refresh=refresh))
+    write_features(features, cache, source)
+    return features
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds the feature table of the analysis dataset.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_DATASET, help='The analysis dataset as CSV')
+    parser.add_argument('--refresh', action='store_true', help='Compute the features even if they are up to date')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    features = load_features(args.path, refresh=args.refresh)
+    print(f"{len(features)} rows, features: {', '.join(FEATURE_COLUMNS)}")
+    print(f"------------------ Features ready in {time.monotonic() - start:.2f}s ({feature_file(args.path)}) ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from nonparametric import adjust
+from schema import DEFAULT_DATASET, WEATHER_COLUMNS, load_analysis_dataset
+
+# Do stock prices and weather of the days before a flight go along with its price? The analysis dataset only
+# holds the values of the flight date, so every route gets a daily price series and every driver (stock
+# column of the airline, weather column of the departure or destination airport) a daily series over the
+# same calendar. The correlations of all routes, drivers and lags are computed at once on these matrices,
+# with the routes of every airline in their own process.
+
+ROUTE_COLUMNS = ['airline_name', 'departure_airport', 'destination_airport']
+STOCK_DRIVERS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+DEFAULT_DRIVERS = STOCK_DRIVERS + WEATHER_COLUMNS
+# Lag k correlates the price of a day with the driver k days earlier
+DEFAULT_MAX_LAG = 7
+DEFAULT_WINDOW = 14
+# Days with both a price and a driver value needed for a correlation
+MIN_PERIODS = 5
+DEFAULT_WORKERS = os.cpu_count() or 1
+RESULTS_FILE = 'lagged_correlations.csv'
+
+
+def driver_key(driver):
+    """ Returns the column whose value the driver belongs to: the airline for stocks, else the airport """
+    if driver.endswith('_departure'):
+        return 'departure_airport'
+    if driver.endswith('_destination'):
+        return 'destination_airport'
+    return 'airline_name'
+
+
+def daily_series(df, drivers, statistic='mean'):
+    """
+    Builds the daily price series of every route and the daily series of every driver for these routes.
+
+    The value of a driver on a day is taken from any flight of its airline or airport on that day, so a route
+    also gets the values of days on which it has no flight itself.
+
+    Parameters:
+        df (pandas.DataFrame): The analysis dataset.
+        drivers (list): The driver columns.
+        statistic (str): How the prices of the flights of a route and day are combined ('mean' or 'median').
+
+    Returns:
+        tuple: The routes (DataFrame of ROUTE_COLUMNS), the calendar (DatetimeIndex of all days), the prices
+               (routes x days) and the drivers (drivers x routes x days), NaN where there is no value.
+    """
+    df = df.dropna(subset=['date', 'price'])
+    calendar = pd.date_range(df['date'].min(), df['date'].max(), freq='D')
+    prices = df.groupby(ROUTE_COLUMNS + ['date'], observed=True)['price'].agg(statistic).unstack('date')
+    prices = prices.reindex(columns=calendar)
+    routes = prices.index.to_frame(index=False)
+
+    values = np.full((len(drivers), len(routes), len(calendar)), np.nan)
+    for number, driver in enumerate(drivers):
+        key = driver_key(driver)
+        table = df.dropna(subset=[driver]).groupby([key, 'date'], observed=True)[driver].first().unstack('date')
+        table = table.reindex(index=routes[key].astype(str).unique(), columns=calendar)
+        rows = table.index.get_indexer(routes[key].astype(str))
+        values[number] = table.to_numpy(dtype='float64')[rows]
+    return routes, calendar, prices.to_numpy(dtype='float64'), values
+
+
+def shift(values, lag):
+    """ Shifts the days (last axis) by lag, so day t holds the value of day t - lag """
+    if lag == 0:
+        return values
+    shifted = np.full(values.shape, np.nan)
+    if lag > 0:
+        shifted[..., lag:] = values[..., :-lag]
+    else:
+        shifted[..., :lag] = values[..., -lag:]
+    return shifted
+
+
+def lagged_correlations(prices, drivers, lags, min_periods=MIN_PERIODS):
+    """
+    Pearson correlation of every route's prices with every driver at every lag, over the days where both exist.
+
+    Parameters:
+        prices (numpy.ndarray): routes x days.
+        drivers (numpy.ndarray): drivers x routes x days.
+        lags (list): The lags in days.
+        min_periods (int): Correlations over fewer days are NaN.
+
+    Returns:
+        tuple: The correlations and the number of days, both drivers x lags x routes.
+    """
+    x = np.stack([shift(drivers, lag) for lag in lags], axis=1)
+    y = np.broadcast_to(prices, x.shape)
+    mask = ~np.isnan(x) & ~np.isnan(y)
+    n = mask.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Centred on the means of the common days, which is more accurate than sums of squares
+        dx = np.where(mask, x - (np.where(mask, x, 0).sum(axis=-1) / n)[..., None], 0)
+        dy = np.where(mask, y - (np.where(mask, y, 0).sum(axis=-1) / n)[..., None], 0)
+        correlation = (dx * dy).sum(axis=-1) / np.sqrt((dx ** 2).sum(axis=-1) * (dy ** 2).sum(axis=-1))
+    correlation[(n < min_periods) | ~np.isfinite(correlation)] = np.nan
+    return np.clip(correlation, -1, 1), n
+
+
+def rolling_correlations(prices, drivers, lag=0, window=DEFAULT_WINDOW, min_periods=MIN_PERIODS):
+    """
+    Pearson correlation of prices and drivers at one lag over a sliding window of days.
+
+    Returns:
+        numpy.ndarray: drivers x routes x days, the correlation of the window ending on that day.
+    """
+    x = shift(drivers, lag)
+    y = np.broadcast_to(prices, x.shape)
+    mask = ~np.isnan(x) & ~np.isnan(y)
+    x, y = np.where(mask, x, 0), np.where(mask, y, 0)
+
+    def window_sums(values):
+        sums = np.cumsum(values, axis=-1)
+        sums[..., window:] = sums[..., window:] - sums[..., :-window]
+        return sums
+
+    n = window_sums(mask.astype('float64'))
+    sx, sy = window_sums(x), window_sums(y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = window_sums(x * y) - sx * sy / n
+        variance_x = window_sums(x * x) - sx ** 2 / n
+        variance_y = window_sums(y * y) - sy ** 2 / n
+        correlation = covariance / np.sqrt(variance_x * variance_y)
+    # Variances that are zero up to rounding give no correlation
+    flat = (variance_x <= 1e-12 * np.maximum(window_sums(x * x), 1)) | (variance_y <= 1e-12 * np.maximum(window_sums(y * y), 1))
+    correlation[(n < min_periods) | flat | ~np.isfinite(correlation)] = np.nan
+    return np.clip(correlation, -1, 1)
+
+
+def p_values(correlation, n):
+    """ Two-sided p-values of Pearson correlations with the t distribution """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = correlation * np.sqrt((n - 2) / np.clip(1 - correlation ** 2, 1e-300, None))
+        return 2 * stats.t.sf(np.abs(t), n - 2)
+
+
+def screen_airline(prices, drivers, lags, min_periods):
+    """ lagged_correlations and p-values for the routes of one airline """
+    correlation, n = lagged_correlations(prices, drivers, lags, min_periods)
+    return correlation, n, p_values(correlation, n)
+
+
+def screen(df, drivers=DEFAULT_DRIVERS, lags=range(DEFAULT_MAX_LAG + 1), statistic='mean', min_periods=MIN_PERIODS,
+           correction='holm', workers=DEFAULT_WORKERS):
+    """
+    Correlates the price series of every route with every driver at every lag.
+
+    Parameters:
+        df (pandas.DataFrame): The analysis dataset.
+        drivers (list): The driver columns, e.g. ['Close', 'tavg_departure'].
+        lags (list): The lags in days, e.g. range(8).
+        statistic (str): The daily price of a route, 'mean' or 'median'.
+        min_periods (int): The minimum number of common days of a correlation.
+        correction (str): The correction of the p-values over all correlations, see nonparametric.adjust.
+        workers (int): The number of processes, each computing the routes of some airlines.
+
+    Returns:
+        pandas.DataFrame: One row per route, driver and lag with the number of days, correlation, p-value and
+                          adjusted p-value, the strongest correlations first.
+    """
+    drivers, lags = list(drivers), list(lags)
+    routes, _, prices, values = daily_series(df, drivers, statistic)
+    airlines = [np.flatnonzero(routes['airline_name'].to_numpy() == airline) for airline in routes['airline_name'].unique()]
+    arguments = [(prices[rows], values[:, rows], lags, min_periods) for rows in airlines]
+    if workers > 1 and len(arguments) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(arguments))) as executor:
+            results = list(executor.map(screen_airline, *zip(*arguments)))
+    else:
+        results = [screen_airline(*argument) for argument in arguments]
+
+    tables = []
+    for rows, (correlation, n, p) in zip(airlines, results):
+        # drivers x lags x routes, flattened in this order
+        table = routes.iloc[np.tile(rows, len(drivers) * len(lags))].reset_index(drop=True)
+        table['driver'] = np.repeat(drivers, len(lags) * len(rows))
+        table['lag'] = np.tile(np.repeat(lags, len(rows)), len(drivers))
+        table['days'] = n.ravel()
+        table['correlation'] = correlation.ravel()
+        table['p_value'] = p.ravel()
+        tables.append(table)
+    table = pd.concat(tables, ignore_index=True).dropna(subset=['correlation'])
+    table['adjusted_p_value'] = adjust(table['p_value'], correction) if len(table) else []
+    order = table['correlation'].abs().sort_values(ascending=False).index
+    return table.loc[order].reset_index(drop=True)
+
+
+def rolling_screen(df, drivers=DEFAULT_DRIVERS, lag=0, window=DEFAULT_WINDOW, statistic='mean', min_periods=MIN_PERIODS):
+    """
+    Rolling-window correlations of every route and driver at one lag.
+
+    Returns:
+        pandas.DataFrame: One row per route, driver and day with a correlation of the window ending that day.
+    """
+    drivers = list(drivers)
+    routes, calendar, prices, values = daily_series(df, drivers, statistic)
+    correlation = rolling_correlations(prices, values, lag, window, min_periods)
+    table = routes.iloc[np.tile(np.repeat(np.arange(len(routes)), len(calendar)), len(drivers))].reset_index(drop=True)
+    table['driver'] = np.repeat(drivers, len(routes) * len(calendar))
+    table['date'] = np.tile(calendar, len(drivers) * len(routes))
+    table['correlation'] = correlation.ravel()
+    return table.dropna(subset=['correlation']).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Screens lagged correlations between route prices and stock and weather series.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_DATASET, help='The analysis dataset as CSV')
+    parser.add_argument('--drivers', nargs='+', default=DEFAULT_DRIVERS, help='Stock and weather columns')
+    parser.add_argument('--max-lag', type=int, default=DEFAULT_MAX_LAG, help='Largest lag in days')
+    parser.add_argument('--statistic', default='mean', choices=['mean', 'median'], help='Daily price of a route')
+    parser.add_argument('--min-periods', type=int, default=MIN_PERIODS, help='Minimum number of common days')
+    parser.add_argument('--correction', default='holm', choices=['bonferroni', 'holm'], help='Correction of the p-values')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of processes')
+    parser.add_argument('--window', type=int, default=0,
+                        help='Also compute rolling correlations over this many days at lag 0, saved next to the output as *_rolling.csv')
+    parser.add_argument('--top', type=int, default=10, help='Number of strongest correlations to print')
+    parser.add_argument('--output', default=RESULTS_FILE, help='File of the results table')
+    args = parser.parse_args(argv)
+
+    df = load_analysis_dataset(args.path)
+    start = time.monotonic()
+    results = screen(df, args.drivers, range(args.max_lag + 1), args.statistic, args.min_periods, args.correction, args.workers)
+    screened = time.monotonic() - start
+    temporary = args.output + '.tmp'
+    results.to_csv(temporary, index=False)
+    os.replace(temporary, args.output)
+    print(results.head(args.top).to_string(index=False))
+    if args.window:
+        rolling = rolling_screen(df, args.drivers, 0, args.window, args.statistic, args.min_periods)
+        rolling_output = os.path.splitext(args.output)[0] + '_rolling.csv'
+        rolling.to_csv(rolling_output + '.tmp', index=False)
+        os.replace(rolling_output + '.tmp', rolling_output)
+        print(f"{len(rolling)} rolling correlations over {args.window} days, saved {rolling_output}")
+    print(f"------------------ {len(results)} correlations screened in {screened:.2f}s, saved {args.output} ------------------")
+
+
+if __name__ == "__main__":
+    main()
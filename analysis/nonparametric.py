@@ -0,0 +1,228 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from schema import DEFAULT_DATASET
+
+# The Kruskal-Wallis, Dunn and Mann-Whitney tests of analysis.ipynb for any number of grouping factors. The
+# prices are sorted by group once, so every group is a contiguous slice instead of a df[df[...] == group]
+# filter, and all ranks are computed once per factor. Permutation p-values shuffle the group labels of these
+# ranks and are spread over several processes.
+
+DEFAULT_FACTORS = [
+    'weekday', 'destination_category', 'airline_name', 'transit_group',
+    'departure_time_group', 'arrival_time_group', 'travel_duration_group'
+]
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Permutations computed by one task of a worker
+PERMUTATION_BATCH = 200
+ALPHA = 0.05
+
+
+class GroupedValues:
+    """
+    The values of all groups of a factor, sorted by group.
+
+    Parameters:
+        df (pandas.DataFrame): The data.
+        by (str): The column of the groups.
+        value (str): The column of the values.
+
+    Attributes:
+        labels (list): The groups, in the order of the categories or sorted.
+        values (numpy.ndarray): The values, group after group.
+        codes (numpy.ndarray): The group number of every value.
+        counts (numpy.ndarray): The number of values of every group.
+        ranks (numpy.ndarray): The ranks of the values among all values (average ranks for ties).
+    """
+
+    def __init__(self, df, by, value='price'):
+        data = df[[by, value]].dropna()
+        codes, uniques = pd.factorize(data[by], sort=True)
+        order = np.argsort(codes, kind='stable')
+        self.by = by
+        self.labels = list(uniques)
+        self.codes = codes[order]
+        self.values = data[value].to_numpy(dtype='float64')[order]
+        self.counts = np.bincount(self.codes, minlength=len(self.labels))
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self.ranks = stats.rankdata(self.values)
+        ties = np.unique(self.values, return_counts=True)[1].astype('float64')
+        self.tie_sum = (ties ** 3 - ties).sum()
+
+    def group(self, index):
+        """ Returns the values of one group """
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+
+def kruskal_statistic(rank_sums, counts, n, tie_sum):
+    """ Kruskal-Wallis H from the rank sums of the groups, with the tie correction of scipy.stats.kruskal """
+    h = 12 / (n * (n + 1)) * (rank_sums ** 2 / counts).sum(axis=-1) - 3 * (n + 1)
+    correction = 1 - tie_sum / (n ** 3 - n)
+    return h / correction if correction > 0 else h
+
+
+def dunn_z(mean_ranks, counts, n, tie_sum, pairs):
+    """ Dunn's z of every pair of groups, with the tie correction of scikit_posthocs.posthoc_dunn """
+    first, second = pairs[:, 0], pairs[:, 1]
+    variance = (n * (n + 1) / 12 - tie_sum / (12 * (n - 1))) * (1 / counts[first] + 1 / counts[second])
+    return np.abs(mean_ranks[..., first] - mean_ranks[..., second]) / np.sqrt(variance)
+
+
+def adjust(p_values, method='bonferroni'):
+    """
+    Corrects p-values for multiple comparisons.
+
+    Parameters:
+        p_values (numpy.ndarray): The p-values of all comparisons.
+        method (str): 'bonferroni' (p times the number of comparisons, as in the notebook) or 'holm'.
+
+    Returns:
+        numpy.ndarray: The adjusted p-values, at most 1.
+    """
+    p_values = np.asarray(p_values, dtype='float64')
+    m = len(p_values)
+    if method == 'bonferroni':
+        return np.minimum(p_values * m, 1)
+    if method == 'holm':
+        order = np.argsort(p_values)
+        adjusted = np.maximum.accumulate(p_values[order] * (m - np.arange(m)))
+        result = np.empty(m)
+        result[order] = np.minimum(adjusted, 1)
+        return result
+    raise ValueError(f"Unknown correction: {method}")
+
+
+def permutation_batch(ranks, counts, tie_sum, pairs, observed_h, observed_z, permutations, seed):
+    """
+    Counts the permutations of the group labels with statistics at least as large as observed.
+
+    Returns:
+        tuple: The count for the Kruskal-Wallis H and the counts for the Dunn z of every pair.
+    """
+    rng = np.random.default_rng(seed)
+    n, groups = len(ranks), len(counts)
+    labels = np.repeat(np.arange(groups), counts)
+    h_count, z_counts = 0, np.zeros(len(pairs), dtype='int64')
+    for _ in range(permutations):
+        rank_sums = np.bincount(rng.permutation(labels), weights=ranks, minlength=groups)
+        h_count += kruskal_statistic(rank_sums, counts, n, tie_sum) >= observed_h - 1e-12
+        z_counts += dunn_z(rank_sums / counts, counts, n, tie_sum, pairs) >= observed_z - 1e-12
+    return h_count, z_counts
+
+
+def permutation_p_values(grouped, pairs, observed_h, observed_z, permutations, workers=DEFAULT_WORKERS, seed=None):
+    """
+    Permutation p-values of the Kruskal-Wallis H and of the Dunn z of every pair.
+
+    The permutations are split into batches with independent random streams, computed by several processes
+    if workers > 1. The result does not depend on the number of workers.
+    """
+    batches = [PERMUTATION_BATCH] * (permutations // PERMUTATION_BATCH)
+    if permutations % PERMUTATION_BATCH:
+        batches.append(permutations % PERMUTATION_BATCH)
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    arguments = [(grouped.ranks, grouped.counts, grouped.tie_sum, pairs, observed_h, observed_z, size, batch_seed)
+                 for size, batch_seed in zip(batches, seeds)]
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(permutation_batch, *zip(*arguments)))
+    else:
+        results = [permutation_batch(*batch) for batch in arguments]
+    h_count = sum(result[0] for result in results)
+    z_counts = sum(result[1] for result in results)
+    # The observed labelling counts as one of the permutations
+    return (h_count + 1) / (permutations + 1), (z_counts + 1) / (permutations + 1)
+
+
+def test_factor(df, by, value='price', correction='bonferroni', permutations=0, workers=DEFAULT_WORKERS, seed=None):
+    """
+    Runs the Kruskal-Wallis test, Dunn's post-hoc test and pairwise Mann-Whitney U tests for one factor.
+
+    Parameters:
+        df (pandas.DataFrame): The data.
+        by (str): The column of the groups, e.g. 'weekday'.
+        value (str): The column of the values.
+        correction (str): The correction of the pairwise p-values, see adjust.
+        permutations (int): The number of permutations for permutation p-values, none if 0.
+        workers (int): The number of processes computing the permutations.
+        seed (int): The seed of the permutations.
+
+    Returns:
+        dict: 'kruskal' (statistic, p-value and permutation p-value), 'dunn' (matrix of the adjusted p-values,
+              like posthoc_dunn) and 'pairs' (one row per pair of groups, like the p_values_df of the notebook).
+    """
+    grouped = GroupedValues(df, by, value)
+    n, counts = len(grouped.values), grouped.counts
+    pairs = np.array(list(itertools.combinations(range(len(grouped.labels)), 2)), dtype='int64').reshape(-1, 2)
+
+    rank_sums = np.bincount(grouped.codes, weights=grouped.ranks, minlength=len(counts))
+    h = kruskal_statistic(rank_sums, counts, n, grouped.tie_sum)
+    kruskal = {'statistic': h, 'p_value': stats.chi2.sf(h, len(counts) - 1), 'permutation_p_value': np.nan}
+
+    z = dunn_z(rank_sums / counts, counts, n, grouped.tie_sum, pairs)
+    dunn_p = adjust(2 * stats.norm.sf(z), correction)
+
+    mann_whitney = [stats.mannwhitneyu(grouped.group(first), grouped.group(second), alternative='two-sided')
+                    for first, second in pairs]
+    table = pd.DataFrame({
+        'Group1': [grouped.labels[first] for first in pairs[:, 0]],
+        'Group2': [grouped.labels[second] for second in pairs[:, 1]],
+        'U': [result.statistic for result in mann_whitney],
+        'p_value': [result.pvalue for result in mann_whitney],
+    })
+    table['adjusted_p_value'] = adjust(table['p_value'], correction)
+    table['significant'] = table['adjusted_p_value'] < ALPHA
+    table['dunn_z'] = z
+    table['dunn_adjusted_p_value'] = dunn_p
+
+    if permutations:
+        kruskal['permutation_p_value'], z_p = permutation_p_values(grouped, pairs, h, z, permutations, workers, seed)
+        table['dunn_permutation_p_value'] = adjust(z_p, correction)
+
+    matrix = np.ones((len(counts), len(counts)))
+    matrix[pairs[:, 0], pairs[:, 1]] = dunn_p
+    matrix[pairs[:, 1], pairs[:, 0]] = dunn_p
+    matrix = pd.DataFrame(matrix, index=grouped.labels, columns=grouped.labels)
+    return {'kruskal': kruskal, 'dunn': matrix, 'pairs': table}
+
+
+def test_battery(df, factors=DEFAULT_FACTORS, value='price', **options):
+    """ Runs test_factor for every factor, returns factor -> result """
+    return {by: test_factor(df, by, value, **options) for by in factors}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the nonparametric tests of the notebook for every grouping factor.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_DATASET, help='The analysis dataset as CSV')
+    parser.add_argument('--by', nargs='+', default=DEFAULT_FACTORS, help='Grouping factors')
+    parser.add_argument('--correction', default='bonferroni', choices=['bonferroni', 'holm'], help='Correction of the pairwise p-values')
+    parser.add_argument('--permutations', type=int, default=0, help='Number of permutations for permutation p-values')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Processes computing the permutations')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the permutations')
+    args = parser.parse_args(argv)
+
+    from features import load_features
+
+    df = load_features(args.path)
+    start = time.monotonic()
+    results = test_battery(df, args.by, correction=args.correction, permutations=args.permutations,
+                           workers=args.workers, seed=args.seed)
+    for by, result in results.items():
+        kruskal = result['kruskal']
+        print(f"{by}: Kruskal-Wallis-Statistik {kruskal['statistic']:.3f}, P-Wert {kruskal['p_value']:.3g}"
+              + (f", Permutations-P-Wert {kruskal['permutation_p_value']:.3g}" if args.permutations else ''))
+        significant = result['pairs'][result['pairs']['significant']]
+        for _, pair in significant.iterrows():
+            print(f"    {pair['Group1']} vs. {pair['Group2']}: adjusted p {pair['adjusted_p_value']:.3g}")
+    print(f"------------------ {len(results)} factors tested in {time.monotonic() - start:.2f}s ------------------")
+
+
+if __name__ == "__main__":
+    main()
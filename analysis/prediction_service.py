@@ -0,0 +1,283 @@
+import argparse
+import bisect
+import http.client
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import numpy as np
+
+# Local HTTP service for the price model exported by regression.py (python regression.py --export
+# price_model.json). It only needs numpy: the encoding, polynomial terms, standardization and coefficients
+# are applied directly, and the weather and stock inputs are looked up in memory by airport or airline and
+# date, so a request does not load pandas or scikit-learn.
+#
+#   GET  /health
+#   GET  /predict?airline=Lufthansa&departure_airport=FRA&destination_airport=JFK&date=2024-10-01&transit=false&travel_duration=08:45
+#   POST /predict   {"airline": ..., ...} or {"flights": [{...}, {...}]}
+
+MODEL_FILE = 'price_model.json'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8000
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+# Request fields that are accepted for the features of the model
+ALIASES = {
+    'airline_name': ['airline_name', 'airline'],
+    'departure_airport': ['departure_airport', 'departure', 'origin'],
+    'destination_airport': ['destination_airport', 'destination'],
+}
+
+
+def parse_minutes(value):
+    """ Minutes of 'HH:MM' or of a number of minutes """
+    if isinstance(value, str) and ':' in value:
+        hours, minutes = value.split(':')
+        return int(hours) * 60 + int(minutes)
+    return float(value)
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'ja')
+    return bool(value)
+
+
+class DailyLookup:
+    """ Values by key and date; a missing date gets the last earlier date of the key, else its first date """
+
+    def __init__(self, table):
+        self.days = {key: sorted(days) for key, days in table.items()}
+        self.values = {key: [days[day] for day in self.days[key]] for key, days in table.items()}
+
+    def get(self, key, day):
+        days = self.days.get(key)
+        if not days:
+            return None
+        position = bisect.bisect_right(days, day) - 1
+        return self.values[key][max(position, 0)]
+
+
+class PriceModel:
+    """
+    The exported model, ready to predict.
+
+    Parameters:
+        exported (dict): The content of the file written by regression.export_model.
+    """
+
+    def __init__(self, exported):
+        self.exported = exported
+        self.features = exported['features']
+        self.encoding = exported['encoding']
+        self.categories = exported.get('categories', {})
+        self.powers = np.array(exported['powers'], dtype='float64') if exported['degree'] > 1 else None
+        self.mean = np.array(exported['mean'])
+        self.scale = np.array(exported['scale'])
+        self.coefficients = np.array(exported['coefficients'])
+        self.intercept = exported['intercept']
+        self.weather_columns = exported['weather_columns']
+        self.weather = {side: DailyLookup(table) for side, table in exported['weather'].items()}
+        self.stock_columns = exported['stock_columns']
+        self.stocks = DailyLookup(exported['stocks'])
+
+    @classmethod
+    def load(cls, path=MODEL_FILE):
+        with open(path, encoding='utf-8') as file:
+            return cls(json.load(file))
+
+    def feature_values(self, request):
+        """
+        Derives the features of one flight from a request.
+
+        The airline, the airports (or 'route' as 'FRA-JFK') and the date are required. The weekday follows from
+        the date, durations can be given as 'HH:MM' or as *_minutes, and weather and stock values that are not
+        given are looked up for the airports, the airline and the date.
+        """
+        values = {}
+        for feature, names in ALIASES.items():
+            value = next((request[name] for name in names if request.get(name) not in (None, '')), None)
+            if value is not None:
+                values[feature] = str(value)
+        if 'route' in request and '-' in str(request['route']):
+            values['departure_airport'], values['destination_airport'] = str(request['route']).split('-', 1)
+        day = request.get('date')
+        if day:
+            day = str(day)[:10]
+            values['weekday'] = WEEKDAYS[datetime.strptime(day, '%Y-%m-%d').weekday()]
+        if request.get('weekday'):
+            values['weekday'] = str(request['weekday'])
+
+        values['transit'] = parse_bool(request.get('transit', False))
+        for name in ('travel_duration', 'transit_duration', 'departure_time', 'arrival_time'):
+            for key in (f'{name}_minutes', name):
+                if request.get(key) not in (None, ''):
+                    values[f'{name}_minutes'] = parse_minutes(request[key])
+                    break
+        if not values['transit']:
+            values.setdefault('transit_duration_minutes', 0.0)
+
+        for side, columns in self.weather_columns.items():
+            found = self.weather[side].get(values.get(f'{side}_airport'), day) if day else None
+            for position, name in enumerate(columns):
+                if request.get(name) not in (None, ''):
+                    values[name] = float(request[name])
+                elif found is not None:
+                    values[name] = found[position]
+        found = self.stocks.get(values.get('airline_name'), day) if day else None
+        for position, column in enumerate(self.stock_columns):
+            if request.get(column) not in (None, ''):
+                values[column] = float(request[column])
+            else:
+                # Airlines without stock data were trained with 0
+                values[column] = found[position] if found is not None else 0.0
+        return values
+
+    def encode(self, request):
+        """ Returns the row of the design matrix of one request """
+        values = self.feature_values(request)
+        # An unknown category would be encoded like the dropped first category without any warning
+        for feature, known in self.categories.items():
+            if feature in values and values[feature] not in known:
+                raise ValueError(f"Unknown {feature} {values[feature]!r}, the model knows {', '.join(known)}")
+        missing = [feature for feature in self.features if feature not in values]
+        if missing:
+            raise ValueError(f"Missing input: {', '.join(missing)}")
+        return [float(values[column['feature']] == column['equals']) if 'equals' in column
+                else float(values[column['feature']]) for column in self.encoding]
+
+    def predict(self, requests):
+        """ Returns the expected prices of a list of requests """
+        matrix = np.array([self.encode(request) for request in requests], dtype='float64').reshape(-1, len(self.encoding))
+        if self.powers is not None:
+            matrix = np.prod(matrix[:, None, :] ** self.powers[None, :, :], axis=2)
+        return ((matrix - self.mean) / self.scale) @ self.coefficients + self.intercept
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # Keeps connections open, so clients do not pay a new connection per request, and sends small answers
+    # right away instead of waiting for the acknowledgement of the headers
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    model = None
+    quiet = True
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, content):
+        if isinstance(content, list) or 'flights' in content:
+            flights = content if isinstance(content, list) else content['flights']
+            return {'prices': [round(float(price), 2) for price in self.model.predict(flights)]}
+        return {'price': round(float(self.model.predict([content])[0]), 2)}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self.send_json(200, {'status': 'ok', 'model': self.model.exported['model'],
+                                 'degree': self.model.exported['degree'], 'trained_on': self.model.exported['trained_on']})
+        elif url.path == '/predict':
+            self.respond(lambda: self.answer(dict(parse_qsl(url.query))))
+        else:
+            self.send_json(404, {'error': f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/predict':
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        self.respond(lambda: self.answer(json.loads(self.rfile.read(length) or b'{}')))
+
+    def respond(self, compute):
+        try:
+            self.send_json(200, compute())
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {'error': str(error)})
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def create_server(model, host=DEFAULT_HOST, port=DEFAULT_PORT, quiet=True):
+    """ Returns the HTTP server for a PriceModel, port 0 picks a free port """
+    handler = type('Handler', (PredictionHandler,), {'model': model, 'quiet': quiet})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def percentiles(latencies):
+    milliseconds = np.array(latencies) * 1000
+    return ', '.join(f"p{q} {np.percentile(milliseconds, q):.2f}ms" for q in (50, 95, 99))
+
+
+def benchmark(model, example, requests=1000, batch_size=100):
+    """
+    Measures the latency of single and batched predictions over HTTP with a server on a free local port.
+
+    Returns:
+        dict: The latencies in seconds of the single and of the batch requests.
+    """
+    server = create_server(model, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    latencies = {'single': [], 'batch': []}
+    try:
+        for name, body, count in [('single', example, requests),
+                                  ('batch', {'flights': [example] * batch_size}, max(requests // batch_size, 1))]:
+            payload = json.dumps(body).encode('utf-8')
+            for _ in range(count):
+                start = time.perf_counter()
+                connection.request('POST', '/predict', payload, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                latencies[name].append(time.perf_counter() - start)
+                if response.status != 200:
+                    raise RuntimeError(f"Prediction failed with status {response.status}")
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serves the exported price model over HTTP.')
+    parser.add_argument('--model', default=MODEL_FILE, help='The model exported by regression.py --export')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Host to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='REQUESTS',
+                        help='Measure the latency of this many requests instead of serving')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args(argv)
+
+    model = PriceModel.load(args.model)
+    if args.benchmark:
+        example = {'airline': 'Lufthansa', 'route': 'FRA-JFK', 'date': '2024-10-01', 'transit': False,
+                   'travel_duration': '08:45'}
+        latencies = benchmark(model, example, args.benchmark)
+        print(f"Single: {percentiles(latencies['single'])}")
+        print(f"Batch of 100: {percentiles(latencies['batch'])}")
+        print(f"------------------ {len(latencies['single']) + len(latencies['batch'])} requests measured ------------------")
+        return
+
+    server = create_server(model, args.host, args.port, quiet=not args.verbose)
+    print(f"------------------ Serving {args.model} on http://{args.host}:{server.server_address[1]} ------------------")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import argparse
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.model_selection import KFold, cross_validate
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+from features import load_features
+from schema import DEFAULT_DATASET
+
+# Model selection for the price regression of analysis.ipynb. The design matrix of every feature set and
+# polynomial degree (one-hot encoding and polynomial terms) is built once per version of the dataset and
+# stored, and the combinations of model, degree and feature set are cross-validated in parallel.
+
+TARGET = 'price'
+
+# The features of the regression in the notebook
+NOTEBOOK_FEATURES = [
+    'departure_time_minutes', 'arrival_time_minutes', 'travel_duration_minutes',
+    'tavg_departure', 'tavg_destination', 'Close', 'Volume',
+    'transit_duration_minutes', 'destination_category',
+    'wind_speed_group_simplified', 'close_cat_simplified', 'volume_cat_simplified'
+]
+FEATURE_SETS = {
+    'notebook': NOTEBOOK_FEATURES,
+    'flight': [
+        'departure_time_minutes', 'arrival_time_minutes', 'travel_duration_minutes', 'transit_duration_minutes',
+        'days_to_departure', 'airline_name', 'destination_category', 'weekday'
+    ],
+    'weather': [
+        'tavg_departure', 'tavg_destination', 'prcp_departure', 'prcp_destination',
+        'wspd_departure', 'wspd_destination'
+    ],
+}
+FEATURE_SETS['all'] = list(dict.fromkeys(FEATURE_SETS['notebook'] + FEATURE_SETS['flight'] + FEATURE_SETS['weather']))
+# Features the prediction service can derive from a request (see prediction_service.py)
+FEATURE_SETS['service'] = [
+    'airline_name', 'departure_airport', 'destination_airport', 'weekday', 'transit',
+    'travel_duration_minutes', 'transit_duration_minutes',
+    'tavg_departure', 'tavg_destination', 'prcp_destination', 'wspd_destination', 'Close', 'Volume'
+]
+# Airlines without stock data (Qatar Airways) get 0 for these, as in the notebook
+STOCK_FEATURES = ['Close', 'Volume']
+
+MODELS = {
+    'linear': LinearRegression,
+    'ridge': Ridge,
+}
+
+DEFAULT_DEGREES = [1, 2]
+DEFAULT_FOLDS = 5
+RESULTS_FILE = 'regression_results.csv'
+MODEL_FILE = 'price_model.json'
+
+
+def regression_frame(df):
+    """
+    Adds the simplified groups of the notebook that are used as regression features. Missing stock values
+    are 0, as in the notebook.
+
+    Returns:
+        pandas.DataFrame: The feature table with wind_speed_group_simplified, close_cat_simplified and
+                          volume_cat_simplified.
+    """
+    df = df.copy()
+    df[STOCK_FEATURES] = df[STOCK_FEATURES].astype('float64').fillna(0)
+    # Wind at the destination: Leicht and Mäßig (below 20 km/h) -> Niedrig-Mittel, Stark and Sehr Stark -> Hoch
+    wind = df['wspd_destination'].astype('float64')
+    df['wind_speed_group_simplified'] = pd.Categorical(
+        np.where(wind.isna(), None, np.where(wind < 20, 'Niedrig-Mittel', 'Hoch')), categories=['Niedrig-Mittel', 'Hoch'])
+    # Close in terciles: Niedrig and Mittel -> Niedrig/Mittel
+    close = df['Close'].astype('float64')
+    terciles = pd.qcut(close, q=3, labels=['Niedrig', 'Mittel', 'Hoch'])
+    df['close_cat_simplified'] = pd.Categorical(
+        np.where(terciles.isna(), None, np.where(terciles == 'Hoch', 'Hoch', 'Niedrig/Mittel')),
+        categories=['Niedrig/Mittel', 'Hoch'])
+    # Volume below its 0.33 quantile -> Niedrig, the others -> Nicht-Niedrig
+    volume = df['Volume'].astype('float64')
+    df['volume_cat_simplified'] = pd.Categorical(
+        np.where(volume.isna(), None, np.where(volume < volume.quantile(0.33), 'Niedrig', 'Nicht-Niedrig')),
+        categories=['Niedrig', 'Nicht-Niedrig'])
+    return df
+
+
+def design_version(feature_set):
+    """ Hash of the features of a feature set and of the code building its design matrix """
+    content = json.dumps(FEATURE_SETS[feature_set]) + inspect.getsource(regression_frame) + inspect.getsource(build_design)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def design_file(cache_dir, dataset_hash, feature_set, degree):
+    version = design_version(feature_set)
+    return os.path.join(cache_dir, f"{dataset_hash[:16]}_{version[:8]}_{feature_set}_degree{degree}.npz")
+
+
+def build_design(df, features, degree):
+    """
+    Builds the design matrix of a feature set as in the notebook: rows with missing values are dropped,
+    categories are one-hot encoded (drop_first=True), then the polynomial terms are added.
+
+    Returns:
+        tuple: The design matrix, the target and the names of the columns.
+    """
+    data = df[features + [TARGET]].dropna()
+    encoded = pd.get_dummies(data[features], drop_first=True).astype('float64')
+    if degree > 1:
+        polynomial = PolynomialFeatures(degree=degree, include_bias=False)
+        matrix = polynomial.fit_transform(encoded.to_numpy())
+        columns = polynomial.get_feature_names_out(encoded.columns)
+    else:
+        matrix, columns = encoded.to_numpy(), encoded.columns.to_numpy()
+    return matrix, data[TARGET].to_numpy(dtype='float64'), np.asarray(columns, dtype=str)
+
+
+def cached_design(df, dataset_hash, feature_set, degree, cache_dir):
+    """
+    Returns the file of the design matrix of a feature set and degree, built if it is not stored yet.
+
+    The file name contains the hash of the dataset and of the feature list and preprocessing code, so
+    matrices of an older dataset or built by older code are never used.
+    """
+    path = design_file(cache_dir, dataset_hash, feature_set, degree)
+    if not os.path.exists(path):
+        matrix, target, columns = build_design(df, FEATURE_SETS[feature_set], degree)
+        temporary = path + '.tmp.npz'
+        np.savez(temporary, X=matrix, y=target, columns=columns)
+        os.replace(temporary, path)
+    return path
+
+
+def evaluate(path, model, feature_set, degree, folds):
+    """
+    Cross-validates one model on a stored design matrix. The features are standardized inside every fold,
+    like the StandardScaler of the notebook but without using the test fold.
+
+    Returns:
+        dict: One row of the results table.
+    """
+    with np.load(path) as design:
+        matrix, target = design['X'], design['y']
+    pipeline = make_pipeline(StandardScaler(), MODELS[model]())
+    start = time.monotonic()
+    scores = cross_validate(pipeline, matrix, target, cv=KFold(folds), scoring=('neg_mean_squared_error', 'r2'))
+    return {
+        'model': model,
+        'feature_set': feature_set,
+        'degree': degree,
+        'rows': matrix.shape[0],
+        'columns': matrix.shape[1],
+        'cv_mse': -scores['test_neg_mean_squared_error'].mean(),
+        'cv_mse_std': scores['test_neg_mean_squared_error'].std(),
+        'cv_r2': scores['test_r2'].mean(),
+        'fit_time': scores['fit_time'].mean(),
+        'score_time': scores['score_time'].mean(),
+        'total_time': time.monotonic() - start
+    }
+
+
+def run_grid(path=DEFAULT_DATASET, models=list(MODELS), degrees=DEFAULT_DEGREES, feature_sets=list(FEATURE_SETS),
+             folds=DEFAULT_FOLDS, jobs=-1, cache_dir=None):
+    """
+    Cross-validates every combination of model, degree and feature set.
+
+    Parameters:
+        path (str): The analysis dataset as CSV.
+        models (list): Names of MODELS.
+        degrees (list): Degrees of the polynomial features, 1 for the features only.
+        feature_sets (list): Names of FEATURE_SETS.
+        folds (int): The number of folds, 5 as in the notebook.
+        jobs (int): The number of processes, all cores if -1.
+        cache_dir (str): The folder of the design matrices, 'regression_cache' next to the dataset if not given.
+
+    Returns:
+        pandas.DataFrame: One row per combination, sorted by the cross-validated MSE.
+    """
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), 'regression_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    df = regression_frame(load_features(path))
+    dataset_hash = df.attrs['source']['sha256']
+
+    designs = {(feature_set, degree): cached_design(df, dataset_hash, feature_set, degree, cache_dir)
+               for feature_set, degree in itertools.product(feature_sets, degrees)}
+    results = Parallel(n_jobs=jobs)(
+        delayed(evaluate)(designs[feature_set, degree], model, feature_set, degree, folds)
+        for model, feature_set, degree in itertools.product(models, feature_sets, degrees)
+    )
+    return pd.DataFrame(results).sort_values('cv_mse', ignore_index=True)
+
+
+def latest_values(df, keys, columns):
+    """ Returns key -> date -> values of the last row of every key and date, without missing values """
+    table = df[keys + ['date'] + columns].dropna().drop_duplicates(keys + ['date'], keep='last')
+    lookup = {}
+    for row in table.itertuples(index=False):
+        key = row[0] if len(keys) == 1 else tuple(row[:len(keys)])
+        lookup.setdefault(str(key), {})[row[len(keys)].strftime('%Y-%m-%d')] = [float(value) for value in row[len(keys) + 1:]]
+    return lookup
+
+
+def export_model(path=DEFAULT_DATASET, output=MODEL_FILE, model='ridge', degree=1, feature_set='service'):
+    """
+    Fits a model on the complete dataset and exports it with everything needed to predict without pandas
+    and scikit-learn: the encoding of the features, the polynomial terms, the standardization, the
+    coefficients, and the weather and stock values by airport or airline and date for the lookups.
+
+    Returns:
+        dict: The exported model, also written to output as JSON.
+    """
+    df = regression_frame(load_features(path))
+    features = FEATURE_SETS[feature_set]
+    matrix, target, columns = build_design(df, features, 1)
+
+    # Every encoded column is a feature or a feature being equal to a category (get_dummies)
+    encoding = []
+    for column in columns:
+        if column in features:
+            encoding.append({'feature': column})
+        else:
+            feature = next(feature for feature in features if column.startswith(feature + '_'))
+            encoding.append({'feature': feature, 'equals': column[len(feature) + 1:]})
+    # All categories seen in training, including the first one dropped by the encoding
+    data = df[features + [TARGET]].dropna()
+    categories = {feature: [column[len(feature) + 1:] for column in pd.get_dummies(data[[feature]]).columns]
+                  for feature in features if feature not in columns}
+
+    polynomial = PolynomialFeatures(degree=degree, include_bias=False).fit(matrix)
+    pipeline = make_pipeline(StandardScaler(), MODELS[model]()).fit(polynomial.transform(matrix), target)
+    scaler, estimator = pipeline[0], pipeline[-1]
+
+    # Weather by airport and date, for the weather features of the model on each side of the flight
+    weather_columns, weather = {}, {}
+    for side in ('departure', 'destination'):
+        columns = [feature for feature in features if feature.endswith(f'_{side}')]
+        if columns:
+            weather_columns[side] = columns
+            weather[side] = latest_values(df, [f'{side}_airport'], columns)
+
+    exported = {
+        'model': model,
+        'degree': degree,
+        'feature_set': feature_set,
+        'features': features,
+        'encoding': encoding,
+        'categories': categories,
+        'powers': polynomial.powers_.tolist(),
+        'mean': scaler.mean_.tolist(),
+        'scale': scaler.scale_.tolist(),
+        'coefficients': estimator.coef_.tolist(),
+        'intercept': float(estimator.intercept_),
+        'weather_columns': weather_columns,
+        'weather': weather,
+        'stock_columns': STOCK_FEATURES,
+        'stocks': latest_values(df, ['airline_name'], STOCK_FEATURES),
+        'trained_on': {'rows': int(len(target)), 'dataset_sha256': df.attrs['source']['sha256']}
+    }
+    temporary = output + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(exported, file, separators=(',', ':'))
+    os.replace(temporary, output)
+    return exported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cross-validates price regressions for several models, degrees and feature sets.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_DATASET, help='The analysis dataset as CSV')
+    parser.add_argument('--models', nargs='+', default=None, choices=list(MODELS),
+                        help='Models (default: all for the grid, ridge for --export)')
+    parser.add_argument('--degrees', nargs='+', type=int, default=DEFAULT_DEGREES, help='Degrees of the polynomial features')
+    parser.add_argument('--feature-sets', nargs='+', default=list(FEATURE_SETS), choices=list(FEATURE_SETS), help='Feature sets')
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS, help='Number of cross-validation folds')
+    parser.add_argument('--jobs', type=int, default=-1, help='Number of processes (default: all cores)')
+    parser.add_argument('--output', default=RESULTS_FILE, help='File of the results table')
+    parser.add_argument('--export', default=None, metavar='FILE',
+                        help='Instead of the grid, export the first model and degree on the service features to FILE')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    if args.export:
+        exported = export_model(args.path, args.export, args.models[0] if args.models else 'ridge', args.degrees[0])
+        print(f"{exported['model']} (degree {exported['degree']}) trained on {exported['trained_on']['rows']} flights")
+        print(f"------------------ Model exported to {args.export} in {time.monotonic() - start:.2f}s ------------------")
+        return
+    results = run_grid(args.path, args.models or list(MODELS), args.degrees, args.feature_sets, args.folds, args.jobs)
+    temporary = args.output + '.tmp'
+    results.to_csv(temporary, index=False)
+    os.replace(temporary, args.output)
+    print(results[['model', 'feature_set', 'degree', 'columns', 'cv_mse', 'cv_r2', 'fit_time']].to_string(index=False))
+    print(f"------------------ {len(results)} models evaluated in {time.monotonic() - start:.2f}s, saved {args.output} ------------------")
+
+
+if __name__ == "__main__":
+    main()
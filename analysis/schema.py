@@ -0,0 +1,210 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Canonical schema of the analysis dataset. analysis_dataset.csv holds every value as text, so pandas loads
+# names as strings, times and durations as 'HH:MM' strings that the notebook converted row by row, and the
+# stock volume as float64. The typed frame uses categoricals, integer minutes, float32 and dates instead
+# and is stored next to the CSV, so later loads skip the parsing.
+
+DEFAULT_DATASET = 'analysis_dataset.csv'
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+CATEGORY_COLUMNS = ['airline_name', 'departure_airport', 'destination_airport']
+DATE_COLUMNS = ['crawling_date', 'date']
+# 'HH:MM' columns -> integer minutes (durations) or minutes since midnight (clock times)
+MINUTE_COLUMNS = {
+    'travel_duration': 'travel_duration_minutes',
+    'transit_duration': 'transit_duration_minutes',
+    'departure_time': 'departure_time_minutes',
+    'arrival_time': 'arrival_time_minutes',
+}
+WEATHER_COLUMNS = [
+    f'{field}_{suffix}'
+    for suffix in ('departure', 'destination')
+    for field in ('tavg', 'tmin', 'tmax', 'prcp', 'wdir', 'wspd', 'wpgt', 'pres')
+]
+STOCK_PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+SCHEMA = {
+    'airline_name': 'category',
+    'crawling_date': 'datetime64[ns]',
+    'departure_airport': 'category',
+    'destination_airport': 'category',
+    'date': 'datetime64[ns]',
+    'weekday': pd.CategoricalDtype(WEEKDAYS, ordered=True),
+    'transit': 'boolean',
+    'travel_duration_minutes': 'Int16',
+    'transit_duration_minutes': 'Int16',
+    'departure_time_minutes': 'Int16',
+    'arrival_time_minutes': 'Int16',
+    'price': 'float32',
+    **{column: 'float32' for column in WEATHER_COLUMNS + STOCK_PRICE_COLUMNS},
+    'Volume': 'UInt32',
+}
+
+
+def typed_file(path):
+    """ Returns the file of the typed frame of a dataset, e.g. 'analysis_dataset.pkl' """
+    return os.path.splitext(path)[0] + '.pkl'
+
+
+def parse_unique(values, parse):
+    """
+    Applies a parser to the distinct values only and maps the result back to all rows. Weather, stock
+    and time values repeat a lot, so this keeps the string operations small for large datasets.
+    """
+    codes, uniques = pd.factorize(values.astype('string'), use_na_sentinel=True)
+    parsed = parse(pd.Series(uniques, dtype='string')).to_numpy(dtype='float64', na_value=np.nan)
+    result = np.full(len(codes), np.nan)
+    result[codes >= 0] = parsed[codes[codes >= 0]]
+    return pd.Series(result, index=values.index)
+
+
+def parse_minutes(values):
+    """
+    Vectorized conversion of 'HH:MM' texts into minutes, replacing convert_to_minutes of the notebook.
+
+    Returns:
+        pandas.Series: The minutes as Int16, missing where the text is no time (e.g. '-').
+    """
+    def parse(texts):
+        parts = texts.str.extract(r'^\s*(\d+):(\d{2})')
+        return pd.to_numeric(parts[0]) * 60 + pd.to_numeric(parts[1])
+
+    return parse_unique(values, parse).astype('Int16')
+
+
+def parse_numbers(values):
+    """
+    Vectorized version of clean_numeric_string of the notebook: commas and spaces are removed and only the
+    last dot is kept as decimal point. Values without a number, such as the '-' of a failed crawl, are missing.
+    """
+    def parse(texts):
+        # Plain numbers need no cleaning, only the others go through the string operations
+        numbers = pd.to_numeric(texts, errors='coerce')
+        other = numbers.isna() & texts.notna()
+        if other.any():
+            text = texts[other].str.replace(r'[,\s]', '', regex=True)
+            text = text.str.replace(r'\.(?=.*\.)', '', regex=True)
+            numbers[other] = pd.to_numeric(text.str.replace(r'[^\d.\-]', '', regex=True), errors='coerce')
+        return numbers
+
+    return parse_unique(values, parse)
+
+
+def to_typed(df):
+    """
+    Converts the analysis dataset as read from the CSV into the typed frame.
+
+    Parameters:
+        df (pandas.DataFrame): The dataset with the columns of analysis_dataset.csv.
+
+    Returns:
+        pandas.DataFrame: The columns of SCHEMA, in this order and with these dtypes.
+    """
+    typed = pd.DataFrame(index=pd.RangeIndex(len(df)))
+    for column in CATEGORY_COLUMNS:
+        typed[column] = df[column].to_numpy()
+    for column in DATE_COLUMNS:
+        typed[column] = pd.to_datetime(df[column].to_numpy(), format='%Y-%m-%d', errors='coerce')
+    typed['weekday'] = typed['date'].dt.day_name()
+    typed['transit'] = df['transit'].astype('string').str.strip().map({'True': True, 'False': False}).to_numpy()
+    for column, minutes in MINUTE_COLUMNS.items():
+        typed[minutes] = parse_minutes(df[column]).to_numpy()
+    for column in ['price'] + WEATHER_COLUMNS + STOCK_PRICE_COLUMNS + ['Volume']:
+        values = df[column]
+        typed[column] = (values if pd.api.types.is_numeric_dtype(values) else parse_numbers(values)).to_numpy()
+    typed['Volume'] = typed['Volume'].round()
+    return typed.astype(SCHEMA)[list(SCHEMA)]
+
+
+def has_dtype(series, dtype):
+    if isinstance(dtype, str) and dtype == 'category':
+        # Any categories, they depend on the airlines and airports crawled
+        return isinstance(series.dtype, pd.CategoricalDtype)
+    return series.dtype == pd.api.types.pandas_dtype(dtype)
+
+
+def validate(df):
+    """ Raises a ValueError if a frame does not follow SCHEMA """
+    if list(df.columns) != list(SCHEMA):
+        raise ValueError(f"Columns {list(df.columns)} do not match the schema {list(SCHEMA)}")
+    wrong = [column for column, dtype in SCHEMA.items() if not has_dtype(df[column], dtype)]
+    if wrong:
+        raise ValueError(f"Columns with wrong dtype: {', '.join(f'{column} ({df[column].dtype})' for column in wrong)}")
+
+
+def write_typed(df, path):
+    """ Validates the typed frame and stores it, replacing an older version of the file """
+    validate(df)
+    temporary = path + '.tmp'
+    df.to_pickle(temporary)
+    os.replace(temporary, path)
+
+
+def read_raw(path=DEFAULT_DATASET):
+    """ Reads the CSV like the notebook did, with default dtypes and without the index column """
+    df = pd.read_csv(path)
+    return df.drop(columns=[column for column in df.columns if column.startswith('Unnamed:')])
+
+
+def load_analysis_dataset(path=DEFAULT_DATASET, refresh=False):
+    """
+    Returns the typed analysis dataset.
+
+    The typed frame is read from the file next to the CSV if it is newer than the CSV, otherwise it is built
+    from the CSV and stored.
+
+    Parameters:
+        path (str): The analysis dataset as CSV.
+        refresh (bool): Build the typed frame from the CSV even if it is up to date.
+
+    Returns:
+        pandas.DataFrame: The dataset with the columns and dtypes of SCHEMA.
+    """
+    cache = typed_file(path)
+    if not refresh and os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        df = pd.read_pickle(cache)
+        if list(df.columns) == list(SCHEMA):
+            return df
+    df = to_typed(pd.read_csv(path, dtype=str, keep_default_na=False))
+    write_typed(df, cache)
+    return df
+
+
+def memory_report(path=DEFAULT_DATASET):
+    """
+    Compares the memory of the dataset loaded with default dtypes and of the typed frame.
+
+    Returns:
+        dict: The number of rows and the memory of both frames in MB.
+    """
+    raw = read_raw(path)
+    typed = load_analysis_dataset(path, refresh=True)
+    raw_bytes = raw.memory_usage(deep=True).sum()
+    typed_bytes = typed.memory_usage(deep=True).sum()
+    return {
+        'rows': len(typed),
+        'default_mb': round(raw_bytes / 1024 ** 2, 3),
+        'typed_mb': round(typed_bytes / 1024 ** 2, 3),
+        'ratio': round(raw_bytes / typed_bytes, 1) if typed_bytes else np.nan
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds the typed analysis dataset and reports its memory.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_DATASET, help='The analysis dataset as CSV')
+    args = parser.parse_args(argv)
+
+    report = memory_report(args.path)
+    print(f"{report['rows']} rows: {report['default_mb']} MB with default dtypes, "
+          f"{report['typed_mb']} MB typed ({report['ratio']}x smaller)")
+    print(f"------------------ Saved {typed_file(args.path)} ------------------")
+
+
+if __name__ == "__main__":
+    main()
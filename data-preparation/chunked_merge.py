@@ -0,0 +1,150 @@
+import argparse
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from consolidate_flight_data import DEFAULT_OUTPUT as MERGED_FILE, FIELDNAMES
+from enrichment import (AIRLINE_MAPPING, CITY_MAPPING, DEFAULT_OUTPUT, DEFAULT_STOCKS, DEFAULT_WEATHER,
+                        OUTPUT_FIELDNAMES, STOCK_FIELDS, WEATHER_FIELDS, parse_flight_date)
+
+# Out-of-core version of the merge of merge_all_crawling_data.ipynb for large crawl histories. The crawler
+# dataset is read in chunks of a fixed number of rows and every chunk is joined and written on its own,
+# so the memory use depends on the chunk size and on the (small) weather and stock tables only, not on the
+# number of crawled flights.
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def load_weather(weather_file=DEFAULT_WEATHER):
+    """ Returns the weather data indexed by (IATA code, date), all values as text """
+    weather = pd.read_csv(weather_file, dtype=str, keep_default_na=False)
+    weather['City'] = weather['City'].replace(CITY_MAPPING)
+    return weather.drop_duplicates(['City', 'Date'], keep='last').set_index(['City', 'Date'])[WEATHER_FIELDS]
+
+
+def load_stocks(stocks_file=DEFAULT_STOCKS):
+    """ Returns the stock data indexed by (airline, date), all values as text """
+    stocks = pd.read_csv(stocks_file, dtype=str, keep_default_na=False)
+    return stocks.drop_duplicates(['Airline', 'Date'], keep='last').set_index(['Airline', 'Date'])[STOCK_FIELDS]
+
+
+def parse_dates(dates):
+    """
+    Returns the flight dates as 'YYYY-MM-DD', keeping unparsable values.
+
+    A chunk holds many flights but only a few distinct dates, so every distinct date is parsed once.
+    """
+    parsed = {}
+    for value in pd.unique(dates):
+        flight_date = parse_flight_date(value)
+        parsed[value] = flight_date.isoformat() if flight_date else value
+    return dates.map(parsed)
+
+
+def lookup(table, first, second):
+    """ Returns the rows of an indexed table for the given key columns, empty where a key is missing """
+    keys = pd.MultiIndex.from_arrays([first.to_numpy(), second.to_numpy()])
+    return table.reindex(keys).fillna('').reset_index(drop=True)
+
+
+def merge_chunk(chunk, weather, stocks):
+    """
+    Joins a chunk of the crawler dataset to the weather at both airports and the stock data of the airline.
+
+    Returns:
+        pandas.DataFrame: The chunk with the columns of the analysis dataset except the index column.
+    """
+    chunk = chunk[FIELDNAMES].reset_index(drop=True)
+    chunk['airline_name'] = chunk['airline_name'].replace(AIRLINE_MAPPING)
+    chunk['date'] = parse_dates(chunk['date'])
+
+    departure = lookup(weather, chunk['departure_airport'], chunk['date'])
+    departure.columns = [f'{field}_departure' for field in WEATHER_FIELDS]
+    destination = lookup(weather, chunk['destination_airport'], chunk['date'])
+    destination.columns = [f'{field}_destination' for field in WEATHER_FIELDS]
+    stock = lookup(stocks, chunk['airline_name'], chunk['date'])
+    return pd.concat([chunk, departure, destination, stock], axis=1)
+
+
+def chunked_merge(merged=MERGED_FILE, output=DEFAULT_OUTPUT, weather_file=DEFAULT_WEATHER, stocks_file=DEFAULT_STOCKS,
+                  chunk_size=DEFAULT_CHUNK_SIZE, trace_memory=False):
+    """
+    Builds the analysis dataset from the crawler dataset chunk by chunk.
+
+    The output is the same as a rebuild by enrichment.py: every flight with the weather and stock values
+    found for it, empty where none exist.
+
+    Parameters:
+        merged (str): The consolidated crawler dataset.
+        output (str): The analysis dataset to write.
+        weather_file (str): The combined weather data.
+        stocks_file (str): The combined stock data.
+        chunk_size (int): The number of flights processed at a time.
+        trace_memory (bool): Also measure the peak of the Python allocations with tracemalloc, which slows
+                             the merge down several times.
+
+    Returns:
+        dict: The number of rows and chunks, the duration, rows per second and the peak memory in MB as
+              maximum resident set size of the process and, if traced, as Python allocations.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.monotonic()
+    weather = load_weather(weather_file)
+    stocks = load_stocks(stocks_file)
+
+    rows = 0
+    chunks = 0
+    temporary = output + '.tmp'
+    reader = pd.read_csv(merged, dtype=str, keep_default_na=False, chunksize=chunk_size, encoding='utf-8')
+    for chunk in reader:
+        result = merge_chunk(chunk, weather, stocks)
+        result.insert(0, '', range(rows, rows + len(result)))
+        result[OUTPUT_FIELDNAMES].to_csv(temporary, mode='w' if chunks == 0 else 'a', header=chunks == 0,
+                                         index=False, lineterminator='\n')
+        rows += len(result)
+        chunks += 1
+    if chunks == 0:
+        pd.DataFrame(columns=OUTPUT_FIELDNAMES).to_csv(temporary, index=False, lineterminator='\n')
+    os.replace(temporary, output)
+
+    seconds = time.monotonic() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    # ru_maxrss is given in bytes on macOS and in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return {
+        'rows': rows,
+        'chunks': chunks,
+        'seconds': round(seconds, 2),
+        'rows_per_second': round(rows / seconds) if seconds else 0,
+        'peak_traced_mb': round(peak / 1024 ** 2, 1) if peak is not None else None,
+        'max_rss_mb': round(max_rss, 1)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds the analysis dataset from the crawler, weather and stock data in chunks.')
+    parser.add_argument('--merged', default=MERGED_FILE, help='The consolidated crawler dataset')
+    parser.add_argument('--weather', default=DEFAULT_WEATHER, help='The combined weather data')
+    parser.add_argument('--stocks', default=DEFAULT_STOCKS, help='The combined stock data')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='The analysis dataset to write')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Number of flights processed at a time')
+    parser.add_argument('--trace-memory', action='store_true', help='Also trace the Python allocations (slower)')
+    args = parser.parse_args(argv)
+
+    report = chunked_merge(args.merged, args.output, args.weather, args.stocks, args.chunk_size, args.trace_memory)
+    print(f"{report['rows']} rows in {report['chunks']} chunks, {report['seconds']}s ({report['rows_per_second']} rows/s)")
+    print(f"Peak memory: {report['max_rss_mb']} MB max RSS" +
+          (f", {report['peak_traced_mb']} MB traced allocations" if report['peak_traced_mb'] is not None else ''))
+    print(f"------------------ Saved {args.output} ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+# Incremental version of merge_flight_data.ipynb: the results files of the crawlers only grow, so every
+# source keeps a watermark (the byte offset up to which it has been consolidated) and a run only reads,
+# decodes and maps the rows appended since the previous run.
+
+DATA_DIR = 'data'
+DEFAULT_SOURCES = [
+    os.path.join(DATA_DIR, 'results_AustrianAirlines.csv'),
+    os.path.join(DATA_DIR, 'results_KLM.csv'),
+    os.path.join(DATA_DIR, 'results_Lufthansa.csv'),
+    os.path.join(DATA_DIR, 'results_QatarAirways.csv'),
+]
+DEFAULT_OUTPUT = os.path.join(DATA_DIR, 'cralwer_data_merged.csv')
+DEFAULT_STATE = os.path.join(DATA_DIR, 'consolidation_state.json')
+
+FIELDNAMES = [
+    'airline_name', 'crawling_date', 'departure_airport', 'destination_airport', 'date', 'travel_duration',
+    'departure_time', 'arrival_time', 'transit', 'transit_duration', 'price'
+]
+
+# Mapping for departure_airport and destination_airport, as in merge_flight_data.ipynb
+AIRPORT_MAPPING = {
+    'Frankfurt': 'FRA',
+    'Berlin': 'BER',
+    'Hamburg': 'HAM',
+    'München': 'MUC',
+    'Muenchen': 'MUC',
+    'Munich': 'MUC',
+    'London': 'LHR',
+    'Palma': 'PMI',
+    'Palma de Mallorca': 'PMI',
+    'Istanbul': 'SAW',
+    'IST': 'SAW',  # Qatar Airways lists both Istanbul airports, the dataset uses SAW throughout
+    'Dubai': 'DXB',
+    'New York': 'JFK',
+    'Shanghai': 'PVG'
+}
+
+# Number of bytes before the watermark that are compared to detect rewritten source files
+FINGERPRINT_BYTES = 256
+
+
+def decode_line(raw):
+    """
+    Decodes a line of a results file.
+
+    The files are written as UTF-8, but some rows were saved by other programs: 'München' then appears as
+    'MÃ¼nchen' (UTF-8 read as Windows-1252 and saved again) or as the single byte 0x9f (Mac Roman).
+
+    Parameters:
+        raw (bytes): The line as read from the file.
+
+    Returns:
+        str: The decoded line.
+    """
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        # Bytes 0x80-0x9f are umlauts in Mac Roman, but control characters in Latin-1
+        encoding = 'mac_roman' if re.search(rb'[\x80-\x9f]', raw) else 'cp1252'
+        return raw.decode(encoding)
+    if re.search('[ÃÂ]', text):
+        try:
+            return text.encode('cp1252').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return text
+
+
+def to_iata(airport):
+    """ Returns the IATA code of an airport name, names that are already codes are kept """
+    airport = airport.strip()
+    return AIRPORT_MAPPING.get(airport, airport)
+
+
+def format_crawling_date(value):
+    """ Returns the crawling date, written as 'YYYY-MM-DD' or 'DD-MM-YYYY' by the crawlers, as 'YYYY-MM-DD' """
+    for date_format in ('%Y-%m-%d', '%d-%m-%Y', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value.strip(), date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return ''
+
+
+def consolidate_row(row):
+    """
+    Brings a row of a results file into the form of the consolidated dataset.
+
+    Returns:
+        dict: The row with the columns of FIELDNAMES, or None if it is not a flight (e.g. an empty line).
+    """
+    row = {(key or '').strip(): (value or '') for key, value in row.items()}
+    if not row.get('airline_name'):
+        return None
+    consolidated = {field: row.get(field, '') for field in FIELDNAMES}
+    consolidated['crawling_date'] = format_crawling_date(consolidated['crawling_date'])
+    consolidated['departure_airport'] = to_iata(consolidated['departure_airport'])
+    consolidated['destination_airport'] = to_iata(consolidated['destination_airport'])
+    return consolidated
+
+
+def fingerprint(handle, offset):
+    """ Hashes the bytes right before the watermark, which change if the file was rewritten """
+    start = max(0, offset - FINGERPRINT_BYTES)
+    handle.seek(start)
+    return hashlib.sha1(handle.read(offset - start)).hexdigest()
+
+
+def read_new_rows(path, watermark):
+    """
+    Reads the rows appended to a results file since the watermark.
+
+    Parameters:
+        path (str): The results file.
+        watermark (dict): The state of the previous run of this source, None to read the whole file.
+
+    Returns:
+        tuple: (list of consolidated rows, new watermark), or (None, None) if the file was rewritten since
+               the watermark and has to be consolidated again from scratch.
+    """
+    with open(path, 'rb') as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if watermark is None:
+            header_line = handle.readline()
+            header = next(csv.reader([decode_line(header_line)]))
+            offset = handle.tell()
+        else:
+            header, offset = watermark['header'], watermark['offset']
+            if size < offset or fingerprint(handle, offset) != watermark['fingerprint']:
+                return None, None
+            handle.seek(offset)
+        data = handle.read()
+
+    # Only complete lines are consumed, a row that is still being written is left for the next run. A last
+    # row without line break is complete if it has all columns.
+    end = data.rfind(b'\n') + 1
+    rest = data[end:]
+    if rest.strip() and len(next(csv.reader([decode_line(rest)]))) == len(header):
+        end = len(data)
+
+    text = '\n'.join(decode_line(line) for line in data[:end].splitlines())
+    rows = [consolidate_row(row) for row in csv.DictReader(io.StringIO(text), fieldnames=header)]
+    rows = [row for row in rows if row is not None]
+
+    offset += end
+    with open(path, 'rb') as handle:
+        new_watermark = {'header': header, 'offset': offset, 'fingerprint': fingerprint(handle, offset)}
+    return rows, new_watermark
+
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as file:
+        return json.load(file)
+
+
+def save_state(state, state_file):
+    temporary = state_file + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temporary, state_file)
+
+
+def consolidate(sources=DEFAULT_SOURCES, output=DEFAULT_OUTPUT, state_file=DEFAULT_STATE, rebuild=False):
+    """
+    Appends the rows added to the results files since the last run to the consolidated dataset.
+
+    The consolidated dataset is rebuilt from all rows if requested, if there is no watermark for it yet,
+    or if a source was rewritten instead of appended to (e.g. by the normalization of the results files).
+
+    Parameters:
+        sources (list): The results files of the crawlers.
+        output (str): The consolidated dataset.
+        state_file (str): The file holding the watermark of every source.
+        rebuild (bool): Consolidate all rows from scratch.
+
+    Returns:
+        dict: {'rows': {source: number of new rows}, 'rebuilt': whether the dataset was rebuilt}
+    """
+    state = load_state(state_file)
+    if state.get('output') != output or not os.path.exists(output):
+        rebuild = True
+
+    if not rebuild:
+        batches = {}
+        watermarks = {}
+        for source in sources:
+            rows, watermark = read_new_rows(source, state.get('sources', {}).get(source))
+            if rows is None:
+                print(f"{source} was rewritten, consolidating all sources again")
+                rebuild = True
+                break
+            batches[source], watermarks[source] = rows, watermark
+
+    if rebuild:
+        batches, watermarks = {}, {}
+        for source in sources:
+            batches[source], watermarks[source] = read_new_rows(source, None)
+
+    # Sort the new rows by crawling date, like the notebook sorted the whole dataset
+    new_rows = sorted((row for rows in batches.values() for row in rows), key=lambda row: row['crawling_date'])
+    mode = 'w' if rebuild else 'a'
+    temporary = output + '.tmp' if rebuild else output
+    with open(temporary, mode, newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES, lineterminator='\n')
+        if rebuild:
+            writer.writeheader()
+        writer.writerows(new_rows)
+    if rebuild:
+        os.replace(temporary, output)
+
+    save_state({'output': output, 'sources': watermarks}, state_file)
+    return {'rows': {source: len(rows) for source, rows in batches.items()}, 'rebuilt': rebuild}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Appends new crawler results to the consolidated flight dataset.')
+    parser.add_argument('--sources', nargs='+', default=DEFAULT_SOURCES, help='Results files of the crawlers')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='The consolidated dataset')
+    parser.add_argument('--state', default=DEFAULT_STATE, help='File holding the watermark of every source')
+    parser.add_argument('--rebuild', action='store_true', help='Consolidate all rows from scratch')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    summary = consolidate(args.sources, args.output, args.state, args.rebuild)
+    for source, count in summary['rows'].items():
+        print(f"{source}: {count} new rows")
+    action = 'Rebuilt' if summary['rebuilt'] else 'Updated'
+    print(f"------------------ {action} {args.output} in {time.monotonic() - start:.2f}s ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import csv
+import os
+import time
+from datetime import datetime, timedelta
+
+from consolidate_flight_data import DATA_DIR, DEFAULT_OUTPUT as MERGED_FILE, FIELDNAMES, load_state, read_new_rows, save_state
+
+# Incremental version of merge_all_crawling_data.ipynb: instead of joining the whole crawler dataset to the
+# weather and stock data with pd.merge, the weather and stock series are loaded into dictionaries keyed by
+# (IATA code, date) and (airline, date), and every new flight is looked up in them. Flights whose weather or
+# stock data has not been published yet wait in a pending file and are added once the data has arrived.
+
+DEFAULT_WEATHER = os.path.join(DATA_DIR, 'combined_weather.csv')
+DEFAULT_STOCKS = os.path.join(DATA_DIR, 'combined_stocks.csv')
+DEFAULT_OUTPUT = os.path.join(DATA_DIR, 'analysis_dataset.csv')
+DEFAULT_PENDING = os.path.join(DATA_DIR, 'enrichment_pending.csv')
+DEFAULT_STATE = os.path.join(DATA_DIR, 'enrichment_state.json')
+
+WEATHER_FIELDS = ['tavg', 'tmin', 'tmax', 'prcp', 'wdir', 'wspd', 'wpgt', 'pres']
+STOCK_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+OUTPUT_FIELDNAMES = (
+    [''] + FIELDNAMES
+    + [f'{field}_departure' for field in WEATHER_FIELDS]
+    + [f'{field}_destination' for field in WEATHER_FIELDS]
+    + STOCK_FIELDS
+)
+
+# Mapping for city names in the weather data to airport codes
+CITY_MAPPING = {
+    'Frankfurt': 'FRA',
+    'Berlin': 'BER',
+    'Hamburg': 'HAM',
+    'München': 'MUC',
+    'Muenchen': 'MUC',
+    'Munich': 'MUC',
+    'London': 'LHR',
+    'Palma': 'PMI',
+    'Palma de Mallorca': 'PMI',
+    'Istanbul': 'SAW',
+    'Dubai': 'DXB',
+    'New York': 'JFK',
+    'New_York': 'JFK',
+    'Shanghai': 'PVG'
+}
+
+# No stock data is available for Austrian Airlines, it is analysed as part of the Lufthansa Group
+AIRLINE_MAPPING = {'AustrianAirlines': 'Lufthansa'}
+
+# Number of days after the flight date to wait for missing weather or stock data
+DEFAULT_MAX_WAIT_DAYS = 7
+
+
+def parse_flight_date(value):
+    """
+    Parses the flight date.
+
+    The crawlers write it as 'DD-MM-YYYY'. The notebook parsed it month first and then swapped day and month
+    back for all dates with day 8 (correct_date), which missed dates like '01-09-2024'; parsing day first
+    gives the right date for all of them.
+
+    Returns:
+        date: The flight date, or None if the value is no date.
+    """
+    for date_format in ('%d-%m-%Y', '%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+class EnrichmentIndex:
+    """
+    The weather and stock series in dictionaries for lookups by airport or airline and date.
+
+    Parameters:
+        weather_file (str): The combined weather data with one row per city and day.
+        stocks_file (str): The combined stock data with one row per airline and trading day.
+    """
+
+    def __init__(self, weather_file=DEFAULT_WEATHER, stocks_file=DEFAULT_STOCKS):
+        self.weather = {}
+        self.stocks = {}
+        with open(weather_file, 'r', newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                iata = CITY_MAPPING.get(row['City'], row['City'])
+                self.weather[(iata, row['Date'])] = {field: row.get(field, '') for field in WEATHER_FIELDS}
+        with open(stocks_file, 'r', newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                self.stocks[(row['Airline'], row['Date'])] = {field: row.get(field, '') for field in STOCK_FIELDS}
+        # Airports and airlines for which a series exists at all, the others never get data
+        self.weather_airports = {iata for iata, _ in self.weather}
+        self.stock_airlines = {airline for airline, _ in self.stocks}
+
+    def enrich(self, row):
+        """
+        Attaches the weather at both airports and the stock data of the airline to a flight.
+
+        Parameters:
+            row (dict): A row of the consolidated crawler dataset.
+
+        Returns:
+            tuple: (enriched row, whether all data that can exist for the flight was found)
+        """
+        enriched = dict(row)
+        enriched['airline_name'] = AIRLINE_MAPPING.get(row['airline_name'], row['airline_name'])
+        flight_date = parse_flight_date(row['date'])
+        date_key = flight_date.isoformat() if flight_date else row['date']
+        enriched['date'] = date_key
+        complete = flight_date is not None
+
+        for suffix, airport in (('departure', row['departure_airport']), ('destination', row['destination_airport'])):
+            weather = self.weather.get((airport, date_key))
+            if weather is None and airport in self.weather_airports:
+                complete = False
+            for field in WEATHER_FIELDS:
+                enriched[f'{field}_{suffix}'] = weather[field] if weather else ''
+
+        stock = self.stocks.get((enriched['airline_name'], date_key))
+        if stock is None and enriched['airline_name'] in self.stock_airlines:
+            complete = False
+        for field in STOCK_FIELDS:
+            enriched[field] = stock[field] if stock else ''
+        return enriched, complete
+
+
+def read_rows(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+def count_rows(path):
+    """ Returns the number of data rows of the analysis dataset, the next value of its index column """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as handle:
+        return max(sum(1 for line in handle if line.strip()) - 1, 0)
+
+
+def enrich(merged=MERGED_FILE, output=DEFAULT_OUTPUT, pending_file=DEFAULT_PENDING, state_file=DEFAULT_STATE,
+           weather_file=DEFAULT_WEATHER, stocks_file=DEFAULT_STOCKS, max_wait_days=DEFAULT_MAX_WAIT_DAYS,
+           today=None, rebuild=False):
+    """
+    Adds the flights consolidated since the last run and the pending flights whose data has arrived to the
+    analysis dataset.
+
+    Parameters:
+        merged (str): The consolidated crawler dataset.
+        output (str): The analysis dataset.
+        pending_file (str): Flights waiting for weather or stock data.
+        state_file (str): The file holding the watermark in the consolidated dataset.
+        weather_file (str): The combined weather data.
+        stocks_file (str): The combined stock data.
+        max_wait_days (int): Days after the flight date after which a flight is added with the data found so far.
+        today (date): The current date, for tests.
+        rebuild (bool): Build the analysis dataset from scratch.
+
+    Returns:
+        dict: The number of new, added and still pending flights and whether the dataset was rebuilt.
+    """
+    today = today or datetime.now().date()
+    state = load_state(state_file)
+    if state.get('output') != output or not os.path.exists(output):
+        rebuild = True
+
+    new_rows = None
+    if not rebuild:
+        new_rows, watermark = read_new_rows(merged, state.get('source'))
+        if new_rows is None:
+            print(f"{merged} was rewritten, enriching all flights again")
+            rebuild = True
+    if rebuild:
+        new_rows, watermark = read_new_rows(merged, None)
+        waiting = []
+    else:
+        waiting = [{field: row[field] for field in FIELDNAMES} for row in read_rows(pending_file)]
+
+    index = EnrichmentIndex(weather_file, stocks_file)
+    ready, pending = [], []
+    for row in waiting + new_rows:
+        enriched, complete = index.enrich(row)
+        flight_date = parse_flight_date(row['date'])
+        overdue = flight_date is None or today > flight_date + timedelta(days=max_wait_days)
+        if complete or overdue:
+            ready.append(enriched)
+        else:
+            pending.append(row)
+
+    start_index = 0 if rebuild else count_rows(output)
+    for offset, row in enumerate(ready):
+        row[''] = start_index + offset
+    temporary = output + '.tmp' if rebuild else output
+    with open(temporary, 'w' if rebuild else 'a', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=OUTPUT_FIELDNAMES, lineterminator='\n')
+        if rebuild:
+            writer.writeheader()
+        writer.writerows(ready)
+    if rebuild:
+        os.replace(temporary, output)
+
+    with open(pending_file + '.tmp', 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(pending)
+    os.replace(pending_file + '.tmp', pending_file)
+
+    save_state({'output': output, 'source': watermark}, state_file)
+    return {'new': len(new_rows), 'added': len(ready), 'pending': len(pending), 'rebuilt': rebuild}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Adds weather and stock data to the new flights and appends them to the analysis dataset.')
+    parser.add_argument('--merged', default=MERGED_FILE, help='The consolidated crawler dataset')
+    parser.add_argument('--weather', default=DEFAULT_WEATHER, help='The combined weather data')
+    parser.add_argument('--stocks', default=DEFAULT_STOCKS, help='The combined stock data')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='The analysis dataset')
+    parser.add_argument('--max-wait-days', type=int, default=DEFAULT_MAX_WAIT_DAYS,
+                        help='Days after the flight date to wait for missing weather or stock data')
+    parser.add_argument('--rebuild', action='store_true', help='Build the analysis dataset from scratch')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    summary = enrich(args.merged, args.output, weather_file=args.weather, stocks_file=args.stocks,
+                     max_wait_days=args.max_wait_days, rebuild=args.rebuild)
+    print(f"{summary['new']} new flights, {summary['added']} added to {args.output}, {summary['pending']} waiting for weather or stock data")
+    action = 'Rebuilt' if summary['rebuilt'] else 'Updated'
+    print(f"------------------ {action} {args.output} in {time.monotonic() - start:.2f}s ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date
+
+from consolidate_flight_data import load_state, save_state
+
+# The way from the crawler results to analysis/analysis_dataset.csv as one command. Every stage declares the
+# files it reads and writes and the code it runs; the order follows from these files. A stage only runs if
+# the hash of its inputs and code differs from its last successful run (or its outputs were changed since),
+# and stages that do not depend on each other (flights, weather, stocks) run at the same time. The stages
+# call the incremental scripts, so after a small change only the new rows are processed.
+#
+#   python pipeline.py                   # flights, weather and stocks as they are on disk
+#   python pipeline.py --fetch           # also fetch new weather and stock data (at most once a day)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_STATE = os.path.join(ROOT, 'data-preparation', 'data', 'pipeline_state.json')
+DEFAULT_WORKERS = 3
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class Stage:
+    """
+    One step of the pipeline. Paths are relative to the repository and separated by '/'.
+
+    Parameters:
+        name (str): The name of the stage.
+        inputs (list): The files the stage reads.
+        outputs (list): The files the stage writes.
+        code (list): The scripts and modules the stage runs.
+        command (list): The script and its arguments, run with the current Python in cwd.
+        cwd (str): The folder the command runs in.
+        copy (bool): Copy every input to the output at the same position instead of running a command.
+        volatile (str): Additional part of the cache key for stages that depend on more than files, e.g. the day
+                        for stages that download data.
+    """
+
+    def __init__(self, name, inputs, outputs, code=(), command=None, cwd=None, copy=False, volatile=None):
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.command = command
+        self.cwd = cwd
+        self.copy = copy
+        self.volatile = volatile
+
+
+def has_rows(path):
+    """ Whether a CSV file exists and has a row below its header """
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as file:
+        file.readline()
+        return bool(file.readline().strip())
+
+
+def pipeline_stages(fetch=False):
+    """
+    Returns the stages from the crawler results, weather and stock data to the analysis dataset.
+
+    Parameters:
+        fetch (bool): Also fetch new weather and stock data, else the combined files on disk are used.
+    """
+    results = [f"flight-crawlers/results/{os.path.basename(path)}"
+               for path in sorted(glob.glob(os.path.join(ROOT, 'flight-crawlers', 'results', 'results_*.csv')))]
+    collected = [f"data-preparation/data/{os.path.basename(path)}" for path in results]
+    sources = sorted(set(collected) | {f"data-preparation/data/results_{airline}.csv"
+                                       for airline in ('AustrianAirlines', 'KLM', 'Lufthansa', 'QatarAirways')})
+    weather, stocks = 'weather-stock-crawler/weather/combined_weather.csv', 'weather-stock-crawler/stocks/combined_stocks.csv'
+    merged = 'data-preparation/data/cralwer_data_merged.csv'
+    dataset = 'data-preparation/data/analysis_dataset.csv'
+    pending, enrichment_state = 'data-preparation/data/enrichment_pending.csv', 'data-preparation/data/enrichment_state.json'
+    today = date.today().isoformat()
+    # Flights waiting for weather or stock data are added after some days even without it, so enrich runs
+    # again every day while there are any
+    waiting = has_rows(os.path.join(ROOT, pending))
+
+    stages = [
+        Stage('collect_results', results, collected, copy=True),
+        Stage('consolidate', sources, [merged], ['data-preparation/consolidate_flight_data.py'],
+              ['consolidate_flight_data.py'], 'data-preparation'),
+    ]
+    if fetch:
+        stages += [
+            Stage('fetch_weather', [], [weather], ['weather-stock-crawler/weather_fetcher.py'],
+                  ['weather_fetcher.py'], 'weather-stock-crawler', volatile=today),
+            Stage('fetch_stocks', [], [stocks],
+                  ['weather-stock-crawler/stock_fetcher.py', 'weather-stock-crawler/weather_fetcher.py'],
+                  ['stock_fetcher.py'], 'weather-stock-crawler', volatile=today),
+        ]
+    stages += [
+        Stage('collect_weather', [weather], ['data-preparation/data/combined_weather.csv'], copy=True),
+        Stage('collect_stocks', [stocks], ['data-preparation/data/combined_stocks.csv'], copy=True),
+        Stage('enrich', [merged, 'data-preparation/data/combined_weather.csv', 'data-preparation/data/combined_stocks.csv'],
+              [dataset, pending, enrichment_state],
+              ['data-preparation/enrichment.py', 'data-preparation/consolidate_flight_data.py'],
+              ['enrichment.py'], 'data-preparation', volatile=today if waiting else None),
+        Stage('publish', [dataset], ['analysis/analysis_dataset.csv'], copy=True),
+    ]
+    return stages
+
+
+def dependencies(stages):
+    """
+    Returns stage name -> names of the stages writing one of its inputs.
+
+    Raises:
+        ValueError: If two stages write the same file or the stages depend on each other in a cycle.
+    """
+    writers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            if path in writers:
+                raise ValueError(f"{path} is written by {writers[path]} and {stage.name}")
+            writers[path] = stage.name
+    graph = {stage.name: sorted({writers[path] for path in stage.inputs if path in writers} - {stage.name})
+             for stage in stages}
+
+    # Every stage has to be reachable in an order without cycles
+    done, remaining = set(), dict(graph)
+    while remaining:
+        ready = [name for name, needed in remaining.items() if done.issuperset(needed)]
+        if not ready:
+            raise ValueError(f"Cycle between the stages {', '.join(sorted(remaining))}")
+        done.update(ready)
+        for name in ready:
+            del remaining[name]
+    return graph
+
+
+class FileHashes:
+    """
+    SHA-256 hashes of files, remembered with size and modification time so unchanged files are not read again.
+
+    Parameters:
+        known (dict): Path -> fingerprint of a previous run.
+    """
+
+    def __init__(self, known=None):
+        self.known = dict(known or {})
+
+    def get(self, path):
+        """ Returns the hash of a file relative to the repository, None if it does not exist """
+        full = os.path.join(ROOT, path)
+        if not os.path.exists(full):
+            self.known.pop(path, None)
+            return None
+        stat = os.stat(full)
+        previous = self.known.get(path)
+        if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+            return previous['sha256']
+        digest = hashlib.sha256()
+        with open(full, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        self.known[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+
+def stage_key(stage, hashes):
+    """ Returns the cache key of a stage: the hash of its command, code and inputs """
+    content = {
+        'command': stage.command, 'copy': stage.copy, 'volatile': stage.volatile,
+        'code': {path: hashes.get(path) for path in stage.code},
+        'inputs': {path: hashes.get(path) for path in stage.inputs},
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def copy_files(stage):
+    """ Copies every input of a copy stage to its output, files with the same content are left alone """
+    for source, target in zip(stage.inputs, stage.outputs):
+        source, target = os.path.join(ROOT, source), os.path.join(ROOT, target)
+        if not os.path.exists(source):
+            continue
+        if os.path.exists(target) and os.path.getsize(source) == os.path.getsize(target):
+            with open(source, 'rb') as first, open(target, 'rb') as second:
+                if first.read() == second.read():
+                    continue
+        temporary = target + '.tmp'
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+    return ''
+
+
+def run_stage(stage):
+    """ Runs a stage, returns its output """
+    if stage.copy:
+        return copy_files(stage)
+    process = subprocess.run([sys.executable] + stage.command, cwd=os.path.join(ROOT, stage.cwd),
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(stage.command)} failed with exit code {process.returncode}:\n"
+                           f"{process.stderr.strip() or process.stdout.strip()}")
+    return process.stdout
+
+
+def run_pipeline(stages, state_file=DEFAULT_STATE, workers=DEFAULT_WORKERS, force=False):
+    """
+    Runs every stage whose inputs, code or outputs changed since its last successful run.
+
+    Stages are started as soon as all stages writing their inputs are done, at most workers at a time. If a
+    stage fails, the stages depending on it are not run; the others continue.
+
+    Parameters:
+        stages (list): The stages, e.g. of pipeline_stages().
+        state_file (str): The file holding the cache keys and file hashes of the last runs.
+        workers (int): The number of stages running at the same time.
+        force (bool): Run all stages, even unchanged ones.
+
+    Returns:
+        dict: Stage name -> 'ran', 'skipped', 'failed' or 'blocked'.
+    """
+    graph = dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    state = load_state(state_file)
+    hashes = FileHashes(state.get('files'))
+    runs = state.get('stages', {})
+    status, errors, running = {}, {}, {}
+
+    def start(executor, name):
+        stage = by_name[name]
+        key = stage_key(stage, hashes)
+        previous = runs.get(name)
+        unchanged = (previous and previous['key'] == key
+                     and all(hashes.get(path) == previous['outputs'].get(path) for path in stage.outputs))
+        if unchanged and not force:
+            status[name] = 'skipped'
+            print(f"{name}: unchanged")
+            return
+        print(f"{name}: running")
+        running[executor.submit(run_stage, stage)] = (name, key, time.monotonic())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(status) < len(stages):
+            for name, needed in graph.items():
+                if name in status or any(entry[0] == name for entry in running.values()):
+                    continue
+                if any(status.get(other) in ('failed', 'blocked') for other in needed):
+                    status[name] = 'blocked'
+                elif all(other in status for other in needed):
+                    start(executor, name)
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, key, started = running.pop(future)
+                try:
+                    output = future.result()
+                except (OSError, RuntimeError) as error:
+                    status[name], errors[name] = 'failed', str(error)
+                    runs.pop(name, None)
+                    print(f"{name}: failed\n    " + str(error).replace('\n', '\n    '))
+                    continue
+                status[name] = 'ran'
+                runs[name] = {'key': key, 'outputs': {path: hashes.get(path) for path in by_name[name].outputs}}
+                last_line = output.strip().splitlines()[-1] if output.strip() else 'done'
+                print(f"{name}: {last_line} ({time.monotonic() - started:.2f}s)")
+            save_state({'stages': runs, 'files': hashes.known}, state_file)
+
+    save_state({'stages': runs, 'files': hashes.known}, state_file)
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Builds analysis/analysis_dataset.csv from the crawler, weather and stock data, skipping unchanged stages.')
+    parser.add_argument('--fetch', action='store_true', help='Also fetch new weather and stock data')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of stages running at the same time')
+    parser.add_argument('--force', action='store_true', help='Run all stages, even unchanged ones')
+    parser.add_argument('--state', default=DEFAULT_STATE, help='File holding the cache of the stages')
+    parser.add_argument('--list', action='store_true', help='Only list the stages and their dependencies')
+    args = parser.parse_args(argv)
+
+    stages = pipeline_stages(args.fetch)
+    if args.list:
+        for name, needed in dependencies(stages).items():
+            print(f"{name}" + (f" (after {', '.join(needed)})" if needed else ''))
+        return
+
+    start = time.monotonic()
+    status = run_pipeline(stages, args.state, args.workers, args.force)
+    counts = {result: list(status.values()).count(result) for result in ('ran', 'skipped', 'failed', 'blocked')}
+    print(f"------------------ {counts['ran']} stages run, {counts['skipped']} unchanged, "
+          f"{counts['failed'] + counts['blocked']} failed in {time.monotonic() - start:.2f}s ------------------")
+    if counts['failed'] or counts['blocked']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import bisect
+import json
+import os
+import re
+import time
+from datetime import date
+
+from consolidate_flight_data import DATA_DIR, DEFAULT_OUTPUT as MERGED_FILE, read_new_rows
+from enrichment import parse_flight_date
+
+# Price history of every flight: one series per (airline, origin, destination, departure date) with the
+# prices observed on the crawl dates. Crawl dates are stored as runs of consecutive days and prices only
+# where they change, so a series crawled daily for two months with three price changes is a handful of
+# numbers. New crawler results are read from the consolidated dataset with a watermark, as in enrichment.py.
+
+DEFAULT_STORE = os.path.join(DATA_DIR, 'price_history.json')
+
+SEPARATOR = '|'
+# Stores of another version are built again, e.g. after a change of how prices are read
+VERSION = 2
+
+# Everything that is not part of a number, and the split of a price at its last separator
+PRICE_JUNK = re.compile(r'[^\d.,\-]')
+PRICE_PARTS = re.compile(r'^(.*?)(?:([.,])(\d*))?$')
+
+
+def series_key(airline, origin, destination, departure):
+    """ Key of a series, e.g. 'QatarAirways|FRA|DXB|2024-09-10' """
+    return SEPARATOR.join([airline, origin, destination, departure.isoformat()])
+
+
+def split_key(key):
+    airline, origin, destination, departure = key.split(SEPARATOR)
+    return airline, origin, destination, date.fromisoformat(departure)
+
+
+def parse_price(value):
+    """
+    Returns the price of the consolidated dataset as float, None if there is none.
+
+    The separators are read as in flight-crawlers/normalization.py: the last one is the decimal separator,
+    unless exactly three digits follow it, so '1.186' (Qatar Airways) and '1,186' are 1186 and '901.0' is 901.
+    """
+    try:
+        integer, separator, fraction = PRICE_PARTS.match(PRICE_JUNK.sub('', value)).groups()
+        if separator is None:
+            return float(integer)
+        other = ',' if separator == '.' else '.'
+        digits = re.sub(r'[.,]', '', integer)
+        if len(fraction) != 3 or other in integer:
+            return float(f"{digits or '0'}.{fraction or '0'}")
+        return float(digits + fraction)
+    except (TypeError, ValueError):
+        return None
+
+
+def encode(days, prices):
+    """
+    Delta-encodes the observations of a series.
+
+    Parameters:
+        days (list): The crawl days as ordinals, sorted and unique.
+        prices (list): The price of every crawl day.
+
+    Returns:
+        list: [day runs, price changes]: [first day, number of consecutive days] for every run of crawl days,
+              and [index of the observation, new price] for the first observation and every change.
+    """
+    runs, changes = [], []
+    for index, (day, price) in enumerate(zip(days, prices)):
+        if runs and day == runs[-1][0] + runs[-1][1]:
+            runs[-1][1] += 1
+        else:
+            runs.append([day, 1])
+        if not changes or changes[-1][1] != price:
+            changes.append([index, price])
+    return [runs, changes]
+
+
+def decode(encoded):
+    """ Returns the crawl days (ordinals) and prices of an encoded series """
+    runs, changes = encoded
+    days = [start + offset for start, length in runs for offset in range(length)]
+    prices = []
+    for position, (index, price) in enumerate(changes):
+        end = changes[position + 1][0] if position + 1 < len(changes) else len(days)
+        prices.extend([price] * (end - index))
+    return days, prices
+
+
+class PriceHistory:
+    """
+    The series of all flights, with an index of the departure dates of every route for range queries.
+
+    Parameters:
+        series (dict): Key -> encoded series.
+        watermark (dict): The position up to which the consolidated dataset has been read.
+    """
+
+    def __init__(self, series=None, watermark=None, source=None, version=VERSION):
+        self.series = series or {}
+        self.watermark = watermark
+        self.source = source
+        self.version = version
+        self.routes = {}
+        for key in self.series:
+            self.index(key)
+
+    def index(self, key):
+        airline, origin, destination, departure = split_key(key)
+        departures = self.routes.setdefault((airline, origin, destination), [])
+        position = bisect.bisect_left(departures, departure)
+        if position == len(departures) or departures[position] != departure:
+            departures.insert(position, departure)
+
+    def add(self, airline, origin, destination, departure, crawl_day, price):
+        """
+        Adds an observation. Several offers of a flight on one crawl day (e.g. with different transits) are
+        stored as the cheapest one.
+        """
+        key = series_key(airline, origin, destination, departure)
+        day = crawl_day.toordinal()
+        encoded = self.series.get(key)
+        if encoded is None:
+            self.series[key] = encode([day], [price])
+            self.index(key)
+            return
+        runs, changes = encoded
+        last_day = runs[-1][0] + runs[-1][1] - 1
+        if day > last_day:
+            # Observations arrive in crawl order, so this is the usual case
+            count = sum(length for _, length in runs)
+            if day == last_day + 1:
+                runs[-1][1] += 1
+            else:
+                runs.append([day, 1])
+            if changes[-1][1] != price:
+                changes.append([count, price])
+            return
+        days, prices = decode(encoded)
+        position = bisect.bisect_left(days, day)
+        if position < len(days) and days[position] == day:
+            prices[position] = min(prices[position], price)
+        else:
+            days.insert(position, day)
+            prices.insert(position, price)
+        self.series[key] = encode(days, prices)
+
+    def add_rows(self, rows):
+        """ Adds the rows of the consolidated dataset, returns the number of observations """
+        added = 0
+        for row in sorted(rows, key=lambda row: row['crawling_date']):
+            departure, crawl_day = parse_flight_date(row['date']), parse_flight_date(row['crawling_date'])
+            price = parse_price(row['price'])
+            if departure is None or crawl_day is None or price is None:
+                continue
+            self.add(row['airline_name'], row['departure_airport'], row['destination_airport'], departure, crawl_day, price)
+            added += 1
+        return added
+
+    def observations(self, airline, origin, destination, departure, start=None, end=None):
+        """
+        Returns the observations of a flight, optionally only those crawled from start to end.
+
+        Returns:
+            list: (crawl date, price) sorted by crawl date, empty if the flight was never crawled.
+        """
+        encoded = self.series.get(series_key(airline, origin, destination, departure))
+        if encoded is None:
+            return []
+        days, prices = decode(encoded)
+        first = bisect.bisect_left(days, start.toordinal()) if start else 0
+        last = bisect.bisect_right(days, end.toordinal()) if end else len(days)
+        return [(date.fromordinal(day), price) for day, price in zip(days[first:last], prices[first:last])]
+
+    def curve(self, airline, origin, destination, departure):
+        """
+        Returns the price curve of a flight over the days before departure.
+
+        Returns:
+            list: (days before departure, price), from the earliest crawl to the last one.
+        """
+        return [((departure - crawl_day).days, price)
+                for crawl_day, price in self.observations(airline, origin, destination, departure)]
+
+    def departures(self, airline, origin, destination, start=None, end=None):
+        """ Returns the departure dates of a route with a series, optionally only from start to end """
+        departures = self.routes.get((airline, origin, destination), [])
+        first = bisect.bisect_left(departures, start) if start else 0
+        last = bisect.bisect_right(departures, end) if end else len(departures)
+        return departures[first:last]
+
+    def route_curves(self, airline, origin, destination, start=None, end=None):
+        """ Returns departure date -> price curve of every flight of a route departing from start to end """
+        return {departure: self.curve(airline, origin, destination, departure)
+                for departure in self.departures(airline, origin, destination, start, end)}
+
+    def save(self, path):
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'version': self.version, 'source': self.source, 'watermark': self.watermark,
+                       'series': self.series}, file, separators=(',', ':'))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        return cls(state['series'], state['watermark'], state.get('source'), state.get('version', 1))
+
+
+def update_history(merged=MERGED_FILE, store=DEFAULT_STORE, rebuild=False):
+    """
+    Adds the rows appended to the consolidated dataset since the last update to the price history.
+
+    The history is built from scratch if requested, if there is none yet for this dataset or version, or if
+    the dataset was rewritten instead of appended to.
+
+    Returns:
+        tuple: The price history and the number of new observations.
+    """
+    history = PriceHistory() if rebuild else PriceHistory.load(store)
+    if history.source != merged or history.version != VERSION:
+        history = PriceHistory()
+    rows, watermark = read_new_rows(merged, history.watermark)
+    if rows is None:
+        print(f"{merged} was rewritten, building the price history again")
+        history = PriceHistory()
+        rows, watermark = read_new_rows(merged, None)
+    added = history.add_rows(rows)
+    history.source, history.watermark = merged, watermark
+    history.save(store)
+    return history, added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Updates the price history of every flight and prints the curve of a route.')
+    parser.add_argument('--merged', default=MERGED_FILE, help='The consolidated crawler dataset')
+    parser.add_argument('--store', default=DEFAULT_STORE, help='The file of the price history')
+    parser.add_argument('--rebuild', action='store_true', help='Build the price history from scratch')
+    parser.add_argument('--route', nargs=3, metavar=('AIRLINE', 'ORIGIN', 'DESTINATION'), default=None,
+                        help='Print the price curves of this route, e.g. QatarAirways FRA DXB')
+    parser.add_argument('--start', default=None, help='First departure date of the route as YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='Last departure date of the route as YYYY-MM-DD')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    history, added = update_history(args.merged, args.store, args.rebuild)
+    updated = time.monotonic() - start
+    if args.route:
+        first = date.fromisoformat(args.start) if args.start else None
+        last = date.fromisoformat(args.end) if args.end else None
+        start = time.monotonic()
+        curves = history.route_curves(*args.route, first, last)
+        queried = time.monotonic() - start
+        for departure, curve in curves.items():
+            print(f"{departure}: " + ', '.join(f"{days} days before: {price:.2f}" for days, price in curve))
+        print(f"{len(curves)} flights queried in {queried * 1000:.2f}ms")
+    print(f"------------------ {added} new observations, {len(history.series)} flights in {args.store} "
+          f"(updated in {updated:.2f}s) ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# KLM and Austrian Airlines are searched by city name, Qatar Airways by IATA code. Jobs are described by
+# IATA codes and translated to the form the airline's website expects when the crawler is created.
+
+# IATA code -> city name as entered into the search forms of KLM and Austrian Airlines
+IATA_TO_CITY = {
+    'FRA': 'Frankfurt',
+    'BER': 'Berlin',
+    'HAM': 'Hamburg',
+    'MUC': 'München',
+    'LHR': 'London',
+    'CDG': 'Paris',
+    'AMS': 'Amsterdam',
+    'PMI': 'Palma de Mallorca',
+    'IST': 'Istanbul',
+    'DXB': 'Dubai',
+    'DOH': 'Doha',
+    'VIE': 'Wien',
+    'JFK': 'New York',
+    'PVG': 'Shanghai',
+}
+
+# City name (lower case) -> IATA code, including spellings found in the crawled data
+CITY_TO_IATA = {city.lower(): iata for iata, city in IATA_TO_CITY.items()}
+CITY_TO_IATA.update({
+    'muenchen': 'MUC',
+    'munich': 'MUC',
+    'palma': 'PMI',
+    'mallorca': 'PMI',
+    'vienna': 'VIE',
+    'new york city': 'JFK',
+})
+
+# Airlines whose websites are searched by city name instead of IATA code
+CITY_NAME_AIRLINES = {'KLM', 'AustrianAirlines'}
+
+
+def to_iata(airport):
+    """
+    Returns the IATA code of an airport given either as IATA code or as city name.
+
+    Parameters:
+        airport (str): An IATA code such as 'FRA' or a city name such as 'Frankfurt'.
+
+    Returns:
+        str: The IATA code.
+
+    Raises:
+        ValueError: If the airport is unknown.
+    """
+    name = airport.strip()
+    if name.upper() in IATA_TO_CITY:
+        return name.upper()
+    if name.lower() in CITY_TO_IATA:
+        return CITY_TO_IATA[name.lower()]
+    raise ValueError(f"Unknown airport: {airport}")
+
+
+def to_city(iata):
+    """ Returns the city name of an IATA code, as entered into the airline search forms """
+    return IATA_TO_CITY[iata]
+
+
+def airport_for_airline(iata, airline_name):
+    """
+    Returns the airport in the form the website of the airline expects.
+
+    Parameters:
+        iata (str): The IATA code of the airport.
+        airline_name (str): The name of the airline, e.g. 'KLM'.
+
+    Returns:
+        str: The city name for KLM and Austrian Airlines, the IATA code otherwise.
+    """
+    return to_city(iata) if airline_name in CITY_NAME_AIRLINES else iata
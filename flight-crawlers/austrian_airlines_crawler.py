@@ -1,14 +1,14 @@
 from base_crawler import BaseCrawler
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait 
 from selenium.webdriver.support import expected_conditions as EC
 import time
 import csv
 import os
 import locale
 from datetime import datetime, timedelta
-import re
+
+from normalization import format_minutes, normalize_duration, normalize_time, parse_duration, parse_price
 
 class AustrianAirlinesCrawler(BaseCrawler):
     """
@@ -17,17 +17,19 @@ class AustrianAirlinesCrawler(BaseCrawler):
 
     airline_name = "AustrianAirlines"
 
-    def __init__(self, departure_airport, destination_airport):
+    def __init__(self, departure_airport, destination_airport, date=None):
         """
         Initializes the AustrianAirlinesCrawler with specific travel details.
 
         Parameters:
             departure_airport (str): The name of the departure airport.
             destination_airport (str): The name of the destination airport.
+            date (str): The departure date in '%Y-%m-%d' format, tomorrow if not given.
         """
         url = "https://www.austrian.com"
         self.departure_airport = departure_airport
         self.destination_airport = destination_airport
+        self.date = date or (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
         self.flight_data = []
         super().__init__(url, "AustrianAirlines")
 
@@ -55,9 +57,13 @@ class AustrianAirlinesCrawler(BaseCrawler):
         This function waits for the cookie consent banner's accept button to be clickable and then clicks it.
         Logs success or error in the operation.
         """
+        if self.session_reused:
+            # The banner has already been accepted in this browser session
+            self.log_to_csv('INFO', 'Cookies already accepted in this browser session')
+            return
         try:
-            accept_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.ID, "cm-acceptAll"))
+            accept_button = self.wait_for(
+                'accept_cookies', EC.element_to_be_clickable((By.ID, "cm-acceptAll"))
             )
             accept_button.click()  # Click the accept button on the cookie consent banner
             self.random_sleep(3, 15)  # Random sleep to mimic human delay
@@ -78,8 +84,8 @@ class AustrianAirlinesCrawler(BaseCrawler):
         Logs success or error in the operation.
         """
         try:
-            departure_button = WebDriverWait(self.driver, 10).until(
-                EC.visibility_of_element_located((By.XPATH, '/html/body/div[2]/div[4]/div/div/div[2]/div/div/div[2]/div[1]/div/section/div[2]/div[1]/div/div/form/div[2]/div[1]/div[1]/div[1]/div/div[1]/div[1]/div[1]/input'))
+            departure_button = self.wait_for(
+                'enter_departure_airport', EC.visibility_of_element_located((By.XPATH, '/html/body/div[2]/div[4]/div/div/div[2]/div/div/div[2]/div[1]/div/section/div[2]/div[1]/div/div/form/div[2]/div[1]/div[1]/div[1]/div/div[1]/div[1]/div[1]/input'))
             )
             departure_button.click()  # Focus on the input field
             self.random_sleep(3, 15)  # Random sleep to mimic human delay
@@ -103,8 +109,8 @@ class AustrianAirlinesCrawler(BaseCrawler):
         enters the new airport, and selects it from the dropdown. Logs success or error in the operation.
         """
         try:
-            destination_button = WebDriverWait(self.driver, 10).until(
-                EC.visibility_of_element_located((By.NAME, 'flightQuery.flightSegments[0].destinationCode'))
+            destination_button = self.wait_for(
+                'enter_destination_airport', EC.visibility_of_element_located((By.NAME, 'flightQuery.flightSegments[0].destinationCode'))
             )
             destination_button.clear()  # Clear existing input
             destination_button.send_keys(airport)  # Enter new airport
@@ -125,14 +131,14 @@ class AustrianAirlinesCrawler(BaseCrawler):
         """
         try:
             # Wait for the round-trip option to be clickable and click it
-            round_trip_opt = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '//*[@id="dcep-tab-control-standalone3-fluge-section"]/div/div/form/div[1]/div/div/div[1]/button'))
+            round_trip_opt = self.wait_for(
+                'choose_oneway.round_trip', EC.element_to_be_clickable((By.XPATH, '//*[@id="dcep-tab-control-standalone3-fluge-section"]/div/div/form/div[1]/div/div/div[1]/button'))
             )
             round_trip_opt.click()
 
             # Wait for the one-way option to be clickable and select it
-            one_way = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '//*[@id="dcep-tab-control-standalone3-fluge-section"]/div/div/form/div[1]/div/div/div[2]/ul/li[2]'))
+            one_way = self.wait_for(
+                'choose_oneway.one_way', EC.element_to_be_clickable((By.XPATH, '//*[@id="dcep-tab-control-standalone3-fluge-section"]/div/div/form/div[1]/div/div/div[2]/ul/li[2]'))
             )
             one_way.click()
             self.log_to_csv('INFO', 'Choose One-Way Flight')
@@ -141,7 +147,7 @@ class AustrianAirlinesCrawler(BaseCrawler):
 
     def enter_departure_date(self):
         """
-        Inputs the departure date into the search form by selecting tomorrow's date from the calendar.
+        Inputs the departure date into the search form by selecting self.date from the calendar.
 
         This function sets the locale to English to ensure the date format matches, clicks on the departure date input,
         selects the date from the calendar, and confirms the selection. It logs the outcome of the operation.
@@ -150,27 +156,27 @@ class AustrianAirlinesCrawler(BaseCrawler):
             # Set locale to English to handle date formatting
             locale.setlocale(locale.LC_TIME, 'en_US.UTF-8')
 
-            # Format tomorrow's date for selection
-            tomorrow_date = (datetime.now() + timedelta(days=1)).strftime("%A, %d %B %Y")
-            date_xpath = f"//td[contains(@class, 'CalendarDay') and contains(@class, 'CalendarDay__default') and contains(@aria-label, '{tomorrow_date}')]"
+            # Format the departure date for selection
+            departure_date_label = datetime.strptime(self.date, '%Y-%m-%d').strftime("%A, %d %B %Y")
+            date_xpath = f"//td[contains(@class, 'CalendarDay') and contains(@class, 'CalendarDay__default') and contains(@aria-label, '{departure_date_label}')]"
 
             # Click on the departure date input field
-            departure_date_input = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '/html/body/div[3]/div[4]/div/div/div[2]/div/div/div[2]/div[1]/div/section/div[2]/div[1]/div/div/form/div[2]/div[2]/div/div[1]/div[1]/input'))
+            departure_date_input = self.wait_for(
+                'enter_departure_date.input', EC.element_to_be_clickable((By.XPATH, '/html/body/div[3]/div[4]/div/div/div[2]/div/div/div[2]/div[1]/div/section/div[2]/div[1]/div/div/form/div[2]/div[2]/div/div[1]/div[1]/input'))
             )
             departure_date_input.click()
             time.sleep(5)
 
             # Select the date from the calendar
-            departure_date = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, date_xpath))
+            departure_date = self.wait_for(
+                'enter_departure_date.day', EC.element_to_be_clickable((By.XPATH, date_xpath))
             )
             departure_date.click()
             time.sleep(3)
 
             # Click the continue button to proceed
-            continue_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'btn-primary') and contains(@class, 'calendar-footer-continue-button') and @type='button' and span[text()='Weiter']]"))
+            continue_button = self.wait_for(
+                'enter_departure_date.continue', EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'btn-primary') and contains(@class, 'calendar-footer-continue-button') and @type='button' and span[text()='Weiter']]"))
             )
             continue_button.click()
 
@@ -187,8 +193,8 @@ class AustrianAirlinesCrawler(BaseCrawler):
         Logs the status of the search initiation.
         """
         try:
-            search_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '/html/body/div[3]/div[4]/div/div/div[2]/div/div/div[2]/div[1]/div/section/div[2]/div[1]/div/div/form/div[2]/div[4]/button'))
+            search_button = self.wait_for(
+                'start_search', EC.element_to_be_clickable((By.XPATH, '/html/body/div[3]/div[4]/div/div/div[2]/div/div/div[2]/div[1]/div/section/div[2]/div[1]/div/div/form/div[2]/div[4]/button'))
             )
             search_button.click()
             time.sleep(10)  # Wait for search results to start loading
@@ -207,13 +213,13 @@ class AustrianAirlinesCrawler(BaseCrawler):
         time.sleep(10)  # Wait for all elements to be fully loaded
 
         try:
-            sort_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/div[1]/refx-upsell-premium-filtering-pres/div[2]/refx-upsell-premium-sorting-pres/refx-menu/div/a'))
+            sort_button = self.wait_for(
+                'sort.button', EC.element_to_be_clickable((By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/div[1]/refx-upsell-premium-filtering-pres/div[2]/refx-upsell-premium-sorting-pres/refx-menu/div/a'))
             )
             sort_button.click()
 
-            cheapest_option = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '/html/body/div[4]/div[2]/div/div/div/button[2]'))
+            cheapest_option = self.wait_for(
+                'sort.cheapest', EC.element_to_be_clickable((By.XPATH, '/html/body/div[4]/div[2]/div/div/div/button[2]'))
             )
             cheapest_option.click()
             self.log_to_csv('INFO', 'Sorted flights from cheapest to most expensive')
@@ -229,8 +235,8 @@ class AustrianAirlinesCrawler(BaseCrawler):
         then clicks it to view more details. Logs the action of clicking the details.
         """
         try:
-            detail_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/mat-accordion/refx-upsell-premium-row-pres[1]/div/div/refx-flight-card-pres/refx-basic-flight-card-layout/div/div/div[1]/div/div[2]/div/refx-flight-details/div/div[2]/a'))
+            detail_button = self.wait_for(
+                'click_details', EC.element_to_be_clickable((By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/mat-accordion/refx-upsell-premium-row-pres[1]/div/div/refx-flight-card-pres/refx-basic-flight-card-layout/div/div/div[1]/div/div[2]/div/refx-flight-details/div/div[2]/a'))
             )
             detail_button.click()
             self.log_to_csv('INFO', 'Clicked details')
@@ -238,26 +244,6 @@ class AustrianAirlinesCrawler(BaseCrawler):
             self.log_to_csv('ERROR', 'Error clicking details')
 
 
-    def extract_time(self, time_string):
-        """
-        Extracts hours and minutes from a given time string formatted as '{hours}h {minutes}min'.
-
-        Args:
-            time_string (str): The time string to parse.
-
-        Returns:
-            list: A list containing the extracted hours and minutes.
-        """
-        try:
-            hours_match = re.search(r'(\d+)h', time_string)
-            minutes_match = re.search(r'(\d+)min', time_string)
-            hours = hours_match.group(1) if hours_match else "00"
-            minutes = minutes_match.group(1) if minutes_match else "00"
-            return [hours, minutes]
-        except Exception as e:
-            self.log_to_csv('ERROR', 'Failed to extract time from string')
-            return ["00", "00"]
-
     def get_transit_duration(self, transit_indicator):
         """
         Calculates the total transit duration based on the flight's transit indicator.
@@ -271,19 +257,13 @@ class AustrianAirlinesCrawler(BaseCrawler):
         try:
             if(transit_indicator == "bound-nb-stop-container has-stops has-1-stop"):
                 transit_duration_string = self.driver.find_element(By.XPATH, '/html/body/div[4]/div[2]/div/mat-dialog-container/refx-itinerary-details-dialog-pres/refx-dialog-pres/div/div[2]/div/div/refx-flight-stop-details-pres/div/div/div/div[2]/div/div[2]').text
-                transit_hours = self.time_extract(transit_duration_string)[0]
-                transit_minutes = self.time_extract(transit_duration_string)[1]
+                transit_minutes = parse_duration(transit_duration_string)
             elif(transit_indicator == "bound-nb-stop-container has-stops"):
                 transit_duration_1_string = self.driver.find_element(By.XPATH, '/html/body/div[4]/div[2]/div/mat-dialog-container/refx-itinerary-details-dialog-pres/refx-dialog-pres/div/div[2]/div/div/refx-flight-stop-details-pres[1]/div/div/div/div[2]/div/div[2]').text
                 transit_duration_2_string = self.driver.find_element(By.XPATH, '/html/body/div[4]/div[2]/div/mat-dialog-container/refx-itinerary-details-dialog-pres/refx-dialog-pres/div/div[2]/div/div/refx-flight-stop-details-pres[2]/div/div/div/div[2]/div/div[2]').text
-                transit_hours = str(int(self.time_extract(transit_duration_1_string)[0]) + int(self.time_extract(transit_duration_2_string)[0]))
-                transit_minutes = str(int(self.time_extract(transit_duration_1_string)[1]) + int(self.time_extract(transit_duration_2_string)[1]))
-            if(int(transit_minutes) > 59):
-                transit_hours = str(int(transit_hours) + 1)
-                transit_minutes = str(int(transit_minutes) - 60)
-            if(len(transit_hours) == 1):
-                transit_hours = "0" + transit_hours
-            transit_duration = transit_hours + ":" + transit_minutes
+                transit_minutes = parse_duration(transit_duration_1_string) + parse_duration(transit_duration_2_string)
+            # Summed in minutes, so '1h 50min' + '2h 15min' gives '04:05' and the minutes are always padded
+            transit_duration = format_minutes(transit_minutes or 0)
             self.log_to_csv('INFO', 'Calculated transit duration successfully')
             return transit_duration
         except Exception as e:
@@ -301,11 +281,7 @@ class AustrianAirlinesCrawler(BaseCrawler):
         time.sleep(10)
         try:
             duration_string = self.driver.find_element(By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/mat-accordion/refx-upsell-premium-row-pres[1]/div/div/refx-flight-card-pres/refx-basic-flight-card-layout/div/div/div[1]/div/div[2]/div/refx-flight-details/div/div[1]/div[1]/div/span[2]').text
-            duration_hours = self.time_extract(duration_string)[0]
-            if(len(duration_hours) == 1):
-                duration_hours = "0" + duration_hours
-            duration_minutes = self.time_extract(duration_string)[1]
-            travel_duration = duration_hours + ":" + duration_minutes
+            travel_duration = normalize_duration(duration_string)
             departure_time = self.driver.find_element(By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/mat-accordion/refx-upsell-premium-row-pres[1]/div/div/refx-flight-card-pres/refx-basic-flight-card-layout/div/div/div[1]/div/div[1]/div/refx-bound-timeline/div[1]/div[1]/div[1]/div').text
             arrival_time = self.driver.find_element(By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/mat-accordion/refx-upsell-premium-row-pres[1]/div/div/refx-flight-card-pres/refx-basic-flight-card-layout/div/div/div[1]/div/div[1]/div/refx-bound-timeline/div[1]/div[3]/div[1]/div').text
             flight_type_element = self.driver.find_element(By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/mat-accordion/refx-upsell-premium-row-pres[1]/div/div/refx-flight-card-pres/refx-basic-flight-card-layout/div/div/div[1]/div/div[1]/div/refx-bound-timeline/div[1]/div[2]/div[2]')
@@ -315,8 +291,7 @@ class AustrianAirlinesCrawler(BaseCrawler):
             else:
                 transit = True
             price = self.driver.find_element(By.XPATH, '/html/body/app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div/refx-calendar-cont/refx-calendar-pres/div/mat-expansion-panel/div/div/refx-carousel/div/ul/li[4]/div/button/span[1]/div[1]/div/refx-price-cont/refx-price/span/span').text
-            price = price.replace(".", "")
-            price = float(price.replace(",", "."))
+            price = parse_price(price, locale='de')
             
             if(transit):
                 self.click_details()
@@ -328,10 +303,10 @@ class AustrianAirlinesCrawler(BaseCrawler):
                 'crawling_date': datetime.now().strftime("%d-%m-%Y"),
                 'departure_airport': self.departure_airport,
                 'destination_airport': self.destination_airport,
-                'date': (datetime.now()+timedelta(days=1)).strftime("%d-%m-%Y"),
+                'date': datetime.strptime(self.date, '%Y-%m-%d').strftime("%d-%m-%Y"),
                 'travel_duration': travel_duration,
-                'departure_time': departure_time,
-                'arrival_time': arrival_time,
+                'departure_time': normalize_time(departure_time),
+                'arrival_time': normalize_time(arrival_time),
                 'transit': transit,
                 'transit_duration': transit_duration,
                 'price': price
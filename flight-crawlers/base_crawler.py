@@ -7,9 +7,16 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException
+from step_timeouts import StepTimeouts
+from quality_gate import append_results
 from datetime import datetime
 import time
 import random
+import threading
+
+# Serializes appends to the shared log and results files when several crawlers run in parallel
+file_lock = threading.Lock()
 
 class BaseCrawler:
     """
@@ -29,7 +36,35 @@ class BaseCrawler:
         The path to the log file for the specific airline.
     logger : Logger
         The logger instance for logging messages and errors.
+    step_timeouts : StepTimeouts
+        The timeout budgets per crawling step, learned from previous crawls of this airline.
+    errors : list
+        The messages of all errors logged by this crawler, used to describe failed crawls.
+    supervisor : BrowserSupervisor
+        The supervisor the started browsers are registered with, shared by all crawlers (default is None).
+    headless : bool
+        Whether Chrome is started without a window, e.g. for benchmarks on a server (default is False).
+    results_saved : int
+        The number of result rows this crawler has written so far.
+    saved_rows : list
+        The result rows this crawler has written so far, e.g. to ship them to the job broker.
+    results_dir : str
+        The directory the results files are written to (default is 'results').
+    quality_gate : QualityGate
+        The gate that flags or quarantines the result rows before they are written, shared by all crawlers
+        (default is None).
+    keep_session : bool
+        Whether stop_driver() leaves the browser open, so the next job of the same airline can continue in it
+        (default is False).
+    session_reused : bool
+        Whether this crawler continued in a browser handed over by a previous crawler, in which case steps
+        like accepting cookies are skipped.
     """
+    supervisor = None
+    headless = False
+    results_dir = 'results'
+    quality_gate = None
+
     def __init__(self, url, airline_name):
         """
         Constructs all the necessary attributes for the BaseCrawler object.
@@ -44,9 +79,15 @@ class BaseCrawler:
         self.url = url
         self.airline_name = airline_name
         self.driver = None
+        self.errors = []
+        self.results_saved = 0
+        self.saved_rows = []
+        self.keep_session = False
+        self.session_reused = False
         self.log_dir = 'logs'
         self.log_file = os.path.join(self.log_dir, f'logging_{self.airline_name}.csv')
         self.setup_logger()
+        self.step_timeouts = StepTimeouts(self.airline_name, self.log_dir)
 
     def setup_logger(self):
         """
@@ -83,23 +124,28 @@ class BaseCrawler:
         error : str, optional
             The error message, if any (default is None).
         """
-        with open(self.log_file, 'a', newline='') as csvfile:  
-            fieldnames = ['date', 'level', 'message', 'error'] 
+        with file_lock, open(self.log_file, 'a', newline='') as csvfile:  
+            fieldnames = ['date', 'time', 'level', 'message', 'error'] 
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)  
             now = datetime.now()  
             date_str = now.strftime('%Y-%m-%d')  
             writer.writerow({
                 'date': date_str,
+                'time': now.strftime('%H:%M:%S'),
                 'level': level,
                 'message': message,
                 'error': error
             }) 
         self.logger.log(getattr(logging, level), f"{message}, {error if error else ''}") 
+        if level == 'ERROR':
+            self.errors.append(message)
 
     def start_driver(self):
         """
         Starts the Selenium WebDriver.
         """
+        if self.resume_session():
+            return
         service = Service()
         options = webdriver.ChromeOptions()
         options.add_argument("start-maximized")
@@ -111,8 +157,11 @@ class BaseCrawler:
         options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
         options.add_experimental_option("excludeSwitches", ["enable-automation"])
         options.add_experimental_option('useAutomationExtension', False)
+        if self.headless:
+            options.add_argument("--headless=new")
 
         self.driver = webdriver.Chrome(service=service, options=options)
+        self.register_browser()
         self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": """
                 Object.defineProperty(navigator, 'webdriver', {
@@ -126,6 +175,8 @@ class BaseCrawler:
         """
         Starts the Selenium WebDriver for KLM, because specific configurations are needed to crawl that website.
         """
+        if self.resume_session():
+            return
         service = Service()
         options = webdriver.ChromeOptions()
         options.add_argument("start-maximized")
@@ -137,9 +188,12 @@ class BaseCrawler:
         options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
         options.add_experimental_option("excludeSwitches", ["enable-automation"])
         options.add_experimental_option('useAutomationExtension', False)
+        if self.headless:
+            options.add_argument("--headless=new")
         options.add_argument("--disable-blink-features=AutomationControlled")
 
         self.driver = webdriver.Chrome(service=service, options=options)
+        self.register_browser()
         self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": """
                 Object.defineProperty(navigator, 'webdriver', {
@@ -162,13 +216,102 @@ class BaseCrawler:
         print(f"------------------ started crawling for airline {self.airline_name} ------------------")
         self.log_to_csv('INFO', f"Selenium WebDriver for {self.airline_name} started.")
 
-    def stop_driver(self):
+    def random_sleep(self, min_seconds, max_seconds):
+        """
+        Sleeps for a random number of seconds to mimic the delays of a human user.
+
+        Parameters
+        ----------
+        min_seconds : float
+            The minimum number of seconds to sleep.
+        max_seconds : float
+            The maximum number of seconds to sleep.
+        """
+        time.sleep(random.uniform(min_seconds, max_seconds))
+
+    def wait_for(self, step, condition, timeout=10):
+        """
+        Waits until the given expected condition is met and records how long the wait took.
+
+        The timeout is taken from the learned budget of the step if there is one, otherwise the given
+        constant is used.
+
+        Parameters
+        ----------
+        step : str
+            The name of the crawling step, used as key for the latency history.
+        condition : callable
+            The expected condition passed to WebDriverWait.until.
+        timeout : float, optional
+            The timeout in seconds used as long as no budget has been learned (default is 10).
+
+        Returns
+        -------
+        The return value of the expected condition, usually the found element.
+        """
+        budget = self.step_timeouts.get(step, timeout)
+        start = time.monotonic()
+        try:
+            result = WebDriverWait(self.driver, budget).until(condition)
+        except TimeoutException:
+            self.step_timeouts.record(step, time.monotonic() - start, 'timeout')
+            raise
+        self.step_timeouts.record(step, time.monotonic() - start, 'ok')
+        return result
+
+    def register_browser(self):
         """
-        Stops the Selenium WebDriver.
+        Registers the chromedriver process of the started WebDriver with the supervisor, if there is one.
         """
+        if self.supervisor is not None and self.driver.service.process is not None:
+            self.supervisor.track(self.driver.service.process.pid)
+
+    def adopt_session(self, driver):
+        """
+        Hands over the browser of a previous crawler of the same airline, which start_driver() will continue in.
+
+        Parameters
+        ----------
+        driver : WebDriver
+            The still running WebDriver of the previous crawler.
+        """
+        self.driver = driver
+
+    def resume_session(self):
+        """
+        Checks whether a browser has been handed over by adopt_session() and marks the session as reused.
+
+        Returns
+        -------
+        bool
+            True if the crawler continues in the handed over browser and no new one has to be started.
+        """
+        if self.driver is None:
+            return False
+        self.session_reused = True
+        self.log_to_csv('INFO', f"Reusing Selenium WebDriver for {self.airline_name} ({self.departure_airport} - {self.destination_airport})")
+        return True
+
+    def stop_driver(self, force=False):
+        """
+        Stops the Selenium WebDriver, unless keep_session is set and the browser should be handed over to the next job.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Stops the browser even if keep_session is set, e.g. after a failure (default is False).
+        """
+        if self.driver and self.keep_session and not force:
+            self.log_to_csv('INFO', f"Keeping Selenium WebDriver for {self.airline_name} open for the next job")
+            return
         if self.driver:
-            self.driver.quit()
-            self.log_to_csv('INFO', f"Selenium WebDriver for {self.airline_name} stopped")
+            try:
+                self.driver.quit()
+                self.log_to_csv('INFO', f"Selenium WebDriver for {self.airline_name} stopped")
+            except Exception:
+                # The browser may already be gone, e.g. killed by the supervisor
+                self.log_to_csv('ERROR', f"Error stopping Selenium WebDriver for {self.airline_name}")
+            self.driver = None
             
     def open_url(self):
         """
@@ -184,23 +327,35 @@ class BaseCrawler:
         """
         Saves the scraped data to a CSV file.
         """
-        results_file = f'results/results_{self.airline_name}.csv'
-        fieldnames = [
-            'airline_name', 'crawling_date', 'departure_airport', 'destination_airport', 
-            'date', 'travel_duration', 'departure_time', 'arrival_time', 
-            'transit', 'transit_duration', 'price'
-        ]
+        self.write_results(self.flight_data)
 
-        if not os.path.exists('results'):
-            os.makedirs('results')
+    def write_results(self, rows):
+        """
+        Appends result rows to results/results_<airline>.csv.
 
-        file_exists = os.path.isfile(results_file)
-        mode = 'a' if file_exists else 'w'  
+        With a quality gate the rows get a quality_flag, and rows with a missing or implausible price or
+        duration are written to results/quarantine_<airline>.csv instead. Quarantined rows do not count as
+        saved, so the job is repeated.
 
-        with open(results_file, mode, newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()  
-            writer.writerows(self.flight_data)
+        Parameters
+        ----------
+        rows : list
+            The result rows as dicts.
+        """
+        results_file = os.path.join(self.results_dir, f'results_{self.airline_name}.csv')
+        quarantine_file = os.path.join(self.results_dir, f'quarantine_{self.airline_name}.csv')
+        accepted, quarantined = self.quality_gate.screen(rows) if self.quality_gate else (rows, [])
+
+        os.makedirs(self.results_dir, exist_ok=True)
+        with file_lock:
+            append_results(results_file, accepted)
+            if quarantined:
+                append_results(quarantine_file, quarantined)
+        self.results_saved += len(accepted)
+        self.saved_rows += accepted
 
-        self.log_to_csv('INFO', f'Results saved to {results_file}')
\ No newline at end of file
+        for row in quarantined:
+            self.log_to_csv('ERROR', f"Result quarantined: {row['quality_flag']}",
+                            f"Price {row.get('price')}, travel duration {row.get('travel_duration')}")
+        if accepted:
+            self.log_to_csv('INFO', f'Results saved to {results_file}')
\ No newline at end of file
@@ -0,0 +1,127 @@
+import argparse
+import csv
+import os
+import time
+from datetime import datetime, timedelta
+
+from base_crawler import BaseCrawler
+from browser_supervisor import BrowserSupervisor
+from circuit_breaker import CircuitBreaker
+from main import build_jobs, run_jobs, CRAWLERS
+from mock_airline_server import MockAirlineServer
+from step_timeouts import read_latencies, percentile
+
+BENCHMARK_FIELDNAMES = [
+    'workers', 'jobs', 'succeeded', 'wall_seconds', 'routes_per_minute', 'peak_rss_mb_per_browser'
+]
+
+
+def step_latency_report(airline_names, log_dir='logs'):
+    """
+    Summarizes the recorded waits of a benchmark run per airline and step.
+
+    Returns:
+        list: One dict per step with the number of samples and the p50 and p95 latency in seconds.
+    """
+    rows = []
+    for airline_name in airline_names:
+        for step, values in sorted(read_latencies(airline_name, log_dir).items()):
+            rows.append({
+                'airline': airline_name,
+                'step': step,
+                'samples': len(values),
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95)
+            })
+    return rows
+
+
+def run_benchmark(server, jobs, workers, output_dir):
+    """
+    Runs all jobs against the mock server with the given number of workers.
+
+    The run uses its own working directory, so its logs, results and learned state do not mix with those
+    of the other runs or of the real crawling cycles.
+
+    Parameters:
+        server (MockAirlineServer): The running mock server.
+        jobs (list): The CrawlJobs to run.
+        workers (int): The number of crawlers running at the same time.
+        output_dir (str): The directory for the files of this run.
+
+    Returns:
+        tuple: (summary dict, list of step latency dicts)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(output_dir)
+    try:
+        supervisor = BrowserSupervisor()
+        BaseCrawler.supervisor = supervisor
+        start = time.monotonic()
+        outcomes = run_jobs(jobs, workers=workers, breaker=CircuitBreaker(), supervisor=supervisor,
+                            configure=server.configure)
+        wall_seconds = time.monotonic() - start
+        latencies = step_latency_report(sorted({job.airline for job in jobs}))
+    finally:
+        BaseCrawler.supervisor = None
+        os.chdir(cwd)
+
+    peak_rss = [float(job['peak_rss_mb']) for job in supervisor.jobs]
+    summary = {
+        'workers': workers,
+        'jobs': len(jobs),
+        'succeeded': sum(1 for _, success, _ in outcomes if success),
+        'wall_seconds': round(wall_seconds, 1),
+        'routes_per_minute': round(len(jobs) / wall_seconds * 60, 2),
+        'peak_rss_mb_per_browser': max(peak_rss) if peak_rss else 0.0
+    }
+    return summary, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the crawling throughput against local mock airline websites.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare')
+    parser.add_argument('--airlines', nargs='+', choices=list(CRAWLERS), default=list(CRAWLERS))
+    parser.add_argument('--latency', type=float, default=0.5, help='Fixed delay of every mock page in seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='Maximum additional random delay in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of pages answered with an error')
+    parser.add_argument('--block-rate', type=float, default=0.0, help='Share of pages answered with a bot challenge')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--headful', action='store_true', help='Show the browser windows')
+    parser.add_argument('--output', default='benchmark', help='Directory for the logs, results and the report')
+    args = parser.parse_args()
+
+    BaseCrawler.headless = not args.headful
+    server = MockAirlineServer(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                               block_rate=args.block_rate, seed=args.seed).start()
+    tomorrow = (datetime.now() + timedelta(days=1)).date()
+    jobs = build_jobs([tomorrow], args.airlines)
+    output_dir = os.path.abspath(args.output)
+
+    summaries = []
+    try:
+        for workers in args.workers:
+            print(f"------------------ Benchmark: {len(jobs)} routes with {workers} workers ------------------")
+            summary, latencies = run_benchmark(server, jobs, workers, os.path.join(output_dir, f'workers_{workers}'))
+            summaries.append(summary)
+            for row in latencies:
+                print(f"{row['airline']} {row['step']}: p50 {row['p50']:.2f}s, p95 {row['p95']:.2f}s ({row['samples']} samples)")
+            print(f"{summary['succeeded']}/{summary['jobs']} routes in {summary['wall_seconds']}s, "
+                  f"{summary['routes_per_minute']} routes/min, peak RSS per browser {summary['peak_rss_mb_per_browser']} MB")
+    finally:
+        server.stop()
+
+    report_file = os.path.join(output_dir, 'benchmark_results.csv')
+    file_exists = os.path.isfile(report_file)
+    with open(report_file, 'a', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=['date'] + BENCHMARK_FIELDNAMES)
+        if not file_exists:
+            writer.writeheader()
+        for summary in summaries:
+            writer.writerow({'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **summary})
+    print(f"------------------ Benchmark results saved to {report_file} ------------------")
+
+
+if __name__ == "__main__":
+    main()
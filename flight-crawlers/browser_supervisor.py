@@ -0,0 +1,315 @@
+import csv
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import psutil
+
+USAGE_FIELDNAMES = [
+    'date', 'time', 'job', 'wall_seconds', 'peak_rss_mb', 'cpu_seconds', 'processes', 'killed', 'orphans_killed'
+]
+
+
+def process_tree(pid):
+    """
+    Returns the process with the given pid and all of its descendants.
+
+    Parameters:
+        pid (int): The pid of the root process, e.g. chromedriver.
+
+    Returns:
+        list: psutil.Process objects, empty if the root process does not exist anymore.
+    """
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def kill_process_tree(pid, timeout=3):
+    """
+    Terminates a process and all of its descendants, killing those that do not exit within the timeout.
+
+    Parameters:
+        pid (int): The pid of the root process.
+        timeout (float): The number of seconds to wait for the processes to terminate.
+
+    Returns:
+        int: The number of processes that had to be stopped.
+    """
+    processes = process_tree(pid)
+    for process in processes:
+        try:
+            process.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(processes, timeout=timeout)
+    for process in alive:
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+    return len(processes)
+
+
+def kill_if_same(pid, create_time):
+    """
+    Kills the tree of a remembered process, but only if the pid still belongs to the same process.
+
+    Parameters:
+        pid (int): The pid of the process.
+        create_time (float): The start time of the process when it was remembered.
+
+    Returns:
+        int: The number of processes that had to be stopped.
+    """
+    try:
+        if abs(psutil.Process(pid).create_time() - create_time) > 1:
+            return 0
+    except psutil.NoSuchProcess:
+        return 0
+    return kill_process_tree(pid)
+
+
+def is_running(pid, create_time):
+    """ Returns whether the pid still belongs to the process started at create_time """
+    try:
+        return abs(psutil.Process(pid).create_time() - create_time) <= 1
+    except psutil.NoSuchProcess:
+        return False
+
+
+class SupervisedJob:
+    """
+    The resource accounting of a single crawling job.
+    """
+
+    def __init__(self, name, max_wall_time=None):
+        self.name = name
+        self.max_wall_time = max_wall_time
+        self.started = time.monotonic()
+        self.finished = None
+        self.pids = []
+        self.processes = {}
+        self.peak_rss = 0
+        self.cpu_seconds = {}
+        self.killed = ''
+        self.orphans_killed = 0
+
+    def wall_seconds(self):
+        """ Returns the runtime of the job so far """
+        return (self.finished or time.monotonic()) - self.started
+
+    def sample(self):
+        """
+        Measures the memory and cpu usage of all browser processes of the job and remembers every process seen,
+        so that children which outlive chromedriver can still be found.
+
+        Returns:
+            int: The summed resident set size in bytes.
+        """
+        rss = 0
+        for pid in list(self.pids):
+            for process in process_tree(pid):
+                try:
+                    rss += process.memory_info().rss
+                    cpu = process.cpu_times()
+                    self.cpu_seconds[process.pid] = cpu.user + cpu.system
+                    self.processes.setdefault(process.pid, process.create_time())
+                except psutil.NoSuchProcess:
+                    continue
+        self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+
+class BrowserSupervisor:
+    """
+    Watches the Chrome and chromedriver processes started by the crawlers.
+
+    Every job runs inside BrowserSupervisor.job(). The browser processes registered by BaseCrawler during the
+    job are polled in the background: if the job exceeds its wall-time or the process tree its memory budget,
+    the browser is killed so the crawler fails fast. When the job ends, whatever is still running is killed as
+    well, so an exception escaping run() before stop_driver() can no longer leak browsers. The resource usage
+    of every job is written to logs/resource_usage.csv.
+
+    Every process keeps its own pid registry (logs/browser_pids_<owner>.json) together with its own pid and
+    start time, so several crawler processes on one machine do not overwrite or reap each other's browsers.
+    """
+
+    def __init__(self, max_wall_time=600, max_rss_mb=2048, poll_interval=2, log_dir='logs', owner=None):
+        """
+        Initializes the BrowserSupervisor.
+
+        Parameters:
+            max_wall_time (float): The maximum runtime of a job in seconds.
+            max_rss_mb (float): The maximum summed resident memory of the browser processes of a job in MB.
+            poll_interval (float): The number of seconds between two measurements.
+            log_dir (str): The directory for the usage report and the pid registries.
+            owner (str): The name of the pid registry of this process, e.g. the node id (default: the pid).
+        """
+        self.max_wall_time = max_wall_time
+        self.max_rss_mb = max_rss_mb
+        self.poll_interval = poll_interval
+        self.log_dir = log_dir
+        self.usage_file = os.path.join(log_dir, 'resource_usage.csv')
+        self.registry_file = os.path.join(log_dir, f'browser_pids_{owner or os.getpid()}.json')
+        self.owner = {'pid': os.getpid(), 'create_time': psutil.Process().create_time()}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.registry = {}
+        self.jobs = []
+
+    def track(self, pid):
+        """
+        Registers the root process of a browser (chromedriver) with the job running in the current thread.
+
+        Parameters:
+            pid (int): The pid of the chromedriver process.
+        """
+        job = getattr(self.local, 'job', None)
+        if job is None:
+            return
+        job.pids.append(pid)
+        job.sample()
+        self.remember(job)
+
+    def remember(self, job):
+        """ Adds the processes seen in a job to the pid registry """
+        with self.lock:
+            new = {str(pid): create_time for pid, create_time in job.processes.items() if str(pid) not in self.registry}
+            if new:
+                self.registry.update(new)
+                self.save_registry()
+
+    def forget(self, job):
+        """ Removes the processes of a finished job from the pid registry """
+        with self.lock:
+            for pid in job.processes:
+                self.registry.pop(str(pid), None)
+            self.save_registry()
+
+    def save_registry(self):
+        """ Stores the pids of the running browsers of this process, so a later run can clean up after a crash """
+        if not self.registry:
+            if os.path.exists(self.registry_file):
+                os.remove(self.registry_file)
+            return
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        temporary = self.registry_file + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'owner': self.owner, 'browsers': self.registry}, file)
+        os.replace(temporary, self.registry_file)
+
+    def reap_orphans(self):
+        """
+        Kills the browsers that crashed or killed crawler processes left behind.
+
+        Only the registries of processes that are not running anymore are reaped, so browsers of other crawler
+        processes on the same machine stay alive. Only processes from these registries are touched, and only if
+        their start time still matches, so browsers that are not started by the crawlers are never affected.
+
+        Returns:
+            int: The number of killed processes.
+        """
+        killed = 0
+        for path in sorted(glob.glob(os.path.join(self.log_dir, 'browser_pids*.json'))):
+            try:
+                with open(path, 'r') as file:
+                    registry = json.load(file)
+            except (OSError, ValueError):
+                continue
+            # The single registry of older versions has no owner
+            owner = registry.get('owner') if 'browsers' in registry else None
+            if owner and is_running(owner['pid'], owner['create_time']):
+                continue
+            for pid, create_time in registry.get('browsers', registry).items():
+                killed += kill_if_same(int(pid), create_time)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if killed:
+            print(f"------------------ Killed {killed} orphaned browser processes ------------------")
+        return killed
+
+    @contextmanager
+    def job(self, name, max_wall_time=None):
+        """
+        Supervises a crawling job running in the current thread.
+
+        Parameters:
+            name (str): A readable name of the job, e.g. 'KLM Frankfurt - Berlin'.
+            max_wall_time (float): The wall-time budget of this job, e.g. for a session of several routes
+                in one browser (default: the max_wall_time of the supervisor).
+
+        Yields:
+            SupervisedJob: The resource accounting of the job.
+        """
+        job = SupervisedJob(name, max_wall_time or self.max_wall_time)
+        self.local.job = job
+        stop = threading.Event()
+        watchdog = threading.Thread(target=self.watch, args=(job, stop), daemon=True)
+        watchdog.start()
+        try:
+            yield job
+        finally:
+            stop.set()
+            watchdog.join()
+            job.sample()
+            for pid, create_time in job.processes.items():
+                job.orphans_killed += kill_if_same(pid, create_time)
+            self.forget(job)
+            job.finished = time.monotonic()
+            self.local.job = None
+            self.report(job)
+
+    def watch(self, job, stop):
+        """
+        Polls the browser processes of a job and kills them once a budget is exceeded.
+        """
+        while not stop.wait(self.poll_interval):
+            rss = job.sample()
+            self.remember(job)
+            if job.wall_seconds() > job.max_wall_time:
+                job.killed = 'wall_time'
+            elif rss > self.max_rss_mb * 1024 * 1024:
+                job.killed = 'rss'
+            else:
+                continue
+            print(f"------------------ {job.name}: {job.killed} budget exceeded, killing browser ------------------")
+            for pid in list(job.pids):
+                kill_process_tree(pid)
+            return
+
+    def report(self, job):
+        """
+        Appends the resource usage of a finished job to logs/resource_usage.csv.
+        """
+        now = datetime.now()
+        row = {
+            'date': now.strftime('%Y-%m-%d'),
+            'time': now.strftime('%H:%M:%S'),
+            'job': job.name,
+            'wall_seconds': f'{job.wall_seconds():.1f}',
+            'peak_rss_mb': f'{job.peak_rss / (1024 * 1024):.1f}',
+            'cpu_seconds': f'{sum(job.cpu_seconds.values()):.1f}',
+            'processes': len(job.processes),
+            'killed': job.killed,
+            'orphans_killed': job.orphans_killed
+        }
+        with self.lock:
+            self.jobs.append(row)
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+            file_exists = os.path.isfile(self.usage_file)
+            with open(self.usage_file, 'a', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=USAGE_FIELDNAMES)
+                if not file_exists:
+                    writer.writeheader()
+                writer.writerow(row)
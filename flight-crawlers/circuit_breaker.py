@@ -0,0 +1,210 @@
+import csv
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+EVENT_FIELDNAMES = ['date', 'time', 'airline', 'event', 'failures', 'signature']
+
+
+class CircuitBreaker:
+    """
+    A per-airline circuit breaker for the crawling orchestration.
+
+    After failure_threshold consecutive failed crawls of an airline its circuit opens and all further jobs of
+    that airline are skipped. Once the cooldown has passed, a single probe job is let through (half-open):
+    if it succeeds the circuit closes again, otherwise it stays open for another cooldown.
+
+    The state is kept in logs/circuit_breaker.json so that the next crawling cycle starts with the knowledge
+    of the previous one, and every trip is written to logs/circuit_breaker.csv.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=900, log_dir='logs', clock=time.time):
+        """
+        Initializes the CircuitBreaker and loads the state of the previous cycle.
+
+        Parameters:
+            failure_threshold (int): The number of consecutive failures after which a circuit opens.
+            cooldown (float): The number of seconds an open circuit waits before it lets a probe through.
+            log_dir (str): The directory for the state and event files.
+            clock (callable): Returns the current time in seconds, replaceable for testing.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.log_dir = log_dir
+        self.state_file = os.path.join(log_dir, 'circuit_breaker.json')
+        self.event_file = os.path.join(log_dir, 'circuit_breaker.csv')
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.circuits = self.load_state()
+        self.skipped = {}
+
+    def load_state(self):
+        """
+        Loads the circuits stored by the previous cycle.
+
+        Returns:
+            dict: {airline: circuit}, empty if no state has been stored yet.
+        """
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r') as file:
+                circuits = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        for circuit in circuits.values():
+            # A probe that was running when the last cycle ended is not running anymore
+            circuit['probing'] = False
+        return circuits
+
+    def save_state(self):
+        """
+        Stores the circuits for the next cycle.
+        """
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        with open(self.state_file + '.tmp', 'w') as file:
+            json.dump(self.circuits, file, indent=2, sort_keys=True)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def circuit(self, airline):
+        """ Returns the circuit of an airline, creating a closed one if needed """
+        return self.circuits.setdefault(airline, {
+            'state': CLOSED,
+            'failures': 0,
+            'opened_at': None,
+            'signature': None,
+            'trips': 0,
+            'probing': False
+        })
+
+    def allow(self, airline):
+        """
+        Decides whether a job of the airline may run.
+
+        Parameters:
+            airline (str): The name of the airline.
+
+        Returns:
+            bool: True if the job may run, False if it should be skipped.
+        """
+        with self.lock:
+            circuit = self.circuit(airline)
+            if circuit['state'] == CLOSED:
+                return True
+            if circuit['state'] == OPEN and self.clock() - circuit['opened_at'] >= self.cooldown:
+                circuit['state'] = HALF_OPEN
+                self.log_event(airline, 'probe', circuit)
+            if circuit['state'] == HALF_OPEN and not circuit['probing']:
+                circuit['probing'] = True
+                return True
+            self.skipped[airline] = self.skipped.get(airline, 0) + 1
+            return False
+
+    def blocked(self, airline):
+        """
+        Returns True if allow() would currently skip jobs of the airline, without changing any state.
+
+        Parameters:
+            airline (str): The name of the airline.
+        """
+        with self.lock:
+            circuit = self.circuits.get(airline)
+            if circuit is None or circuit['state'] == CLOSED:
+                return False
+            if circuit['state'] == OPEN:
+                return self.clock() - circuit['opened_at'] < self.cooldown
+            return circuit['probing']
+
+    def record_success(self, airline):
+        """
+        Records a successful crawl and closes the circuit of the airline.
+
+        Parameters:
+            airline (str): The name of the airline.
+        """
+        with self.lock:
+            circuit = self.circuit(airline)
+            if circuit['state'] != CLOSED:
+                self.log_event(airline, 'closed', circuit)
+            circuit.update(state=CLOSED, failures=0, opened_at=None, signature=None, probing=False)
+            self.save_state()
+
+    def record_failure(self, airline, signature=None):
+        """
+        Records a failed crawl and opens the circuit once the threshold is reached or a probe failed.
+
+        Parameters:
+            airline (str): The name of the airline.
+            signature (str): A short description of what failed, e.g. the first error message of the crawler.
+        """
+        with self.lock:
+            circuit = self.circuit(airline)
+            circuit['failures'] += 1
+            circuit['signature'] = signature
+            probe_failed = circuit['state'] == HALF_OPEN
+            circuit['probing'] = False
+            if probe_failed or (circuit['state'] == CLOSED and circuit['failures'] >= self.failure_threshold):
+                circuit['state'] = OPEN
+                circuit['opened_at'] = self.clock()
+                circuit['trips'] += 1
+                self.log_event(airline, 'opened', circuit)
+                print(f"------------------ Circuit for {airline} opened after {circuit['failures']} consecutive failures ({signature}) ------------------")
+            self.save_state()
+
+    def is_open(self, airline):
+        """ Returns True if jobs of the airline are currently being skipped """
+        with self.lock:
+            return self.circuit(airline)['state'] != CLOSED
+
+    def log_event(self, airline, event, circuit):
+        """
+        Appends a state change of a circuit to logs/circuit_breaker.csv.
+        """
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        file_exists = os.path.isfile(self.event_file)
+        now = datetime.now()
+        with open(self.event_file, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=EVENT_FIELDNAMES)
+            if not file_exists:
+                writer.writeheader()
+            writer.writerow({
+                'date': now.strftime('%Y-%m-%d'),
+                'time': now.strftime('%H:%M:%S'),
+                'airline': airline,
+                'event': event,
+                'failures': circuit['failures'],
+                'signature': circuit['signature']
+            })
+
+    def report(self):
+        """
+        Prints the state of every circuit that is not closed or skipped jobs in this cycle.
+
+        Returns:
+            list: One dict per reported airline.
+        """
+        rows = []
+        with self.lock:
+            for airline, circuit in sorted(self.circuits.items()):
+                skipped = self.skipped.get(airline, 0)
+                if circuit['state'] == CLOSED and not skipped:
+                    continue
+                rows.append({
+                    'airline': airline,
+                    'state': circuit['state'],
+                    'failures': circuit['failures'],
+                    'skipped_jobs': skipped,
+                    'signature': circuit['signature']
+                })
+        for row in rows:
+            print(f"Circuit {row['airline']}: {row['state']}, {row['failures']} consecutive failures, "
+                  f"{row['skipped_jobs']} jobs skipped, last error: {row['signature']}")
+        return rows
@@ -0,0 +1,75 @@
+from airports import airport_for_airline
+from collections import namedtuple
+from contextlib import nullcontext
+import importlib
+import time
+
+# Creating and running the crawler of a single job. Shared by main.py, route_planner.py and job_broker.py, so
+# none of them has to import another one's command line script.
+
+# A single crawling job: one airline, one route (IATA codes), one departure date
+CrawlJob = namedtuple('CrawlJob', ['airline', 'departure_airport', 'destination_airport', 'date'])
+
+# Airline -> (module, class) of its crawler. The modules are only imported when a job of the airline runs,
+# so selenium and the other crawling libraries are not loaded for a dry run or an unrelated airline.
+CRAWLERS = {
+    'KLM': ('klm_crawler', 'KLMCrawler'),
+    'QatarAirways': ('qatar_airways_crawler', 'QatarAirwaysCrawler'),
+    'AustrianAirlines': ('austrian_airlines_crawler', 'AustrianAirlinesCrawler'),
+}
+
+def load_crawler_class(airline):
+    """ Imports the crawler module of an airline and returns its crawler class """
+    module_name, class_name = CRAWLERS[airline]
+    return getattr(importlib.import_module(module_name), class_name)
+
+def create_crawler(job):
+    """ Creates the crawler for a job, formatting airports and date the way the airline's website expects them """
+    crawler_class = load_crawler_class(job.airline)
+    departure_airport = airport_for_airline(job.departure_airport, job.airline)
+    destination_airport = airport_for_airline(job.destination_airport, job.airline)
+    if job.airline == 'KLM':
+        return crawler_class(departure_airport, destination_airport, job.date.strftime('%d.%m.%Y'))
+    return crawler_class(departure_airport, destination_airport, job.date.strftime('%Y-%m-%d'))
+
+def run_crawler_once(crawler, supervisor=None):
+    """ Runs the crawler a single time and returns the signature of the failure, if any """
+    crawler.errors = []
+    job_name = f"{crawler.airline_name} {crawler.departure_airport} - {crawler.destination_airport}"
+    with supervisor.job(job_name) if supervisor else nullcontext():
+        try:
+            crawler.run()
+        except Exception as e:
+            crawler.log_to_csv('ERROR', f'Crawler aborted: {type(e).__name__}', str(e))
+            crawler.stop_driver(force=True)
+            return f'{type(e).__name__}: {e}'
+    return crawler.errors[0] if crawler.errors else None
+
+def run_crawler_with_expected_results(crawler, expected_count, breaker, supervisor=None, admitted=False, retries=3):
+    """
+    Function to run the crawler and verify that the expected number of results has been saved.
+    With admitted=True the caller has already asked the circuit breaker whether the job may run.
+    retries is the number of times a failed crawl is repeated, 0 when the caller retries the job itself.
+    """
+    if not admitted and not breaker.allow(crawler.airline_name):
+        print(f"Circuit for {crawler.airline_name} is open, skipping {crawler.departure_airport} - {crawler.destination_airport}")
+        return False
+
+    initial_count = crawler.results_saved
+    attempts = 0
+    while True:
+        signature = run_crawler_once(crawler, supervisor)
+        new_results = crawler.results_saved - initial_count
+
+        # Check if the expected number of results has been saved
+        if new_results >= expected_count:
+            breaker.record_success(crawler.airline_name)
+            return True
+
+        if attempts >= retries:
+            # One failure per job, so a single route without results does not open the circuit of the airline
+            breaker.record_failure(crawler.airline_name, signature or 'No results saved')
+            return False
+        print(f"Expected {expected_count} new results, found {new_results}. Repeating the crawling process...")
+        time.sleep(10)  # Short pause to circumvent potential temporary issues
+        attempts += 1
@@ -0,0 +1,428 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from quality_gate import QualityGate, append_results
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    cycle TEXT NOT NULL,
+    airline TEXT NOT NULL,
+    departure_airport TEXT NOT NULL,
+    destination_airport TEXT NOT NULL,
+    date TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    submitted REAL,
+    finished REAL,
+    error TEXT,
+    UNIQUE (cycle, airline, departure_airport, destination_airport, date)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires);
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    started REAL,
+    last_heartbeat REAL,
+    jobs_done INTEGER NOT NULL DEFAULT 0,
+    jobs_failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    job_id INTEGER NOT NULL,
+    node_id TEXT NOT NULL,
+    airline TEXT NOT NULL,
+    data TEXT NOT NULL,
+    received REAL NOT NULL,
+    exported INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class JobBroker:
+    """
+    A job queue for crawling with several worker nodes, kept in a SQLite database on a shared disk.
+
+    Nodes lease one (airline, route, date) job at a time. A lease is valid for lease_seconds and is extended
+    by the heartbeats of the node, so the jobs of a node that crashed or lost its connection expire and are
+    leased again by the other nodes. The result rows of finished jobs are shipped back into the database,
+    from where export_results() appends them to the usual results files.
+
+    The database uses SQLite's default rollback journal instead of WAL, because WAL needs shared memory and
+    does not work on network file systems.
+    """
+
+    def __init__(self, path='broker/crawl_broker.db', lease_seconds=900, max_attempts=3, clock=time.time):
+        """
+        Initializes the JobBroker and creates the database if needed.
+
+        Parameters:
+            path (str): The path of the SQLite database, on a disk all nodes can access.
+            lease_seconds (float): The number of seconds a lease is valid without a heartbeat.
+            max_attempts (int): The number of leases after which a failing job is given up.
+            clock (callable): Returns the current time in seconds, replaceable for testing.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        """ Returns the database connection of the current thread """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: transactions are started explicitly with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            self.local.connection = connection
+        return connection
+
+    def transaction(self):
+        """ Starts a write transaction, which locks the database against other writers until commit """
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def submit(self, jobs, cycle=None):
+        """
+        Adds crawling jobs to the queue. Jobs already queued for the same cycle are not added twice, failed
+        ones are queued again.
+
+        Parameters:
+            jobs (list): CrawlJobs with IATA codes and datetime.date departure dates.
+            cycle (str): The crawling day the jobs belong to, today if not given.
+
+        Returns:
+            int: The number of jobs added or queued again.
+        """
+        cycle = cycle or datetime.now().strftime('%Y-%m-%d')
+        now = self.clock()
+        connection = self.transaction()
+        try:
+            added = 0
+            for job in jobs:
+                cursor = connection.execute(
+                    """INSERT INTO jobs (cycle, airline, departure_airport, destination_airport, date, submitted)
+                       VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (cycle, airline, departure_airport, destination_airport, date)
+                       DO UPDATE SET status = 'pending', attempts = 0, error = NULL WHERE status = 'failed'""",
+                    (cycle, job.airline, job.departure_airport, job.destination_airport,
+                     job.date.strftime('%Y-%m-%d'), now)
+                )
+                added += cursor.rowcount
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return added
+
+    def register(self, node_id):
+        """ Registers a worker node, or updates it when the node restarts """
+        now = self.clock()
+        self.connection().execute(
+            """INSERT INTO nodes (node_id, host, pid, started, last_heartbeat) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (node_id) DO UPDATE SET host = excluded.host, pid = excluded.pid,
+               started = excluded.started, last_heartbeat = excluded.last_heartbeat""",
+            (node_id, socket.gethostname(), os.getpid(), now, now)
+        )
+
+    def heartbeat(self, node_id):
+        """
+        Signals that a node is alive and extends the leases of all jobs it is working on.
+
+        Returns:
+            int: The number of extended leases.
+        """
+        now = self.clock()
+        connection = self.transaction()
+        try:
+            connection.execute('UPDATE nodes SET last_heartbeat = ? WHERE node_id = ?', (now, node_id))
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE status = 'leased' AND lease_owner = ?",
+                (now + self.lease_seconds, node_id)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.rowcount
+
+    def lease(self, node_id, prefer=None, exclude=()):
+        """
+        Leases the next job to a node. Pending jobs and jobs whose lease has expired, e.g. because their node
+        crashed, can be leased. A job whose lease expired max_attempts times is given up, as it may be what
+        made its nodes crash.
+
+        Parameters:
+            node_id (str): The node asking for work.
+            prefer (tuple): (airline, departure_airport) of the previous job of the worker; jobs of the same
+                airline and origin are handed out first, as they continue on the same website.
+            exclude (list): Airlines the node does not want jobs of, e.g. because their circuit is open.
+
+        Returns:
+            sqlite3.Row: The leased job, or None if there is nothing to do right now.
+        """
+        airline, origin = prefer or (None, None)
+        exclude = list(exclude)
+        now = self.clock()
+        connection = self.transaction()
+        try:
+            connection.execute(
+                """UPDATE jobs SET status = 'failed', lease_owner = NULL, lease_expires = NULL, finished = ?,
+                          error = 'Lease expired after the last attempt'
+                   WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                (now, now, self.max_attempts)
+            )
+            row = connection.execute(
+                f"""SELECT * FROM jobs
+                   WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ? AND attempts < ?))
+                   AND airline NOT IN ({', '.join('?' * len(exclude))})
+                   ORDER BY (airline = ? AND departure_airport = ?) DESC, cycle, date, airline, id
+                   LIMIT 1""",
+                [now, self.max_attempts] + exclude + [airline, origin]
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            connection.execute(
+                """UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                   WHERE id = ?""",
+                (node_id, now + self.lease_seconds, row['id'])
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        if row['status'] == LEASED:
+            print(f"------------------ {node_id} took over job {row['id']} from {row['lease_owner']} (lease expired) ------------------")
+        return connection.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+
+    def complete(self, job_id, node_id, rows):
+        """
+        Marks a job as done and stores its result rows.
+
+        If another node has already completed the job (after taking it over from this node), the rows are
+        discarded so that no route is stored twice.
+
+        Returns:
+            bool: True if the rows have been stored.
+        """
+        now = self.clock()
+        connection = self.transaction()
+        try:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, lease_owner = ?, error = NULL WHERE id = ? AND status != 'done'",
+                (now, node_id, job_id)
+            )
+            stored = cursor.rowcount == 1
+            if stored:
+                airline = connection.execute('SELECT airline FROM jobs WHERE id = ?', (job_id,)).fetchone()['airline']
+                connection.executemany(
+                    'INSERT INTO results (job_id, node_id, airline, data, received) VALUES (?, ?, ?, ?, ?)',
+                    [(job_id, node_id, airline, json.dumps(row), now) for row in rows]
+                )
+                connection.execute('UPDATE nodes SET jobs_done = jobs_done + 1 WHERE node_id = ?', (node_id,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return stored
+
+    def fail(self, job_id, node_id, error=None):
+        """
+        Returns a failed job to the queue, or gives it up after max_attempts leases.
+
+        Returns:
+            str: The new status of the job.
+        """
+        connection = self.transaction()
+        try:
+            row = connection.execute('SELECT status, attempts, lease_owner FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            # The job may have been taken over and finished by another node in the meantime
+            if row['status'] != LEASED or row['lease_owner'] != node_id:
+                connection.execute('COMMIT')
+                return row['status']
+            status = FAILED if row['attempts'] >= self.max_attempts else PENDING
+            connection.execute(
+                'UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, error = ?, finished = ? WHERE id = ?',
+                (status, error, self.clock() if status == FAILED else None, job_id)
+            )
+            connection.execute('UPDATE nodes SET jobs_failed = jobs_failed + 1 WHERE node_id = ?', (node_id,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return status
+
+    def release(self, job_id, node_id):
+        """ Returns a leased job to the queue without counting the attempt, e.g. when the node cannot run it now """
+        self.connection().execute(
+            """UPDATE jobs SET status = 'pending', lease_owner = NULL, lease_expires = NULL, attempts = attempts - 1
+               WHERE id = ? AND status = 'leased' AND lease_owner = ?""",
+            (job_id, node_id)
+        )
+
+    def outstanding(self):
+        """ Returns the number of jobs that are pending or being worked on """
+        return self.connection().execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')").fetchone()[0]
+
+    def status(self):
+        """
+        Summarizes the queue and the nodes.
+
+        Returns:
+            tuple: ({status: number of jobs}, list of node rows)
+        """
+        connection = self.connection()
+        counts = {row['status']: row['count'] for row in
+                  connection.execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status')}
+        nodes = connection.execute('SELECT * FROM nodes ORDER BY node_id').fetchall()
+        return counts, nodes
+
+    def export_results(self, results_dir='results'):
+        """
+        Appends the result rows that have not been exported yet to results/results_<airline>.csv.
+
+        The rows of every airline are marked as exported in the same transaction right after its file was
+        written, so a failure while exporting another airline does not export them a second time.
+
+        Returns:
+            int: The number of exported rows.
+        """
+        connection = self.connection()
+        airlines = [row['airline'] for row in
+                    connection.execute('SELECT DISTINCT airline FROM results WHERE exported = 0 ORDER BY airline')]
+        os.makedirs(results_dir, exist_ok=True)
+        exported = 0
+        for airline in airlines:
+            connection = self.transaction()
+            try:
+                rows = connection.execute('SELECT id, data FROM results WHERE exported = 0 AND airline = ? ORDER BY id',
+                                          (airline,)).fetchall()
+                if rows:
+                    results_file = os.path.join(results_dir, f'results_{airline}.csv')
+                    append_results(results_file, [json.loads(row['data']) for row in rows])
+                    connection.executemany('UPDATE results SET exported = 1 WHERE id = ?', [(row['id'],) for row in rows])
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            exported += len(rows)
+        return exported
+
+
+def default_node_id():
+    """ Returns a node id unique per host and process """
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def run_worker(broker, node_id=None, workers=1, heartbeat_interval=30, poll_interval=10, wait=False, configure=None):
+    """
+    Runs a worker node: leases jobs from the broker and crawls them until the queue is empty.
+
+    Every worker thread drives its own browser. A heartbeat thread keeps the leases of the node alive while
+    the jobs run. The results files of the node are written to results/nodes/<node_id>/ as a local copy,
+    the shared store is the broker database.
+
+    Parameters:
+        broker (JobBroker): The broker to pull jobs from.
+        node_id (str): The name of this node, unique per host and process if not given.
+        workers (int): The number of jobs this node runs at the same time.
+        heartbeat_interval (float): The number of seconds between two heartbeats.
+        poll_interval (float): The number of seconds to wait when all remaining jobs are leased by other nodes.
+        wait (bool): Keeps polling for new jobs when the queue is empty instead of exiting.
+        configure (callable): Called with every crawler before it runs, e.g. to point it to a mock website.
+
+    Returns:
+        list: One (job id, success) tuple per job this node worked on.
+    """
+    from base_crawler import BaseCrawler
+    from browser_supervisor import BrowserSupervisor
+    from circuit_breaker import CircuitBreaker
+    from crawl_jobs import CRAWLERS, CrawlJob, create_crawler, run_crawler_with_expected_results
+
+    node_id = node_id or default_node_id()
+    broker.register(node_id)
+    # Every node keeps its own pid registry, so only browsers of nodes that are no longer running are reaped
+    supervisor = BrowserSupervisor(owner=node_id)
+    supervisor.reap_orphans()
+    BaseCrawler.supervisor = supervisor
+    BaseCrawler.results_dir = os.path.join('results', 'nodes', node_id)
+    BaseCrawler.quality_gate = QualityGate()
+    breaker = CircuitBreaker()
+
+    stop = threading.Event()
+
+    def send_heartbeats():
+        while not stop.wait(heartbeat_interval):
+            try:
+                broker.heartbeat(node_id)
+            except sqlite3.Error as e:
+                # A missed heartbeat only shortens the lease, the next one may succeed again
+                print(f"Heartbeat of {node_id} failed: {e}")
+
+    def work():
+        outcomes = []
+        prefer = None
+        while True:
+            blocked = [airline for airline in CRAWLERS if breaker.blocked(airline)]
+            row = broker.lease(node_id, prefer, exclude=blocked)
+            if row is None:
+                if wait or broker.outstanding():
+                    # Jobs leased by other nodes may still expire, and open circuits close again after the cooldown
+                    time.sleep(poll_interval)
+                    continue
+                return outcomes
+            job = CrawlJob(row['airline'], row['departure_airport'], row['destination_airport'],
+                           datetime.strptime(row['date'], '%Y-%m-%d').date())
+            prefer = (job.airline, job.departure_airport)
+            if not breaker.allow(job.airline):
+                # Another worker thread of this node opened the circuit in the meantime
+                broker.release(row['id'], node_id)
+                continue
+            try:
+                crawler = create_crawler(job)
+                if configure:
+                    configure(crawler)
+                # The broker retries failed jobs with a new lease, so every lease is a single crawl
+                success = run_crawler_with_expected_results(crawler, 1, breaker, supervisor, admitted=True, retries=0)
+                error = None if success else (crawler.errors[0] if crawler.errors else 'No results saved')
+            except Exception as e:
+                crawler, success, error = None, False, f'{type(e).__name__}: {e}'
+            if success:
+                broker.complete(row['id'], node_id, crawler.saved_rows)
+            else:
+                broker.fail(row['id'], node_id, error)
+            outcomes.append((row['id'], success))
+
+    heartbeat = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeat.start()
+    print(f"------------------ Worker node {node_id} started with {workers} workers ------------------")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(work) for _ in range(workers)]
+            results = [outcome for future in futures for outcome in future.result()]
+    finally:
+        stop.set()
+        heartbeat.join()
+    print(f"------------------ Worker node {node_id} finished: {sum(1 for _, success in results if success)}/{len(results)} jobs succeeded ------------------")
+    return results
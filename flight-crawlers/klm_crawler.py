@@ -1,9 +1,9 @@
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from base_crawler import BaseCrawler
+from normalization import normalize_duration, parse_price
 from selenium.webdriver.chrome.service import Service
 from bs4 import BeautifulSoup
 import time
@@ -76,9 +76,13 @@ class KLMCrawler(BaseCrawler):
         Waits for the 'Accept Cookies' button to become clickable, clicks it, and logs the process.
         In case of failure, logs the error.
         """
+        if self.session_reused:
+            # The banner has already been accepted in this browser session
+            self.log_to_csv('INFO', 'Cookies already accepted in this browser session')
+            return
         try:
-            decline_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "#accept_cookies_btn"))
+            decline_button = self.wait_for(
+                'accept_cookies', EC.element_to_be_clickable((By.CSS_SELECTOR, "#accept_cookies_btn"))
             )
             decline_button.click()
             time.sleep(3)
@@ -108,12 +112,12 @@ class KLMCrawler(BaseCrawler):
         In case of failure, logs the error.
         """
         try:
-            dropdown_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "#mat-input-0"))
+            dropdown_button = self.wait_for(
+                'select_one_way_flight.dropdown', EC.element_to_be_clickable((By.CSS_SELECTOR, "#mat-input-0"))
             )
             dropdown_button.click()
-            one_way_option = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "#mat-input-0 > option:nth-child(2)"))
+            one_way_option = self.wait_for(
+                'select_one_way_flight.option', EC.element_to_be_clickable((By.CSS_SELECTOR, "#mat-input-0 > option:nth-child(2)"))
             )
             one_way_option.click()
             time.sleep(5)
@@ -130,8 +134,8 @@ class KLMCrawler(BaseCrawler):
         """
         try:
             for _ in range(2):  
-                departure_button = WebDriverWait(self.driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, '//*[@id="mat-input-5"]'))
+                departure_button = self.wait_for(
+                    'enter_departure_airport.field', EC.element_to_be_clickable((By.XPATH, '//*[@id="mat-input-5"]'))
                 )
                 departure_button.click()
                 time.sleep(1)  
@@ -139,8 +143,8 @@ class KLMCrawler(BaseCrawler):
             departure_button.clear()
             departure_button.send_keys(airport)
             departure_button.send_keys(Keys.RETURN)
-            WebDriverWait(self.driver, 10).until(
-                EC.text_to_be_present_in_element_value((By.XPATH, '//*[@id="mat-input-5"]'), airport)
+            self.wait_for(
+                'enter_departure_airport.value', EC.text_to_be_present_in_element_value((By.XPATH, '//*[@id="mat-input-5"]'), airport)
             )
             self.log_to_csv('INFO', f'Entered departure airport: {airport}')
         except Exception as e:
@@ -155,8 +159,8 @@ class KLMCrawler(BaseCrawler):
         """
         try:
             for _ in range(2):  
-                destination_input_field = WebDriverWait(self.driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, '//*[@id="mat-input-6"]'))
+                destination_input_field = self.wait_for(
+                    'enter_destination_airport.field', EC.element_to_be_clickable((By.XPATH, '//*[@id="mat-input-6"]'))
                 )
                 destination_input_field.click()
                 time.sleep(1) 
@@ -164,8 +168,8 @@ class KLMCrawler(BaseCrawler):
             destination_input_field.clear()
             destination_input_field.send_keys(airport)
             destination_input_field.send_keys(Keys.RETURN)
-            WebDriverWait(self.driver, 10).until(
-                EC.text_to_be_present_in_element_value((By.XPATH, '//*[@id="mat-input-6"]'), airport)
+            self.wait_for(
+                'enter_destination_airport.value', EC.text_to_be_present_in_element_value((By.XPATH, '//*[@id="mat-input-6"]'), airport)
             )
             self.log_to_csv('INFO', f'Entered destination airport: {airport}')
         except Exception as e:
@@ -179,28 +183,28 @@ class KLMCrawler(BaseCrawler):
         In case of an error, it logs the issue.
         """
         try:
-            date_picker_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-search-widget-expandable"]/div/bw-datepicker/bwc-form-input-container/div/label/mat-form-field/div[1]/div/div[2]/bwc-date-picker-toggle-button/button/span[3]'))
+            date_picker_button = self.wait_for(
+                'enter_departure_date.picker', EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-search-widget-expandable"]/div/bw-datepicker/bwc-form-input-container/div/label/mat-form-field/div[1]/div/div[2]/bwc-date-picker-toggle-button/button/span[3]'))
             )
             date_picker_button.click()
             self.log_to_csv('INFO', 'Opened date picker successfully')
 
             day, month, year = date.split('.')
             day_xpath = f'//*[@id="bwc-day_{year}_{int(month)-1}_{int(day)}"]'
-            day_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, day_xpath))
+            day_button = self.wait_for(
+                'enter_departure_date.day', EC.element_to_be_clickable((By.XPATH, day_xpath))
             )
             self.driver.execute_script("arguments[0].scrollIntoView(true);", day_button)
             day_button.click()
 
             confirm_button_xpath = '/html/body/div[3]/div[2]/div[2]/bwc-calendar/div/div[3]/button[2]'
-            confirm_button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, confirm_button_xpath))
+            confirm_button = self.wait_for(
+                'enter_departure_date.confirm', EC.element_to_be_clickable((By.XPATH, confirm_button_xpath))
             )
             self.driver.execute_script("arguments[0].scrollIntoView(true);", confirm_button)
             self.driver.execute_script("arguments[0].click();", confirm_button)
-            WebDriverWait(self.driver, 10).until(
-                EC.invisibility_of_element_located((By.XPATH, confirm_button_xpath))
+            self.wait_for(
+                'enter_departure_date.close', EC.invisibility_of_element_located((By.XPATH, confirm_button_xpath))
             )
             self.log_to_csv('INFO', f'Entered departure date: {date}')
 
@@ -241,14 +245,14 @@ class KLMCrawler(BaseCrawler):
             try:
                 self.verify_and_fill_fields()
 
-                search_button = WebDriverWait(self.driver, 10).until(
-                    EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-search-widget-form-15hCmh4vxh"]/div/div[2]/div[2]/button'))
+                search_button = self.wait_for(
+                    'search_flights.button', EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-search-widget-form-15hCmh4vxh"]/div/div[2]/div[2]/button'))
                 )
                 self.driver.execute_script("arguments[0].click();", search_button)
                 self.log_to_csv('INFO', 'Pressed Enter to search for flights')
 
-                search_results = WebDriverWait(self.driver, 30).until(
-                    EC.presence_of_element_located((By.XPATH, '/html/body/bw-app/bwc-page-template/mat-sidenav-container/mat-sidenav-content/div/main/div/bwsfe-search-result'))
+                search_results = self.wait_for(
+                    'search_flights.results', EC.presence_of_element_located((By.XPATH, '/html/body/bw-app/bwc-page-template/mat-sidenav-container/mat-sidenav-content/div/main/div/bwsfe-search-result')), timeout=30
                 )
                 self.log_to_csv('INFO', 'Successfully navigated to the search results page')
                 return  
@@ -267,13 +271,13 @@ class KLMCrawler(BaseCrawler):
         In case of failure, logs the error.
         """
         try:
-            dropdown = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-flight-list-result-filters__select-0"]'))
+            dropdown = self.wait_for(
+                'select_filter_option.dropdown', EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-flight-list-result-filters__select-0"]'))
             )
             dropdown.click()
 
-            option = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-flight-list-result-filters__select-0"]/option[1]'))
+            option = self.wait_for(
+                'select_filter_option.option', EC.element_to_be_clickable((By.XPATH, '//*[@id="bw-flight-list-result-filters__select-0"]/option[1]'))
             )
             option.click()
             self.log_to_csv('INFO', 'Option selected from the dropdown')
@@ -287,16 +291,18 @@ class KLMCrawler(BaseCrawler):
         Checks and selects the economy class option for a flight.
 
         Iterates over flight options until it finds the economy class, selects it, and logs the action.
-        Logs errors and continues to the next option if the current one fails.
+        Logs errors and continues to the next option if the current one fails. Gives up after max_flights
+        options, e.g. if the results page did not load at all.
         """
+        max_flights = 10
         index = 1
-        while True:
+        while index <= max_flights:
             try:
                 container_xpath = f'//*[@id="flight{index}cabinClassCardTabECONOMY"]'
                 clickable_element_xpath = f'//*[@id="flight{index}cabinClassCardTabECONOMY"]/div/div'
 
-                container = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, container_xpath))
+                container = self.wait_for(
+                    'check_and_select_economy', EC.presence_of_element_located((By.XPATH, container_xpath))
                 )
 
                 clickable_element = container.find_element(By.XPATH, clickable_element_xpath)
@@ -311,6 +317,9 @@ class KLMCrawler(BaseCrawler):
                 index += 1  
                 continue 
 
+        self.log_to_csv('ERROR', f'No economy option found in the first {max_flights} flights')
+        return None
+
     def extract_price(self):
         """
         Extracts the flight price from the displayed elements on the page.
@@ -351,8 +360,8 @@ class KLMCrawler(BaseCrawler):
         """
         try:
             button_xpath = f'/html/body/bw-app/bwc-page-template/mat-sidenav-container/mat-sidenav-content/div/main/div/bwsfe-search-result/div/section/bwsfe-search-result-list/section/ol/li[{index}]/bwsfc-flight-offer/div/div[1]/div[2]/button'
-            button = WebDriverWait(self.driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, button_xpath))
+            button = self.wait_for(
+                'click_button_in_opened_tab', EC.element_to_be_clickable((By.XPATH, button_xpath))
             )
             self.driver.execute_script("arguments[0].click();", button)
             self.log_to_csv('INFO', 'Clicked button in the opened tab successfully')
@@ -375,20 +384,20 @@ class KLMCrawler(BaseCrawler):
             departure_time_xpath = '//*[@id="mat-mdc-dialog-0"]/div/div/bwsfc-flight-details/mat-dialog-content/ol/li[2]/div/div[3]/bwsfc-segment-nodes/div/bwsfc-segment-station-node[1]/div[2]/span'
             transit_time_xpath = '//*[@id="mat-mdc-dialog-0"]/div/div/bwsfc-flight-details/mat-dialog-content/ol/li[1]/div[2]/div[2]'
 
-            total_flight_duration_element = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, total_flight_duration_xpath))
+            total_flight_duration_element = self.wait_for(
+                'extract_flight_details.duration', EC.presence_of_element_located((By.XPATH, total_flight_duration_xpath))
             )
             total_flight_duration = total_flight_duration_element.text
             self.log_to_csv('INFO', 'Total flight duration extracted successfully')
 
-            landing_time_element = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, landing_time_xpath))
+            landing_time_element = self.wait_for(
+                'extract_flight_details.arrival', EC.presence_of_element_located((By.XPATH, landing_time_xpath))
             )
             landing_time = landing_time_element.text
             self.log_to_csv('INFO', 'Landing time extracted successfully')
 
-            departure_time_element = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, departure_time_xpath))
+            departure_time_element = self.wait_for(
+                'extract_flight_details.departure', EC.presence_of_element_located((By.XPATH, departure_time_xpath))
             )
             departure_time = departure_time_element.text
             self.log_to_csv('INFO', 'Departure time extracted successfully')
@@ -420,41 +429,18 @@ class KLMCrawler(BaseCrawler):
         """
         Formats the flight duration from the provided string into HH:MM format.
 
-        Processes the duration string, removes unnecessary text, and converts hours and minutes to the correct format.
+        Accepts the texts of the details dialog such as '4h 25min' or 'Transferzeit: 2h 10min'. A missing
+        duration, e.g. the transit time of a nonstop flight, is returned as '00:00'.
         """
-        if "Transferzeit:" in duration:
-            duration = duration.replace("Transferzeit:", "").strip()
-        duration = duration.replace('h', ' ').replace('min', '').strip()
-        hours, minutes = duration.split()
-        return f"{int(hours):02d}:{int(minutes):02d}"
+        return normalize_duration(duration, default="00:00")
 
     def save_results(self, flight_details):
         """
         Saves the scraped data to a CSV file.
         """
-        results_file = f'results/results_{self.airline_name}.csv'
-        fieldnames = [
-            'airline_name', 'crawling_date', 'departure_airport', 
-            'destination_airport', 'date', 'travel_duration', 
-            'departure_time', 'arrival_time', 'transit', 
-            'transit_duration', 'price'
-        ]
-
-        if not os.path.exists('results'):
-            os.makedirs('results')
-
         flight_details['travel_duration'] = self.format_duration(flight_details['travel_duration'])
         flight_details['transit_duration'] = self.format_duration(flight_details['transit_duration'])
         flight_details['date'] = flight_details['date'].replace('.', '-')
-        flight_details['price'] = float(flight_details['price'].replace(' EUR', '').replace('.', '').replace(',', '.'))
-
-        file_exists = os.path.isfile(results_file)
-        mode = 'a' if file_exists else 'w'
-
-        with open(results_file, mode, newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(flight_details)
+        flight_details['price'] = parse_price(flight_details['price'], locale='de')
 
-        self.log_to_csv('INFO', f'Results saved to {results_file}')
+        self.write_results([flight_details])
@@ -0,0 +1,458 @@
+import argparse
+import csv
+import glob
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+from airports import to_iata
+
+# The crawler logs (logs/logging_<airline>.csv) and the waits of step_timeouts.py (logs/step_latencies_<airline>.csv)
+# in one SQLite database with indexes by airline, day, step and route. Every log line gets the crawling step
+# it belongs to and the job (one route in one browser session) it was written in, so failure rates, retries
+# and time lost can be counted with SQL instead of grep. The files only grow, so each run only reads the
+# records appended since the previous one.
+
+LOG_DIR = 'logs'
+DEFAULT_DB = os.path.join(LOG_DIR, 'log_analytics.db')
+LEVELS = {'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'}
+FINGERPRINT_BYTES = 256
+# Databases of another version only hold what was read from the logs, so they are built again
+SCHEMA_VERSION = 2
+
+# Crawling step of a log message, the first matching pattern wins (case insensitive)
+STEP_PATTERNS = [
+    ('abort', r'crawler aborted'),
+    ('start_browser', r'webdriver for .* started|reusing selenium webdriver'),
+    ('stop_browser', r'webdriver for .* stopped|stopping selenium webdriver|keeping selenium webdriver'),
+    ('build_url', r'flight data url'),
+    ('open_url', r'url opened|opening url|page to load'),
+    ('cookies', r'cookie'),
+    ('one_way', r'one[- ]way'),
+    ('departure_airport', r'departure airport'),
+    ('destination_airport', r'destination (airport|field)'),
+    ('departure_date', r'departure date|date picker'),
+    ('search', r'search'),
+    ('sort', r'sort'),
+    ('filter', r'dropdown|filter option|empty area'),
+    ('economy', r'economy option|processing flight'),
+    ('price', r'price|mat-tab-content'),
+    ('transit', r'transit'),
+    ('flight_times', r'flight duration|landing time|departure time'),
+    ('details', r'details|opened tab'),
+    ('scrape', r'flight data|flight results'),
+    ('save', r'results saved|result quarantined'),
+]
+STEP_PATTERNS = [(step, re.compile(pattern, re.IGNORECASE)) for step, pattern in STEP_PATTERNS]
+# Messages of a step that is tried again
+RETRY_PATTERN = re.compile(r'attempt|again|retry', re.IGNORECASE)
+# Steps at the beginning of a job; one of them after later steps means a new job, even without a stop
+JOB_START_STEPS = {'build_url', 'open_url', 'start_browser'}
+JOB_END_STEPS = {'stop_browser', 'abort'}
+ROUTE_PATTERN = re.compile(r'\((.+?) - (.+?)\)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    records INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    record INTEGER NOT NULL,
+    airline TEXT NOT NULL,
+    day TEXT NOT NULL,
+    time TEXT,
+    level TEXT NOT NULL,
+    step TEXT NOT NULL,
+    message TEXT NOT NULL,
+    error TEXT,
+    retry INTEGER NOT NULL,
+    job INTEGER NOT NULL,
+    departure_airport TEXT,
+    destination_airport TEXT,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS events_step ON events (airline, day, step, level);
+CREATE INDEX IF NOT EXISTS events_route ON events (airline, departure_airport, destination_airport, day);
+CREATE INDEX IF NOT EXISTS events_job ON events (source, job);
+CREATE TABLE IF NOT EXISTS waits (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    airline TEXT NOT NULL,
+    day TEXT NOT NULL,
+    time TEXT,
+    step TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS waits_step ON waits (airline, step, outcome, day);
+"""
+
+
+def classify(message):
+    """ Returns the crawling step of a log message, 'other' if it matches none """
+    for step, pattern in STEP_PATTERNS:
+        if pattern.search(message):
+            return step
+    return 'other'
+
+
+def parse_log_row(row):
+    """
+    Parses a row of a crawler log.
+
+    The logs have been written in three layouts: date, level, message (the first Qatar Airways log), date,
+    level, message, error, and date, time, level, message, error. The header of new log files has always
+    named the time column, while the rows were written without it, so the position of the level decides.
+
+    Returns:
+        dict: day, time, level, message and error, or None for headers and rows that are no log line.
+    """
+    if len(row) >= 3 and row[1].strip() in LEVELS:
+        day, clock, rest = row[0], None, row[1:]
+    elif len(row) >= 4 and row[2].strip() in LEVELS:
+        day, clock, rest = row[0], row[1] or None, row[2:]
+    else:
+        return None
+    try:
+        datetime.strptime(day.strip(), '%Y-%m-%d')
+    except ValueError:
+        return None
+    error = ','.join(rest[2:]).strip() or None
+    return {'day': day.strip(), 'time': clock, 'level': rest[0].strip(), 'message': rest[1].strip(), 'error': error}
+
+
+def route_of(message):
+    """ Returns (departure, destination) as IATA codes if the message names them, else None for each """
+    match = ROUTE_PATTERN.search(message)
+    if match:
+        airports = match.groups()
+    elif ':' in message and re.match(r'entered (departure|destination) airport', message, re.IGNORECASE):
+        airport = message.split(':', 1)[1]
+        airports = (airport, None) if 'departure' in message.lower() else (None, airport)
+    else:
+        return None, None
+    codes = []
+    for airport in airports:
+        try:
+            codes.append(to_iata(airport) if airport else None)
+        except ValueError:
+            codes.append(airport.strip())
+    return tuple(codes)
+
+
+def seconds_between(day, first, second):
+    """ Seconds from the time first to the time second of a day, None if one is missing """
+    if not first or not second:
+        return None
+    try:
+        start = datetime.strptime(f"{day} {first}", '%Y-%m-%d %H:%M:%S')
+        end = datetime.strptime(f"{day} {second}", '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+    return max((end - start).total_seconds(), 0.0)
+
+
+def file_fingerprint(handle, offset):
+    """ Fingerprint of the bytes before the offset, to notice files that were rewritten instead of appended to """
+    handle.seek(max(offset - FINGERPRINT_BYTES, 0))
+    return hashlib.sha1(handle.read(min(offset, FINGERPRINT_BYTES))).hexdigest()
+
+
+class LogStore:
+    """
+    The parsed crawler logs in a SQLite database.
+
+    Parameters:
+        path (str): The database file.
+    """
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.connection.executescript('DROP TABLE IF EXISTS sources; DROP TABLE IF EXISTS events; DROP TABLE IF EXISTS waits;')
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def close(self):
+        self.connection.close()
+
+    def new_records(self, path):
+        """
+        Returns the complete CSV records appended to a file since the last ingestion and remembers the new
+        position, which is always the end of a record. A record that is still being written, e.g. a quoted
+        error message with line breaks of which only the first lines are in the file, is left for the next run.
+
+        If the file was rewritten, its rows are removed from the database and it is read from the start.
+
+        Returns:
+            tuple: The records (lists of fields) and the number of the first one in the file.
+        """
+        source = self.connection.execute('SELECT * FROM sources WHERE path = ?', (path,)).fetchone()
+        with open(path, 'rb') as handle:
+            size = os.fstat(handle.fileno()).st_size
+            offset, first_record = (source['offset'], source['records']) if source else (0, 0)
+            if source and (size < offset or file_fingerprint(handle, offset) != source['fingerprint']):
+                self.connection.execute('DELETE FROM events WHERE source = ?', (path,))
+                self.connection.execute('DELETE FROM waits WHERE source = ?', (path,))
+                offset, first_record = 0, 0
+            handle.seek(offset)
+            data = handle.read()
+
+            # The csv reader asks for the next line only while a record is incomplete, so the bytes read when
+            # it returns a record end with that record. A record returned after the data ran out is incomplete.
+            read = {'bytes': 0, 'done': False}
+
+            def complete_lines():
+                for line in io.BytesIO(data):
+                    if not line.endswith(b'\n'):
+                        break
+                    read['bytes'] += len(line)
+                    yield line.decode('utf-8', errors='replace')
+                read['done'] = True
+
+            records, end = [], 0
+            for record in csv.reader(complete_lines()):
+                if read['done']:
+                    break
+                records.append(record)
+                end = read['bytes']
+            fingerprint = file_fingerprint(handle, offset + end)
+        self.connection.execute(
+            """INSERT INTO sources (path, offset, fingerprint, records) VALUES (?, ?, ?, ?)
+               ON CONFLICT (path) DO UPDATE SET offset = excluded.offset, fingerprint = excluded.fingerprint,
+               records = excluded.records""",
+            (path, offset + end, fingerprint, first_record + len(records))
+        )
+        return records, first_record
+
+    def ingest_log(self, path, airline):
+        """ Adds the new records of a crawler log, returns their number """
+        records, first_record = self.new_records(path)
+        # The job of the last stored record continues, unless it had ended
+        last = self.connection.execute(
+            'SELECT * FROM events WHERE source = ? ORDER BY record DESC LIMIT 1', (path,)
+        ).fetchone()
+        job = {'number': 0, 'steps': set(), 'ended': True, 'time': None, 'departure': None, 'destination': None}
+        if last:
+            steps = {row['step'] for row in self.connection.execute(
+                'SELECT DISTINCT step FROM events WHERE source = ? AND job = ?', (path, last['job']))}
+            job = {'number': last['job'], 'steps': steps, 'ended': last['step'] in JOB_END_STEPS, 'time': last['time'],
+                   'departure': last['departure_airport'], 'destination': last['destination_airport']}
+
+        rows = []
+        for number, row in enumerate(records, start=first_record + 1):
+            event = parse_log_row(row)
+            if event is None:
+                continue
+            step = classify(event['message'])
+            if job['ended'] or (step in JOB_START_STEPS and job['steps'] - JOB_START_STEPS):
+                job = {'number': job['number'] + 1, 'steps': set(), 'ended': False, 'time': None,
+                       'departure': None, 'destination': None}
+            departure, destination = route_of(event['message'])
+            if (departure and departure != job['departure']) or (destination and destination != job['destination']):
+                job['departure'], job['destination'] = departure or job['departure'], destination or job['destination']
+                # Records of the job before the route was named
+                for earlier in rows:
+                    if earlier[10] == job['number']:
+                        earlier[11], earlier[12] = job['departure'], job['destination']
+                self.connection.execute(
+                    'UPDATE events SET departure_airport = ?, destination_airport = ? WHERE source = ? AND job = ?',
+                    (job['departure'], job['destination'], path, job['number'])
+                )
+            seconds = seconds_between(event['day'], job['time'], event['time'])
+            rows.append([path, number, airline, event['day'], event['time'], event['level'], step, event['message'],
+                         event['error'], int(bool(RETRY_PATTERN.search(event['message']))), job['number'],
+                         job['departure'], job['destination'], seconds])
+            job['steps'].add(step)
+            job['time'] = event['time'] or job['time']
+            job['ended'] = step in JOB_END_STEPS
+        self.connection.executemany(
+            """INSERT INTO events (source, record, airline, day, time, level, step, message, error, retry, job,
+                                   departure_airport, destination_airport, seconds)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        return len(rows)
+
+    def ingest_waits(self, path, airline):
+        """ Adds the new waits of a step latency file, returns their number """
+        records, _ = self.new_records(path)
+        rows = []
+        for row in records:
+            if len(row) < 5 or row[0] == 'date':
+                continue
+            try:
+                rows.append((path, airline, row[0], row[1] or None, row[2], float(row[3]), row[4]))
+            except ValueError:
+                continue
+        self.connection.executemany(
+            'INSERT INTO waits (source, airline, day, time, step, seconds, outcome) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+        return len(rows)
+
+    def ingest(self, log_dir=LOG_DIR):
+        """
+        Adds the records appended to all crawler logs and step latency files since the last run.
+
+        Returns:
+            dict: File -> number of new rows.
+        """
+        counts = {}
+        with self.connection:
+            for path in sorted(glob.glob(os.path.join(log_dir, 'logging_*.csv'))):
+                airline = os.path.basename(path)[len('logging_'):-len('.csv')]
+                counts[path] = self.ingest_log(path, airline)
+            for path in sorted(glob.glob(os.path.join(log_dir, 'step_latencies_*.csv'))):
+                airline = os.path.basename(path)[len('step_latencies_'):-len('.csv')]
+                counts[path] = self.ingest_waits(path, airline)
+        return counts
+
+    def query(self, sql, parameters=()):
+        return [dict(row) for row in self.connection.execute(sql, parameters)]
+
+    def failure_rates(self, airline=None, start=None, end=None):
+        """
+        Failures of every step per airline and day.
+
+        Returns:
+            list: Dicts with airline, day, step, events, failures and failure_rate, most failures first.
+        """
+        return self.query(
+            """SELECT airline, day, step, COUNT(*) AS events, SUM(level = 'ERROR') AS failures,
+                      ROUND(1.0 * SUM(level = 'ERROR') / COUNT(*), 4) AS failure_rate
+               FROM events
+               WHERE (:airline IS NULL OR airline = :airline) AND (:start IS NULL OR day >= :start)
+                     AND (:end IS NULL OR day <= :end)
+               GROUP BY airline, day, step
+               ORDER BY failures DESC, failure_rate DESC, airline, day, step""",
+            {'airline': airline, 'start': start, 'end': end}
+        )
+
+    def step_failures(self, airline=None):
+        """ Failures of every step per airline over all days, most failures first """
+        return self.query(
+            """SELECT airline, step, COUNT(*) AS events, SUM(level = 'ERROR') AS failures,
+                      ROUND(1.0 * SUM(level = 'ERROR') / COUNT(*), 4) AS failure_rate, COUNT(DISTINCT day) AS days
+               FROM events WHERE (:airline IS NULL OR airline = :airline)
+               GROUP BY airline, step ORDER BY failures DESC, failure_rate DESC, airline, step""",
+            {'airline': airline}
+        )
+
+    def route_retries(self, airline=None):
+        """
+        Jobs and retries of every route. A route crawled more than once on a day counts the extra jobs as
+        retries, as well as steps that were tried again within a job.
+
+        Returns:
+            list: Dicts with airline, route, days, jobs, failed_jobs, errors and retries, most retries first.
+        """
+        return self.query(
+            """WITH jobs AS (
+                   SELECT airline, departure_airport, destination_airport, MIN(day) AS day,
+                          SUM(level = 'ERROR') AS errors, SUM(retry) AS step_retries
+                   FROM events WHERE (:airline IS NULL OR airline = :airline)
+                   GROUP BY source, job
+               )
+               SELECT airline, departure_airport, destination_airport, COUNT(DISTINCT day) AS days,
+                      COUNT(*) AS jobs, SUM(errors > 0) AS failed_jobs, SUM(errors) AS errors,
+                      COUNT(*) - COUNT(DISTINCT day) + SUM(step_retries) AS retries
+               FROM jobs WHERE destination_airport IS NOT NULL
+               GROUP BY airline, departure_airport, destination_airport
+               ORDER BY retries DESC, failed_jobs DESC, airline, departure_airport, destination_airport""",
+            {'airline': airline}
+        )
+
+    def time_lost(self, airline=None):
+        """
+        Time lost to errors per airline and step: the time from the previous line of the job to an error line
+        (only for logs written with times) and the waits that ended in a timeout.
+
+        Returns:
+            list: Dicts with airline, step, errors, error_seconds, timeouts, timeout_seconds and lost_seconds.
+        """
+        return self.query(
+            """WITH errors AS (
+                   SELECT airline, step, COUNT(*) AS errors, COALESCE(SUM(seconds), 0) AS error_seconds
+                   FROM events WHERE level = 'ERROR' AND (:airline IS NULL OR airline = :airline)
+                   GROUP BY airline, step
+               ), timeouts AS (
+                   SELECT airline, step, COUNT(*) AS timeouts, SUM(seconds) AS timeout_seconds
+                   FROM waits WHERE outcome = 'timeout' AND (:airline IS NULL OR airline = :airline)
+                   GROUP BY airline, step
+               ), steps AS (
+                   SELECT airline, step FROM errors UNION SELECT airline, step FROM timeouts
+               )
+               SELECT steps.airline, steps.step, COALESCE(errors, 0) AS errors,
+                      ROUND(COALESCE(error_seconds, 0), 1) AS error_seconds, COALESCE(timeouts, 0) AS timeouts,
+                      ROUND(COALESCE(timeout_seconds, 0), 1) AS timeout_seconds,
+                      ROUND(COALESCE(error_seconds, 0) + COALESCE(timeout_seconds, 0), 1) AS lost_seconds
+               FROM steps
+               LEFT JOIN errors ON errors.airline = steps.airline AND errors.step = steps.step
+               LEFT JOIN timeouts ON timeouts.airline = steps.airline AND timeouts.step = steps.step
+               ORDER BY lost_seconds DESC, errors DESC, steps.airline, steps.step""",
+            {'airline': airline}
+        )
+
+
+def print_table(rows, limit):
+    """ Prints dicts as aligned columns """
+    if not rows:
+        print('No data')
+        return
+    rows = rows[:limit]
+    columns = list(rows[0])
+    widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print('  '.join(str(row[column]).ljust(widths[column]) for column in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Loads the crawler logs into a SQLite database and reports failure and latency hotspots.')
+    parser.add_argument('report', nargs='?', default='steps', choices=['steps', 'daily', 'routes', 'time'],
+                        help='steps: failures per step, daily: failures per step and day, routes: retries per route, '
+                             'time: time lost to errors')
+    parser.add_argument('--airline', default=None, help='Only this airline, e.g. KLM')
+    parser.add_argument('--start', default=None, help='First day of the daily report as YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='Last day of the daily report as YYYY-MM-DD')
+    parser.add_argument('--limit', type=int, default=20, help='Number of rows to print')
+    parser.add_argument('--log-dir', default=LOG_DIR, help='Folder of the crawler logs')
+    parser.add_argument('--db', default=DEFAULT_DB, help='The SQLite database')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    store = LogStore(args.db)
+    try:
+        counts = store.ingest(args.log_dir)
+        ingested = time.monotonic() - start
+        if args.report == 'steps':
+            rows = store.step_failures(args.airline)
+        elif args.report == 'daily':
+            rows = store.failure_rates(args.airline, args.start, args.end)
+        elif args.report == 'routes':
+            rows = store.route_retries(args.airline)
+        else:
+            rows = store.time_lost(args.airline)
+        print_table(rows, args.limit)
+    finally:
+        store.close()
+    print(f"------------------ {sum(counts.values())} new log rows from {len(counts)} files in {ingested:.2f}s, "
+          f"report in {time.monotonic() - start - ingested:.3f}s ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,237 @@
-from austrian_airlines_crawler import AustrianAirlinesCrawler
-from klm_crawler import KLMCrawler
-from qatar_airways_crawler import QatarAirwaysCrawler
 from datetime import datetime, timedelta
-from base_crawler import BaseCrawler
+from step_timeouts import update_step_timeouts
+from circuit_breaker import CircuitBreaker
+from airports import to_iata, IATA_TO_CITY
+from crawl_jobs import CrawlJob, CRAWLERS, create_crawler, run_crawler_with_expected_results
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import time
-import os
-import csv
-
-def main():
-
-    def count_lines_in_file(filepath):
-        """ Helper function to count the lines in a file """
-        if not os.path.exists(filepath):
-            return 0
-        with open(filepath, 'r') as file:
-            return sum(1 for _ in file)
-
-    def run_crawler_with_expected_results(crawler, results_file_path, expected_count):
-        """ Function to run the crawler and verify that the expected number of results has been added """
-        initial_line_count = count_lines_in_file(results_file_path)
-        crawler.run()
-        current_line_count = count_lines_in_file(results_file_path)
-        new_lines_added = current_line_count - initial_line_count
-
-        # Check if the expected number of new lines has been added
-        attempts = 0
-        max_attempts = 3  # Maximum number of attempts
-        while new_lines_added < expected_count and attempts < max_attempts:
-            print(f"Expected {expected_count} new lines, found {new_lines_added}. Repeating the crawling process...")
-            time.sleep(10)  # Short pause to circumvent potential temporary issues
-            crawler.run()
-            current_line_count = count_lines_in_file(results_file_path)
-            new_lines_added = current_line_count - initial_line_count
-            attempts += 1
-
-    tomorrow = datetime.now() + timedelta(days=1)
-    qatar_date = tomorrow.strftime('%Y-%m-%d')  
-    klm_date = tomorrow.strftime('%d.%m.%Y')  
-
-    departure_airport = 'Frankfurt'
-    qatar_departure_airport = 'FRA'
-    qatar_destinations = ['BER', 'HAM', 'LHR', 'IST', 'DXB']
-    austrian_klm_destinations = [
-        'Berlin', 'Hamburg', 'München', 'London', 
-        'Palma de Mallorca', 'Istanbul', 'Dubai', 'New York', 'Shanghai'
-    ]
-
-    qatar_results_file_path = "results/results_QatarAirways.csv"
-    klm_results_file_path = "results/results_KLM.csv"
-    austrian_results_file_path = "results/results_AustrianAirlines.csv"
-
-    ## CRAWLER FOR KLM ### 
-    print("------------------ Started crawling for KLM Airlines ------------------")
-    for destination in austrian_klm_destinations:
-        klm_crawler = KLMCrawler(departure_airport, destination, klm_date)
-        run_crawler_with_expected_results(klm_crawler, klm_results_file_path, 1)
-    print("------------------ Finished crawling for KLM Airlines ------------------")
-
-    ## CRAWLER FOR QATAR AIRWAYS ### 
-    print("------------------ Started crawling for Qatar Airways ------------------")
-    for destination in qatar_destinations:
-        qatar_crawler = QatarAirwaysCrawler(qatar_departure_airport, destination, qatar_date)
-        run_crawler_with_expected_results(qatar_crawler, qatar_results_file_path, 1)
-    print("------------------ Finished crawling for Qatar Airways ------------------")
-
-    # ### CRAWLER FOR AUSTRIAN AIRLINES ### 
-    print("------------------ Started crawling for Austrian Airlines ------------------")
-    for destination in austrian_klm_destinations:
-        austrian_crawler = AustrianAirlinesCrawler(departure_airport, destination)
-        run_crawler_with_expected_results(austrian_crawler, austrian_results_file_path, 1)
-    print("------------------ Finished crawling for Austrian Airlines ------------------")
+
+# The routes of the regular crawling cycle: airline -> (origins, destinations)
+REGULAR_ROUTES = {
+    'KLM': (['FRA'], ['BER', 'HAM', 'MUC', 'LHR', 'PMI', 'IST', 'DXB', 'JFK', 'PVG']),
+    'QatarAirways': (['FRA'], ['BER', 'HAM', 'LHR', 'IST', 'DXB']),
+    'AustrianAirlines': (['FRA'], ['BER', 'HAM', 'MUC', 'LHR', 'PMI', 'IST', 'DXB', 'JFK', 'PVG']),
+}
+
+def build_jobs(dates, airlines=None, origins=None, destinations=None):
+    """
+    Builds the crawling jobs for the given departure dates.
+
+    Parameters:
+        dates (list): The departure dates (datetime.date).
+        airlines (list): The airlines to crawl, all airlines if not given.
+        origins (list): IATA codes of the departure airports, the regular origins of each airline if not given.
+        destinations (list): IATA codes of the destinations, the regular destinations of each airline if not given.
+
+    Returns:
+        list: The CrawlJobs, ordered by airline, date, origin and destination.
+    """
+    jobs = []
+    for airline in airlines or list(CRAWLERS):
+        regular_origins, regular_destinations = REGULAR_ROUTES[airline]
+        for date in dates:
+            for origin in origins or regular_origins:
+                for destination in destinations or regular_destinations:
+                    if origin != destination:
+                        jobs.append(CrawlJob(airline, origin, destination, date))
+    return jobs
+
+def run_jobs(jobs, workers=1, breaker=None, supervisor=None, configure=None):
+    """
+    Runs the crawling jobs on a pool of worker threads, each driving its own browser.
+
+    Parameters:
+        jobs (list): The CrawlJobs to run, started in list order.
+        workers (int): The number of jobs running at the same time.
+        breaker (CircuitBreaker): The circuit breaker shared by all workers.
+        supervisor (BrowserSupervisor): The supervisor of the browser processes, if any.
+        configure (callable): Called with every crawler before it runs, e.g. to point it to a mock website.
+
+    Returns:
+        list: One (job, success, seconds) tuple per job, in the order of the jobs.
+    """
+    breaker = breaker or CircuitBreaker()
+
+    def run_job(job):
+        crawler = create_crawler(job)
+        if configure:
+            configure(crawler)
+        start = time.monotonic()
+        success = run_crawler_with_expected_results(crawler, 1, breaker, supervisor)
+        return job, success, time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs))
+
+def parse_date(value):
+    """ Parses a date given as YYYY-MM-DD or as +N days from today """
+    if value.startswith('+'):
+        return (datetime.now() + timedelta(days=int(value[1:]))).date()
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def positive_int(value):
+    """ Parses a number of at least 1, e.g. of workers """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def date_range(start, end):
+    """ Returns all dates from start to end, both included """
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+def crawl(jobs, workers=1, max_session_jobs=None):
+    """
+    Runs a crawling cycle over the given jobs and learns the step timeouts for the next one.
+
+    The jobs are grouped into browser sessions and distributed over the workers by the route planner.
+    """
+    from base_crawler import BaseCrawler
+    from browser_supervisor import BrowserSupervisor
+    from quality_gate import QualityGate
+    from route_planner import plan_jobs, run_plan, format_duration, DEFAULT_MAX_SESSION_JOBS
+
+    breaker = CircuitBreaker()
+    supervisor = BrowserSupervisor()
+    supervisor.reap_orphans()
+    BaseCrawler.supervisor = supervisor
+    BaseCrawler.quality_gate = QualityGate()
+
+    plan = plan_jobs(jobs, workers, max_session_jobs or DEFAULT_MAX_SESSION_JOBS)
+    print(f"------------------ Started crawling cycle: {len(jobs)} jobs, estimated duration {format_duration(plan.estimated_seconds)} ------------------")
+    start = time.monotonic()
+    outcomes = run_plan(plan, breaker=breaker, supervisor=supervisor)
+    print(f"------------------ Finished crawling cycle after {format_duration(time.monotonic() - start)} ------------------")
+    print(f"{sum(1 for _, success, _ in outcomes if success)}/{len(jobs)} jobs succeeded")
+
+    breaker.report()
+
+    # Learn the timeout budgets for the next cycle from the latencies recorded in this one
+    update_step_timeouts(sorted({job.airline for job in jobs}))
+    return outcomes
+
+def add_job_arguments(parser):
+    """ Adds the options selecting airlines, routes and dates to a (sub)command parser """
+    parser.add_argument('--airlines', nargs='+', choices=list(CRAWLERS), default=None,
+                        help='Airlines to crawl (default: all)')
+    parser.add_argument('--origins', nargs='+', default=None,
+                        help='Departure airports as IATA code or city name (default: the regular origins)')
+    parser.add_argument('--destinations', nargs='+', default=None,
+                        help='Destination airports as IATA code or city name (default: the regular destinations)')
+    parser.add_argument('--date', type=parse_date, default=None,
+                        help='First departure date as YYYY-MM-DD or +N days from today (default: tomorrow)')
+    parser.add_argument('--until', type=parse_date, default=None,
+                        help='Last departure date, crawls every day from --date to --until (default: --date)')
+
+def jobs_from_args(parser, args):
+    """ Builds the jobs selected on the command line, reporting invalid input through the parser """
+    try:
+        origins = [to_iata(airport) for airport in args.origins] if args.origins else None
+        destinations = [to_iata(airport) for airport in args.destinations] if args.destinations else None
+    except ValueError as e:
+        parser.error(f"{e} (known airports: {', '.join(sorted(IATA_TO_CITY))})")
+    start = args.date or parse_date('+1')
+    end = args.until or start
+    if end < start:
+        parser.error('--until must not be before --date')
+    return build_jobs(date_range(start, end), args.airlines, origins, destinations)
+
+def run_broker_command(submit_parser, args):
+    """ Runs one of the 'broker' subcommands """
+    from job_broker import JobBroker
+
+    broker = JobBroker(args.db)
+    if args.broker_command == 'submit':
+        jobs = jobs_from_args(submit_parser, args)
+        print(f"{broker.submit(jobs)} of {len(jobs)} jobs queued in {args.db}")
+    elif args.broker_command == 'status':
+        counts, nodes = broker.status()
+        print(', '.join(f"{status}: {count}" for status, count in sorted(counts.items())) or 'No jobs')
+        for node in nodes:
+            seen = datetime.fromtimestamp(node['last_heartbeat']).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{node['node_id']} ({node['host']}): {node['jobs_done']} done, {node['jobs_failed']} failed, last heartbeat {seen}")
+    elif args.broker_command == 'export':
+        print(f"{broker.export_results(args.output)} result rows exported to {args.output}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Crawls flight prices from the websites of KLM, Qatar Airways and Austrian Airlines.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    crawl_parser = subparsers.add_parser('crawl', help='Crawl the selected routes (default: the regular crawling cycle)')
+    add_job_arguments(crawl_parser)
+    crawl_parser.add_argument('--workers', type=positive_int, default=1, help='Number of browsers running at the same time')
+    crawl_parser.add_argument('--max-session-jobs', type=positive_int, default=None,
+                              help='Maximum number of routes crawled in one browser session, 1 starts a new browser per route')
+    crawl_parser.add_argument('--dry-run', action='store_true', help='Only print the planned sessions without crawling')
+
+    subparsers.add_parser('airports', help='List the known airports')
+
+    broker_parser = subparsers.add_parser('broker', help='Manage the job queue shared by several worker nodes')
+    broker_commands = broker_parser.add_subparsers(dest='broker_command', required=True)
+    submit_parser = broker_commands.add_parser('submit', help='Queue the selected routes for the worker nodes')
+    add_job_arguments(submit_parser)
+    broker_commands.add_parser('status', help='Show the queue and the worker nodes')
+    export_parser = broker_commands.add_parser('export', help='Append the shipped results to the results files')
+    export_parser.add_argument('--output', default='results', help='Directory of the results files')
+
+    worker_parser = subparsers.add_parser('worker', help='Run a worker node that crawls jobs from the broker')
+    worker_parser.add_argument('--workers', type=positive_int, default=1, help='Number of browsers running at the same time')
+    worker_parser.add_argument('--node-id', default=None, help='Name of this node (default: host and process id)')
+    worker_parser.add_argument('--wait', action='store_true', help='Keep waiting for new jobs when the queue is empty')
+
+    subparsers.add_parser('normalize', add_help=False,
+                          help='Normalize durations, times and prices of the results files')
+    subparsers.add_parser('quality', add_help=False,
+                          help='Rebuild the outlier sketches of the quality gate from the results files')
+    subparsers.add_parser('logs', add_help=False,
+                          help='Load the crawler logs into a database and report failure and latency hotspots')
+
+    for command_parser in (broker_parser, worker_parser):
+        command_parser.add_argument('--db', default='broker/crawl_broker.db',
+                                    help='Path of the broker database, on a disk shared by all nodes')
+
+    args, extra = parser.parse_known_args(argv)
+    if args.command == 'normalize':
+        # The options are those of normalization.py
+        from normalization import main as normalize
+        normalize(extra)
+        return
+    if args.command == 'quality':
+        from quality_gate import main as rebuild_quality_sketches
+        rebuild_quality_sketches(extra)
+        return
+    if args.command == 'logs':
+        # The options are those of log_analytics.py
+        from log_analytics import main as analyze_logs
+        analyze_logs(extra)
+        return
+    if extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if args.command is None:
+        # Without a command the regular crawling cycle runs, as before
+        args = parser.parse_args(['crawl'])
+
+    if args.command == 'airports':
+        for iata, city in sorted(IATA_TO_CITY.items()):
+            print(f"{iata}  {city}")
+        return
+
+    if args.command == 'broker':
+        run_broker_command(submit_parser, args)
+        return
+
+    if args.command == 'worker':
+        from job_broker import JobBroker, run_worker
+        run_worker(JobBroker(args.db), args.node_id, workers=args.workers, wait=args.wait)
+        return
+
+    jobs = jobs_from_args(crawl_parser, args)
+    if args.dry_run:
+        from route_planner import plan_jobs, DEFAULT_MAX_SESSION_JOBS
+        plan_jobs(jobs, args.workers, args.max_session_jobs or DEFAULT_MAX_SESSION_JOBS).describe()
+        return
+    crawl(jobs, workers=args.workers, max_session_jobs=args.max_session_jobs)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,508 @@
+import argparse
+import hashlib
+import html
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Void elements are rendered without a closing tag
+VOID_TAGS = {'input', 'br', 'img', 'meta'}
+
+# Block elements inside a paragraph would close it when the HTML is parsed, so they are rendered as spans
+# and turned back into their real tag by BLOCK_SCRIPT once the page has loaded
+BLOCK_TAGS = {'div', 'section', 'ol', 'ul', 'h3'}
+
+BLOCK_SCRIPT = """
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('[data-tag]').forEach(function (span) {
+        var element = document.createElement(span.dataset.tag);
+        for (var i = 0; i < span.attributes.length; i++) {
+            if (span.attributes[i].name !== 'data-tag') {
+                element.setAttribute(span.attributes[i].name, span.attributes[i].value);
+            }
+        }
+        while (span.firstChild) {
+            element.appendChild(span.firstChild);
+        }
+        span.replaceWith(element);
+    });
+});
+"""
+
+BLOCK_PAGE = """<html><head><title>Access Denied</title></head><body>
+<h1>Access Denied</h1><p>Please verify you are a human to continue.</p>
+</body></html>"""
+
+ERROR_PAGE = """<html><head><title>Service Unavailable</title></head><body>
+<h1>Something went wrong</h1><p>Please try again later.</p>
+</body></html>"""
+
+
+class Element:
+    """
+    A minimal DOM element used to build pages that match the XPaths of the crawlers.
+
+    at() walks a relative path such as 'div[3]/div[2]/button' and creates every missing element on the way,
+    including placeholder siblings, so that positional steps like div[3] select exactly the created element.
+    """
+
+    def __init__(self, tag, attrs=None, text='', raw=False):
+        self.tag = tag
+        self.attrs = dict(attrs or {})
+        self.text = text
+        self.raw = raw
+        self.children = []
+
+    def at(self, path):
+        """
+        Returns the element at the given relative path, creating it if needed.
+
+        Parameters:
+            path (str): Steps separated by '/', each a tag name with an optional 1-based position.
+
+        Returns:
+            Element: The element at the end of the path.
+        """
+        element = self
+        for step in path.strip('/').split('/'):
+            match = re.fullmatch(r'([\w-]+)(?:\[(\d+)\])?', step)
+            tag, position = match.group(1), int(match.group(2) or 1)
+            same = [child for child in element.children if child.tag == tag]
+            while len(same) < position:
+                child = Element(tag)
+                element.children.append(child)
+                same.append(child)
+            element = same[position - 1]
+        return element
+
+    def set(self, text=None, **attrs):
+        """ Sets the text and attributes of the element, 'cls' is written as 'class' """
+        if text is not None:
+            self.text = text
+        for name, value in attrs.items():
+            self.attrs['class' if name == 'cls' else name.replace('_', '-')] = value
+        return self
+
+    def add(self, tag, text='', **attrs):
+        """ Appends a new child element and returns it """
+        child = Element(tag).set(text, **attrs)
+        self.children.append(child)
+        return child
+
+    def render(self, in_paragraph=False):
+        """ Renders the element and its children as HTML """
+        tag, attrs = self.tag, dict(self.attrs)
+        if in_paragraph and tag in BLOCK_TAGS:
+            tag, attrs['data-tag'] = 'span', self.tag
+        attrs = ''.join(f' {name}="{html.escape(str(value))}"' for name, value in attrs.items())
+        if tag in VOID_TAGS:
+            return f'<{tag}{attrs}>'
+        in_paragraph = in_paragraph or tag == 'p'
+        inner = (self.text if self.raw else html.escape(self.text))
+        inner += ''.join(child.render(in_paragraph) for child in self.children)
+        return f'<{tag}{attrs}>{inner}</{tag}>'
+
+
+def new_page(title, script=''):
+    """
+    Creates an empty page.
+
+    Returns:
+        tuple: (html element, body element); the script is added to the head of the page.
+    """
+    page = Element('html')
+    head = page.at('head')
+    head.add('meta', charset='utf-8')
+    head.add('title', title)
+    head.children.append(Element('script', text=script, raw=True))
+    return page, page.at('body')
+
+
+def render_page(page):
+    """ Renders a page built with new_page """
+    return '<!DOCTYPE html>' + page.render()
+
+
+def flight_offer(airline, origin, destination, date):
+    """
+    Generates a deterministic flight offer for a route and date.
+
+    Returns:
+        dict: Departure and arrival time, durations in minutes, number of stops and price in euros.
+    """
+    seed = int(hashlib.md5(f'{airline}|{origin}|{destination}|{date}'.encode()).hexdigest(), 16)
+    rng = random.Random(seed)
+    stops = 0 if airline == 'AustrianAirlines' and rng.random() < 0.5 else rng.choice([1, 1, 1, 2])
+    transit_minutes = [rng.randrange(45, 300, 5) for _ in range(stops)]
+    flight_minutes = rng.randrange(60, 720, 5)
+    departure = rng.randrange(6 * 60, 22 * 60, 5)
+    travel = flight_minutes + sum(transit_minutes)
+    return {
+        'departure': departure,
+        'arrival': (departure + travel) % (24 * 60),
+        'travel': travel,
+        'stops': stops,
+        'transit': transit_minutes,
+        'price': round(rng.uniform(90, 2400), 2)
+    }
+
+
+def hhmm(minutes):
+    """ Formats minutes as HH:MM """
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def calendar_days(days_before=30, days_after=365):
+    """ Returns the dates offered by the mock date pickers """
+    today = datetime.now().date()
+    return [today + timedelta(days=offset) for offset in range(-days_before, days_after)]
+
+
+COMMON_SCRIPT = BLOCK_SCRIPT + """
+function show(id) { document.getElementById(id).style.display = 'block'; }
+function hide(id) { document.getElementById(id).style.display = 'none'; }
+var selectedDate = '';
+"""
+
+
+def klm_search_page():
+    """ The KLM search form at /klm/search/advanced """
+    script = COMMON_SCRIPT + """
+function search() {
+    var params = new URLSearchParams({
+        from: document.getElementById('mat-input-5').value,
+        to: document.getElementById('mat-input-6').value,
+        date: selectedDate
+    });
+    location.href = '/klm/search/results?' + params.toString();
+}
+"""
+    page, body = new_page('KLM - Search', script)
+    banner = body.at('div[1]').set(id='cookie-banner')
+    banner.add('button', 'Accept', id='accept_cookies_btn', type='button', onclick="hide('cookie-banner')")
+
+    trip_type = body.at('div[2]').add('select', id='mat-input-0')
+    trip_type.add('option', 'Return', value='return')
+    trip_type.add('option', 'One way', value='oneway')
+    body.at('div[2]').add('input', id='mat-input-5', type='text')
+    body.at('div[2]').add('input', id='mat-input-6', type='text')
+
+    expandable = body.at('div[4]').set(id='bw-search-widget-expandable')
+    toggle = expandable.at('div/bw-datepicker/bwc-form-input-container/div/label/mat-form-field/div[1]/div/div[2]/bwc-date-picker-toggle-button/button')
+    toggle.set(type='button', onclick="show('calendar')")
+    toggle.at('span[3]').set('Date')
+
+    calendar = body.at('div[3]').set(id='calendar', style='display:none')
+    days = calendar.at('div[2]/div[2]/bwc-calendar/div/div[2]')
+    for day in calendar_days():
+        days.add('button', str(day.day), type='button', id=f'bwc-day_{day.year}_{day.month - 1}_{day.day}',
+                 onclick=f"selectedDate = '{day.isoformat()}'")
+    calendar.at('div[2]/div[2]/bwc-calendar/div/div[3]/button[1]').set('Cancel', type='button', onclick="hide('calendar')")
+    calendar.at('div[2]/div[2]/bwc-calendar/div/div[3]/button[2]').set('Confirm', type='button', onclick="hide('calendar')")
+
+    form = body.at('div[5]').set(id='bw-search-widget-form-15hCmh4vxh')
+    form.at('div/div[2]/div[2]/button').set('Search', type='button', onclick='search()')
+    return render_page(page)
+
+
+def klm_results_page(origin, destination, date):
+    """ The KLM search results at /klm/search/results """
+    offer = flight_offer('KLM', origin, destination, date)
+    script = COMMON_SCRIPT
+    page, body = new_page('KLM - Results', script)
+    result = body.at('bw-app/bwc-page-template/mat-sidenav-container/mat-sidenav-content/div/main/div/bwsfe-search-result')
+
+    filters = result.at('div[1]').add('select', id='bw-flight-list-result-filters__select-0')
+    filters.add('option', 'Cheapest', value='price')
+    filters.add('option', 'Fastest', value='duration')
+
+    offer_item = result.at('div[2]/section/bwsfe-search-result-list/section/ol/li[1]/bwsfc-flight-offer/div/div[1]')
+    offer_item.at('div[1]').set(f'{hhmm(offer["departure"])} - {hhmm(offer["arrival"])}')
+    offer_item.at('div[2]/button').set('Details', type='button', onclick="show('mat-mdc-dialog-0')")
+
+    tab = body.at('div[1]').set(id='flight1cabinClassCardTabECONOMY')
+    tab.at('div/div').set('Economy', onclick="show('mat-tab-content-0-0')", style='cursor:pointer')
+
+    content = body.at('div[2]').set(id='mat-tab-content-0-0', style='display:none')
+    price = f'{offer["price"]:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+    content.at('div/section/div/bws-flight-upsell-item[1]/div/div[1]/bws-flight-upsell-price/span').set(f'{price} EUR')
+
+    dialog = body.at('div[3]').set(id='mat-mdc-dialog-0', style='display:none')
+    content = dialog.at('div/div/bwsfc-flight-details/mat-dialog-content')
+    travel = offer['travel']
+    content.at('div/bwsfc-flight-details-flight-info/div[4]/span').set(f'{travel // 60}h {travel % 60}min')
+    nodes = content.at('ol/li[2]/div/div[3]/bwsfc-segment-nodes/div')
+    nodes.at('bwsfc-segment-station-node[1]/div[2]/span').set(hhmm(offer['departure']))
+    nodes.at('bwsfc-segment-station-node[2]/div[2]/span').set(hhmm(offer['arrival']))
+    transit = sum(offer['transit']) or 60
+    content.at('ol/li[1]/div[2]/div[2]').set(f'Transferzeit: {transit // 60}h {transit % 60}min')
+    return render_page(page)
+
+
+def qatar_results_page(origin, destination, date):
+    """ The Qatar Airways flight selection at /qatar/app/booking/flight-selection """
+    offer = flight_offer('QatarAirways', origin, destination, date)
+    page, body = new_page('Qatar Airways - Flight selection', COMMON_SCRIPT)
+
+    cookie = body.at('div[1]').set(id='cookie-id')
+    cookie.at('div[1]').set(cls='cookie-btn col-md-12').at('div').set('We use cookies')
+    cookie.at('div[1]').add('button', 'Accept all', id='cookie-accept-all', type='button', onclick="hide('cookie-id')")
+
+    card = body.at('div[2]').set(id='at-flight-search-result-1')
+    flight = card.at('div/div/div[1]/booking-smart-flight-card/qr-flight-card/div')
+    flight.at('div[2]/div[1]/h3').set(hhmm(offer['departure']))
+    flight.at('div[2]/div[1]/p/abbr').set(origin)
+    stops = 'Nonstop' if not offer['stops'] else f'{offer["stops"]} Stopp'
+    travel = offer['travel']
+    flight.at('div[2]/div[2]/p/div').set(f'{stops}, {travel // 60}h {travel % 60:02d}m')
+    flight.at('div[2]/div[3]/h3/span').set(hhmm(offer['arrival']))
+    flight.at('div[2]/div[3]/p/abbr').set(destination)
+    flight.at('div[3]/div/div').set('Flight details', onclick="show('flight-details')", style='cursor:pointer')
+    # The website formats prices with a German thousands separator and without decimals
+    price = f'{int(offer["price"]):,}'.replace(',', '.')
+    card.at('div/div/div[3]/div/div[1]/a/div[2]/span').set(f'€{price}')
+
+    transit = sum(offer['transit'])
+    details = body.at('modal/div[2]').set(id='flight-details', style='display:none')
+    details.at('div/div[1]/div[2]/booking-smart-flight-details/qr-flight-details/div/div[3]/p').set(
+        f'Umsteigezeit {transit // 60}h {transit % 60}m'
+    )
+    return render_page(page)
+
+
+AUSTRIAN_FORM = 'div[4]/div/div/div[2]/div/div/div[2]/div[1]/div/section/div[2]/div[1]/div/div/form'
+AUSTRIAN_RESULTS = 'app/refx-app-layout/div/div[2]/refx-upsell/refx-basic-in-flow-layout/div/div[6]/div[4]/div/div'
+AUSTRIAN_CARD = (AUSTRIAN_RESULTS + '/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/mat-accordion/'
+                 'refx-upsell-premium-row-pres[1]/div/div/refx-flight-card-pres/refx-basic-flight-card-layout/div/div/div[1]/div')
+
+
+def austrian_search_page():
+    """ The Austrian Airlines start page with its search form at /austrian/ """
+    script = COMMON_SCRIPT + """
+function search() {
+    var params = new URLSearchParams({
+        from: document.getElementById('departure').value,
+        to: document.getElementsByName('flightQuery.flightSegments[0].destinationCode')[0].value,
+        date: selectedDate
+    });
+    location.href = '/austrian/results?' + params.toString();
+}
+"""
+    page, body = new_page('Austrian Airlines', script)
+    body.at('div[1]').set(id='cookie-banner').add('button', 'Accept all', id='cm-acceptAll', type='button',
+                                                  onclick="hide('cookie-banner')")
+
+    departure_form = body.at('div[2]/' + AUSTRIAN_FORM).set(onsubmit='return false')
+    departure_form.at('div[2]/div[1]/div[1]/div[1]/div/div[1]/div[1]/div[1]/input').set(id='departure', type='text')
+    departure_form.at('div[2]/div[1]/div[1]/div[1]/div/div[1]/div[2]/div[1]/input').set(
+        name='flightQuery.flightSegments[0].destinationCode', type='text'
+    )
+
+    date_form = body.at('div[3]/' + AUSTRIAN_FORM).set(onsubmit='return false')
+    date_form.at('div[2]/div[2]/div/div[1]/div[1]/input').set(type='text', readonly='readonly', onclick="show('calendar')")
+    date_form.at('div[2]/div[4]/button').set('Flüge suchen', type='button', onclick='search()')
+
+    trip_type = body.at('div[4]').set(id='dcep-tab-control-standalone3-fluge-section').at('div/div/form').set(onsubmit='return false')
+    trip_type.at('div[1]/div/div/div[1]/button').set('Hin- und Rückflug', type='button', onclick="show('trip-types')")
+    options = trip_type.at('div[1]/div/div/div[2]').set(id='trip-types', style='display:none').at('ul')
+    options.at('li[1]').set('Hin- und Rückflug', onclick="hide('trip-types')")
+    options.at('li[2]').set('Nur Hinflug', onclick="hide('trip-types')")
+
+    calendar = body.at('div[5]').set(id='calendar', style='display:none')
+    row = calendar.at('table/tbody/tr')
+    for day in calendar_days():
+        row.add('td', str(day.day), cls='CalendarDay CalendarDay__default', aria_label=day.strftime('%A, %d %B %Y'),
+                onclick=f"selectedDate = '{day.isoformat()}'")
+    calendar.add('button', cls='btn-primary calendar-footer-continue-button', type='button',
+                 onclick="hide('calendar')").add('span', 'Weiter')
+    return render_page(page)
+
+
+def austrian_results_page(origin, destination, date):
+    """ The Austrian Airlines search results at /austrian/results """
+    offer = flight_offer('AustrianAirlines', origin, destination, date)
+    page, body = new_page('Austrian Airlines - Flights', COMMON_SCRIPT)
+
+    body.at(AUSTRIAN_RESULTS + '/div/refx-upsell-premium-cont/refx-upsell-premium-pres/div/div[1]/'
+            'refx-upsell-premium-filtering-pres/div[2]/refx-upsell-premium-sorting-pres/refx-menu/div/a').set(
+        'Sortieren', onclick="show('sort-menu')", style='cursor:pointer'
+    )
+    menu = body.at('div[4]/div[2]/div/div/div').set(id='sort-menu', style='display:none')
+    menu.at('button[1]').set('Empfohlen', type='button', onclick="hide('sort-menu')")
+    menu.at('button[2]').set('Günstigste zuerst', type='button', onclick="hide('sort-menu')")
+
+    price = f'{offer["price"]:,.2f}'.replace(',', 'X').replace('.', ',').replace('X', '.')
+    body.at(AUSTRIAN_RESULTS + '/refx-calendar-cont/refx-calendar-pres/div/mat-expansion-panel/div/div/refx-carousel/div/ul/'
+            'li[4]/div/button/span[1]/div[1]/div/refx-price-cont/refx-price/span/span').set(price)
+
+    card = body.at(AUSTRIAN_CARD)
+    timeline = card.at('div[1]/div/refx-bound-timeline/div[1]')
+    timeline.at('div[1]/div[1]/div').set(hhmm(offer['departure']))
+    timeline.at('div[3]/div[1]/div').set(hhmm(offer['arrival']))
+    stop_class = {0: 'bound-nb-stop-container', 1: 'bound-nb-stop-container has-stops has-1-stop'}
+    timeline.at('div[2]/div[2]').set('', cls=stop_class.get(offer['stops'], 'bound-nb-stop-container has-stops'))
+    details = card.at('div[2]/div/refx-flight-details/div')
+    travel = offer['travel']
+    details.at('div[1]/div[1]/div/span[2]').set(f'{travel // 60}h {travel % 60}min')
+    details.at('div[2]/a').set('Details', onclick="show('itinerary')", style='cursor:pointer')
+
+    dialog = body.at('div[4]/div[2]/div/mat-dialog-container').set(id='itinerary', style='display:none')
+    stops = dialog.at('refx-itinerary-details-dialog-pres/refx-dialog-pres/div/div[2]/div/div')
+    for index, minutes in enumerate(offer['transit'], start=1):
+        stops.at(f'refx-flight-stop-details-pres[{index}]/div/div/div/div[2]/div/div[2]').set(
+            f'{minutes // 60}h {minutes % 60}min'
+        )
+    return render_page(page)
+
+
+class MockAirlineServer:
+    """
+    A local stand-in for the KLM, Qatar Airways and Austrian Airlines websites.
+
+    The pages reproduce the elements the crawlers look for, so the unchanged crawler classes can run against
+    them. Every page request can be delayed (latency + random jitter), answered with an error page
+    (failure_rate) or with a bot-challenge page (block_rate).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0, block_rate=0.0, seed=None):
+        """
+        Initializes the MockAirlineServer.
+
+        Parameters:
+            host (str): The interface to listen on.
+            port (int): The port to listen on, 0 picks a free one.
+            latency (float): The fixed delay of every page in seconds.
+            jitter (float): The maximum additional random delay in seconds.
+            failure_rate (float): The share of pages answered with an HTTP 500 error page.
+            block_rate (float): The share of pages answered with a bot-challenge page.
+            seed (int): The seed for the injected delays and failures.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.block_rate = block_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """ The URL the server is reachable at """
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url(self, airline):
+        """ Returns the entry URL of an airline, as used by the crawler classes """
+        paths = {
+            'KLM': '/klm/search/advanced',
+            'QatarAirways': '/qatar/app/booking/flight-selection',
+            'AustrianAirlines': '/austrian/',
+        }
+        return self.base_url + paths[airline]
+
+    def configure(self, crawler):
+        """ Points a crawler to the mock website of its airline """
+        if crawler.airline_name == 'QatarAirways':
+            crawler.search_url = self.url('QatarAirways')
+            crawler.url = crawler.construct_url()
+        else:
+            crawler.url = self.url(crawler.airline_name)
+
+    def draw(self):
+        """ Draws the delay and the injected outcome of a page request """
+        with self.random_lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            roll = self.random.random()
+        if roll < self.failure_rate:
+            return delay, 'failure'
+        if roll < self.failure_rate + self.block_rate:
+            return delay, 'block'
+        return delay, 'ok'
+
+    def page(self, path, query):
+        """
+        Returns the status code and HTML of a page.
+        """
+        origin = query.get('from', query.get('fromStation', ['']))[0]
+        destination = query.get('to', query.get('toStation', ['']))[0]
+        date = query.get('date', query.get('departing', ['']))[0] or (datetime.now() + timedelta(days=1)).date().isoformat()
+        if path == '/klm/search/advanced':
+            return 200, klm_search_page()
+        if path == '/klm/search/results':
+            return 200, klm_results_page(origin, destination, date)
+        if path == '/qatar/app/booking/flight-selection':
+            return 200, qatar_results_page(origin, destination, date)
+        if path in ('/austrian', '/austrian/'):
+            return 200, austrian_search_page()
+        if path == '/austrian/results':
+            return 200, austrian_results_page(origin, destination, date)
+        return 404, ERROR_PAGE
+
+    def handler_class(self):
+        """ Creates the request handler bound to this server """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, body = server.page(url.path, parse_qs(url.query))
+                if status == 200:
+                    delay, outcome = server.draw()
+                    time.sleep(delay)
+                    if outcome == 'failure':
+                        status, body = 500, ERROR_PAGE
+                    elif outcome == 'block':
+                        body = BLOCK_PAGE
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """ Serves requests in a background thread """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the server """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the airline websites crawled by the flight crawlers.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Fixed delay of every page in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum additional random delay in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of pages answered with an error')
+    parser.add_argument('--block-rate', type=float, default=0.0, help='Share of pages answered with a bot challenge')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockAirlineServer(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.block_rate, args.seed)
+    for airline in ('KLM', 'QatarAirways', 'AustrianAirlines'):
+        print(f"{airline}: {server.url(airline)}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
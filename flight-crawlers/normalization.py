@@ -0,0 +1,270 @@
+import argparse
+import glob
+import math
+import os
+import re
+import shutil
+import time
+
+# Every crawler writes durations and clock times as 'HH:MM' and prices as a float in EUR. The functions
+# below turn the texts of the airline websites into this form: one record at a time while crawling, or
+# vectorized over a DataFrame when whole results files are cleaned again.
+
+DURATION_COLUMNS = ['travel_duration', 'transit_duration']
+TIME_COLUMNS = ['departure_time', 'arrival_time']
+
+# Decimal separator of the number formats used by the airline websites
+LOCALE_DECIMAL = {'de': ',', 'en': '.'}
+
+# Everything that is not part of a number, e.g. '€', 'EUR' or (non-breaking) spaces
+_PRICE_JUNK = re.compile(r'[^\d.,\-]')
+# Splits a cleaned price at its last separator: '1.295,00' -> ('1.295', ',', '00')
+_PRICE_PARTS = re.compile(r'^(.*?)(?:([.,])(\d*))?$')
+
+# '2h 10m', '11h 0min', '1 Std. 5 Min.', 'Transferzeit: 2h 55min', '1d 3h'
+_DAYS = r'(\d+)\s*(?:d|Tag|Tage)\b'
+_HOURS = r'(\d+)\s*(?:h|Std)'
+_MINUTES = r'(\d+)\s*(?:m|Min)'
+# '4:30', '04:30' and '29:50:00' (hours beyond 24 as written back by spreadsheet programs)
+_CLOCK_DURATION = r'^\s*(\d+):(\d{1,2})(?::\d{2})?\s*$'
+# '7:05', '07:05', '7.05' or '07:05 +1' (arrival on the next day)
+_TIME = r'(\d{1,2})[:.](\d{2})'
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value)) or str(value).strip() in ('', '-')
+
+
+def parse_price(text, locale=None):
+    """
+    Parses a price text into a float.
+
+    With a locale the decimal separator is known and every other separator groups thousands. Without one it
+    is inferred: the last separator is the decimal one, unless it is followed by exactly three digits, which
+    a price in EUR never has, so '€1.186' and '€1,186' both mean 1186 while '333,60' and '1295.0' keep
+    their decimals.
+
+    Parameters:
+        text (str): The price as shown on the website, e.g. '1.295,00 EUR', or as stored in a results file.
+        locale (str): 'de' or 'en', None to infer the separators.
+
+    Returns:
+        float: The price, or None if the text holds no number.
+    """
+    if _is_missing(text):
+        return None
+    if isinstance(text, (int, float)):
+        return float(text)
+    cleaned = _PRICE_JUNK.sub('', str(text))
+    if not re.search(r'\d', cleaned):
+        return None
+    integer, separator, fraction = _PRICE_PARTS.match(cleaned).groups()
+    if separator is None:
+        return float(integer)
+    if locale is not None:
+        is_decimal = separator == LOCALE_DECIMAL[locale]
+    else:
+        other = ',' if separator == '.' else '.'
+        is_decimal = len(fraction) != 3 or other in integer
+    digits = re.sub(r'[.,]', '', integer)
+    return float(f"{digits or '0'}.{fraction or '0'}") if is_decimal else float(digits + fraction)
+
+
+def parse_duration(text):
+    """
+    Parses a duration text into minutes.
+
+    Parameters:
+        text (str): A duration such as '2h 10m', '11h 0min', 'Transferzeit: 2h 55min', '4:30' or '29:50:00'.
+
+    Returns:
+        int: The duration in minutes, or None if the text holds no duration.
+    """
+    if _is_missing(text):
+        return None
+    text = str(text)
+    clock = re.match(_CLOCK_DURATION, text)
+    if clock:
+        return int(clock.group(1)) * 60 + int(clock.group(2))
+    parts = [re.search(pattern, text) for pattern in (_DAYS, _HOURS, _MINUTES)]
+    if not any(parts):
+        return None
+    days, hours, minutes = (int(part.group(1)) if part else 0 for part in parts)
+    return days * 1440 + hours * 60 + minutes
+
+
+def format_minutes(minutes):
+    """ Formats a number of minutes as 'HH:MM', hours beyond 24 are kept: 1790 -> '29:50' """
+    if minutes is None:
+        return None
+    minutes = int(minutes)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def normalize_duration(text, default=None):
+    """
+    Returns a duration text in 'HH:MM' format, or default if the text holds no duration.
+    """
+    minutes = parse_duration(text)
+    return default if minutes is None else format_minutes(minutes)
+
+
+def normalize_time(text):
+    """
+    Returns a clock time such as '7:05' or '07:05 +1' in 'HH:MM' format, or None if the text holds no time.
+    """
+    if _is_missing(text):
+        return None
+    match = re.search(_TIME, str(text))
+    if not match:
+        return None
+    return f"{int(match.group(1)):02d}:{match.group(2)}"
+
+
+def parse_price_series(series, locale=None):
+    """
+    Vectorized parse_price() over a pandas Series.
+
+    Returns:
+        pandas.Series: The prices as floats, NaN where no price could be parsed.
+    """
+    import pandas as pd
+
+    cleaned = series.astype('string').str.replace(_PRICE_JUNK.pattern, '', regex=True)
+    parts = cleaned.str.extract(_PRICE_PARTS.pattern)
+    integer, separator, fraction = parts[0].fillna(''), parts[1], parts[2].fillna('')
+    if locale is not None:
+        is_decimal = separator == LOCALE_DECIMAL[locale]
+    else:
+        mixed = (((separator == '.') & integer.str.contains(',', regex=False))
+                 | ((separator == ',') & integer.str.contains('.', regex=False)))
+        is_decimal = (fraction.str.len() != 3) | mixed
+    is_decimal = is_decimal.fillna(False).astype(bool)
+    digits = integer.str.replace(r'[.,]', '', regex=True)
+    number = digits + fraction
+    number = number.where(~is_decimal, digits.replace('', '0') + '.' + fraction.replace('', '0'))
+    number = number.where(cleaned.str.contains(r'\d', regex=True).fillna(False))
+    return pd.to_numeric(number, errors='coerce').astype(float)
+
+
+def parse_duration_series(series):
+    """
+    Vectorized parse_duration() over a pandas Series.
+
+    Returns:
+        pandas.Series: The durations in minutes as floats, NaN where no duration could be parsed.
+    """
+    text = series.astype('string')
+    clock = text.str.extract(_CLOCK_DURATION).astype(float)
+    from_clock = clock[0] * 60 + clock[1]
+    parts = [text.str.extract(pattern)[0].astype(float) for pattern in (_DAYS, _HOURS, _MINUTES)]
+    found = parts[0].notna() | parts[1].notna() | parts[2].notna()
+    from_units = parts[0].fillna(0) * 1440 + parts[1].fillna(0) * 60 + parts[2].fillna(0)
+    return from_clock.fillna(from_units.where(found))
+
+
+def format_minutes_series(minutes):
+    """ Vectorized format_minutes(), missing values stay missing """
+    valid = minutes.notna()
+    whole = minutes.fillna(0).astype(int)
+    hours = (whole // 60).astype(str).str.zfill(2)
+    rest = (whole % 60).astype(str).str.zfill(2)
+    return (hours + ':' + rest).where(valid)
+
+
+def normalize_time_series(series):
+    """ Vectorized normalize_time() over a pandas Series """
+    parts = series.astype('string').str.extract(_TIME)
+    return parts[0].str.zfill(2) + ':' + parts[1]
+
+
+def normalize_frame(df, locale=None):
+    """
+    Normalizes the durations, clock times and prices of a results DataFrame.
+
+    Durations and times become 'HH:MM' strings and prices floats. Values that cannot be parsed, such as the
+    '-' of a failed crawl, and prices of zero or less become missing.
+
+    Parameters:
+        df (pandas.DataFrame): The rows of a results file.
+        locale (str): The number format of the prices, None to infer it per value.
+
+    Returns:
+        pandas.DataFrame: A normalized copy of df.
+    """
+    df = df.copy()
+    for column in DURATION_COLUMNS:
+        if column in df:
+            df[column] = format_minutes_series(parse_duration_series(df[column]))
+    for column in TIME_COLUMNS:
+        if column in df:
+            df[column] = normalize_time_series(df[column])
+    if 'price' in df:
+        price = parse_price_series(df['price'], locale)
+        df['price'] = price.where(price > 0)
+    return df
+
+
+def read_results_file(path):
+    """
+    Reads a results file with all values as text.
+
+    The file is decoded as latin-1, which maps every byte to one character, so values in unknown or mixed
+    encodings such as the airport names of older crawls are written back byte for byte.
+    """
+    import pandas as pd
+
+    return pd.read_csv(path, dtype=str, na_filter=False, encoding='latin-1')
+
+
+def normalize_results_file(path, output=None, backup=True):
+    """
+    Normalizes a results file in bulk and writes it back.
+
+    Parameters:
+        path (str): The results file, e.g. 'results/results_QatarAirways.csv'.
+        output (str): The file to write, by default the results file itself.
+        backup (bool): Keep a copy of the original file as '<path>.bak' before overwriting it the first time.
+
+    Returns:
+        dict: The number of rows and changed values of the file.
+    """
+    original = read_results_file(path)
+    normalized = normalize_frame(original)
+    if 'price' in normalized:
+        normalized['price'] = normalized['price'].map(lambda price: '' if math.isnan(price) else str(price))
+    normalized = normalized.fillna('')
+
+    output = output or path
+    if backup and os.path.abspath(output) == os.path.abspath(path) and not os.path.exists(path + '.bak'):
+        shutil.copyfile(path, path + '.bak')
+    temporary = output + '.tmp'
+    # Line endings as written by the csv module of the crawlers
+    normalized.to_csv(temporary, index=False, encoding='latin-1', lineterminator='\r\n')
+    os.replace(temporary, output)
+    return {
+        'rows': len(normalized),
+        'changed': int((normalized != original).sum().sum())
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Normalizes durations, times and prices of the results files in bulk.')
+    parser.add_argument('files', nargs='*', help='Results files to normalize (default: results/results_*.csv)')
+    parser.add_argument('--output', default=None, help='Directory for the normalized files (default: overwrite them)')
+    parser.add_argument('--no-backup', action='store_true', help='Do not keep a .bak copy of overwritten files')
+    args = parser.parse_args(argv)
+
+    files = args.files or sorted(glob.glob(os.path.join('results', 'results_*.csv')))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    start = time.monotonic()
+    for path in files:
+        output = os.path.join(args.output, os.path.basename(path)) if args.output else None
+        summary = normalize_results_file(path, output, backup=not args.no_backup)
+        print(f"{path}: {summary['rows']} rows, {summary['changed']} values changed")
+    print(f"------------------ {len(files)} files normalized in {time.monotonic() - start:.2f}s ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 from base_crawler import BaseCrawler
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait 
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 from datetime import datetime
@@ -8,7 +7,8 @@ import time
 import csv
 import os
 from datetime import datetime
-import re
+
+from normalization import normalize_duration, normalize_time, parse_price
 
 class QatarAirwaysCrawler(BaseCrawler):
     """
@@ -16,6 +16,7 @@ class QatarAirwaysCrawler(BaseCrawler):
     """
 
     airline_name = "QatarAirways"
+    search_url = "https://www.qatarairways.com/app/booking/flight-selection"
 
     def __init__(self, departure_airport, destination_airport, date):
         """
@@ -54,7 +55,7 @@ class QatarAirwaysCrawler(BaseCrawler):
         """
         try:
             base_url = (
-                "https://www.qatarairways.com/app/booking/flight-selection?"
+                f"{self.search_url}?"
                 "widget=QR&searchType=F&addTaxToFare=Y&upsellCallId=100&flexibleDate=off&bookingClass=E&"
                 "tripType=O&selLang=de"
             )
@@ -96,8 +97,8 @@ class QatarAirwaysCrawler(BaseCrawler):
 
             for attempt in range(max_retries):
                 try:
-                    WebDriverWait(self.driver, 30).until(
-                        EC.presence_of_element_located((By.XPATH, '//*[@id="at-flight-search-result-1"]'))
+                    self.wait_for(
+                        'open_url', EC.presence_of_element_located((By.XPATH, '//*[@id="at-flight-search-result-1"]')), timeout=30
                     )
                     self.log_to_csv('INFO', f"URL opened successfully: {self.url}")
                     return  # Exit the function if the element is found
@@ -113,20 +114,24 @@ class QatarAirwaysCrawler(BaseCrawler):
         """
         Attempts to close the cookie consent banner on the website if present and logs the action.
         """
+        if self.session_reused:
+            # The banner has already been accepted in this browser session
+            self.log_to_csv('INFO', 'Cookies already accepted in this browser session')
+            return
         try:
             time.sleep(5) 
             self.driver.execute_script("window.scrollBy(0, 300);")  # Scroll down to trigger the cookie window
             time.sleep(2)  # Allow time for the scroll action and cookie banner to appear
 
             # Check for the presence of the cookie banner
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "#cookie-id > div.cookie-btn.col-md-12 > div"))
+            self.wait_for(
+                'accept_cookies.banner', EC.presence_of_element_located((By.CSS_SELECTOR, "#cookie-id > div.cookie-btn.col-md-12 > div"))
             )
 
             try:
                 # Wait for the accept button to be clickable and then click it
-                accept_button = WebDriverWait(self.driver, 10).until(
-                    EC.element_to_be_clickable((By.CSS_SELECTOR, "#cookie-accept-all"))
+                accept_button = self.wait_for(
+                    'accept_cookies.button', EC.element_to_be_clickable((By.CSS_SELECTOR, "#cookie-accept-all"))
                 )
                 accept_button.click()
                 time.sleep(1)  # Pause after clicking to ensure processing
@@ -148,16 +153,16 @@ class QatarAirwaysCrawler(BaseCrawler):
             # Click on the flight result
             flight_detail_link_xpath = '//*[@id="at-flight-search-result-1"]/div/div/div[1]/booking-smart-flight-card/qr-flight-card/div/div[3]/div/div'
             
-            details_button = WebDriverWait(self.driver, 30).until(
-                EC.element_to_be_clickable((By.XPATH, flight_detail_link_xpath))
+            details_button = self.wait_for(
+                'get_transit_duration.details', EC.element_to_be_clickable((By.XPATH, flight_detail_link_xpath)), timeout=30
             )
             details_button.click()
             self.log_to_csv('INFO', 'Flight details page clicked')
 
             # Wait for the details page to load and then extract the transit duration
             transit_duration_xpath = '/html/body/modal/div[2]/div/div[1]/div[2]/booking-smart-flight-details/qr-flight-details/div/div[3]/p'
-            transit_duration_element = WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located((By.XPATH, transit_duration_xpath))
+            transit_duration_element = self.wait_for(
+                'get_transit_duration.transit', EC.presence_of_element_located((By.XPATH, transit_duration_xpath)), timeout=30
             )
 
             transit_duration_text = transit_duration_element.text.strip()
@@ -165,12 +170,7 @@ class QatarAirwaysCrawler(BaseCrawler):
             self.log_to_csv('INFO', 'Flight details page loaded successfully')
 
             # Extract the time (e.g., "2h 10m") from the text
-            match = re.search(r'(\d+)h (\d+)m', transit_duration_text)
-            if match:
-                hours, minutes = match.groups()
-                self.transit_duration = f"{int(hours):02}:{int(minutes):02}"
-            else:
-                self.transit_duration = "00:00"
+            self.transit_duration = normalize_duration(transit_duration_text, default="00:00")
             self.log_to_csv('INFO', 'Transit duration extracted')
         except TimeoutException:
             self.log_to_csv('ERROR', 'Timeout waiting for flight details to load')
@@ -186,8 +186,8 @@ class QatarAirwaysCrawler(BaseCrawler):
         flight type, price, and airports. Logs the operation's success or any errors encountered.
         """
         try:
-            WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located((By.XPATH, '//*[@id="at-flight-search-result-1"]'))
+            self.wait_for(
+                'scrape_flight_data', EC.presence_of_element_located((By.XPATH, '//*[@id="at-flight-search-result-1"]')), timeout=30
             )
             flight_id = "at-flight-search-result-1"
             # XPaths for extracting flight details
@@ -208,10 +208,11 @@ class QatarAirwaysCrawler(BaseCrawler):
                 arrival_airport = self.driver.find_element(By.XPATH, arrival_airport_xpath).text.strip()
 
                 # Formatting extracted data
-                departure_time_formatted = datetime.strptime(departure_time, '%H:%M').strftime('%H:%M')
-                arrival_time_formatted = datetime.strptime(arrival_time, '%H:%M').strftime('%H:%M')
-                travel_duration_formatted = datetime.strptime(travel_duration, '%Hh %Mm').strftime('%H:%M')
-                price = float(price_text.replace('€', '').replace(',', '').strip())
+                departure_time_formatted = normalize_time(departure_time)
+                arrival_time_formatted = normalize_time(arrival_time)
+                travel_duration_formatted = normalize_duration(travel_duration)
+                # The separators vary with the language of the website ('€1,186' or '€1.186')
+                price = parse_price(price_text)
 
                 # Check for nonstop flight
                 if "Nonstop" in flight_type:
@@ -0,0 +1,348 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import shutil
+import threading
+
+from normalization import parse_duration, parse_price
+
+RESULT_FIELDNAMES = [
+    'airline_name', 'crawling_date', 'departure_airport', 'destination_airport',
+    'date', 'travel_duration', 'departure_time', 'arrival_time',
+    'transit', 'transit_duration', 'price', 'quality_flag'
+]
+
+# Values outside these ranges are parse errors rather than unusual fares, e.g. a Qatar fare of 1.186 €
+PRICE_RANGE = (20.0, 20000.0)
+DURATION_RANGE = (20, 48 * 60)
+
+# Flags of rows that are written to the quarantine file instead of the results file
+QUARANTINE_FLAGS = {'missing_price', 'implausible_price', 'missing_duration', 'implausible_duration'}
+
+# Results files are UTF-8. Bytes of older crawls that are no UTF-8 (e.g. Mac Roman umlauts) are read as
+# surrogates and written back unchanged, so rewriting a file never changes or drops them.
+ENCODING = 'utf-8'
+LEGACY_BYTES = 'surrogateescape'
+
+# Outliers are detected like in the analysis: outside [Q1 - 1.5 IQR, Q3 + 1.5 IQR]
+IQR_FACTOR = 1.5
+MIN_SAMPLES = 20
+
+
+class P2Quantile:
+    """
+    Streaming estimate of a quantile with the P² algorithm (Jain and Chlamtac, 1985).
+
+    Only five markers are kept, whatever the number of observations, so the estimate can be updated with
+    every saved row and stored as a few numbers.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value):
+        """ Adds an observation """
+        self.count += 1
+        if self.count <= 5:
+            self.heights.append(value)
+            self.heights.sort()
+            return
+
+        heights, positions = self.heights, self.positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(i for i in range(4) if heights[i] <= value < heights[i + 1])
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the three middle markers towards their desired positions
+        for i in range(1, 4):
+            offset = self.desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (offset <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = self.parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def parabolic(self, i, step):
+        heights, positions = self.heights, self.positions
+        return heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+            (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i])
+            + (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1])
+        )
+
+    def value(self):
+        """ Returns the current estimate, None before the first observation """
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            # Linear interpolation between the few observations, as pandas' quantile() does
+            rank = self.p * (len(self.heights) - 1)
+            lower = int(rank)
+            upper = min(lower + 1, len(self.heights) - 1)
+            return self.heights[lower] + (rank - lower) * (self.heights[upper] - self.heights[lower])
+        return self.heights[2]
+
+    def to_dict(self):
+        return {'p': self.p, 'count': self.count, 'heights': self.heights,
+                'positions': self.positions, 'desired': self.desired}
+
+    @classmethod
+    def from_dict(cls, data):
+        estimator = cls(data['p'])
+        estimator.count = data['count']
+        estimator.heights = data['heights']
+        estimator.positions = data['positions']
+        estimator.desired = data['desired']
+        return estimator
+
+
+class IQRSketch:
+    """
+    Streaming first and third quartile of a value, giving the outlier fences of the IQR method.
+    """
+
+    def __init__(self, q1=None, q3=None):
+        self.q1 = q1 or P2Quantile(0.25)
+        self.q3 = q3 or P2Quantile(0.75)
+
+    @property
+    def count(self):
+        return self.q1.count
+
+    def add(self, value):
+        self.q1.add(value)
+        self.q3.add(value)
+
+    def fences(self):
+        """ Returns the (lower, upper) bounds of acceptable values """
+        q1, q3 = self.q1.value(), self.q3.value()
+        iqr = q3 - q1
+        return q1 - IQR_FACTOR * iqr, q3 + IQR_FACTOR * iqr
+
+    def to_dict(self):
+        return {'q1': self.q1.to_dict(), 'q3': self.q3.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(P2Quantile.from_dict(data['q1']), P2Quantile.from_dict(data['q3']))
+
+
+class QualityGate:
+    """
+    Checks result rows while they are saved.
+
+    Rows with a missing or implausible price or duration are sent to a quarantine file. All other rows are
+    compared with the prices and travel durations seen so far on the same route, or of the airline while a
+    route has fewer than MIN_SAMPLES rows, and flagged as outliers by the IQR method. The quartiles are
+    estimated in a streaming way and kept in logs/quality_sketches.json between cycles.
+
+    Parameters:
+        state_file (str): The file the sketches are stored in.
+        min_samples (int): The number of rows a sketch needs before outliers are flagged.
+    """
+
+    def __init__(self, state_file=os.path.join('logs', 'quality_sketches.json'), min_samples=MIN_SAMPLES):
+        self.state_file = state_file
+        self.min_samples = min_samples
+        self.sketches = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.state_file):
+            return
+        with open(self.state_file, 'r') as file:
+            data = json.load(file)
+        self.sketches = {
+            key: {measure: IQRSketch.from_dict(sketch) for measure, sketch in measures.items()}
+            for key, measures in data.items()
+        }
+
+    def save(self):
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {
+            key: {measure: sketch.to_dict() for measure, sketch in measures.items()}
+            for key, measures in self.sketches.items()
+        }
+        temporary = self.state_file + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary, self.state_file)
+
+    def sketch(self, key, measure):
+        return self.sketches.setdefault(key, {}).setdefault(measure, IQRSketch())
+
+    def fences(self, keys, measure):
+        """ Returns the fences of the most specific sketch with enough samples, or None """
+        for key in keys:
+            sketch = self.sketches.get(key, {}).get(measure)
+            if sketch is not None and sketch.count >= self.min_samples:
+                return sketch.fences()
+        return None
+
+    def check(self, row):
+        """
+        Flags a result row and adds its values to the sketches.
+
+        Parameters:
+            row (dict): The result row, its 'quality_flag' is set.
+
+        Returns:
+            str: 'ok' or the flags of the row separated by ';', e.g. 'price_outlier;duration_outlier'.
+        """
+        price = parse_price(row.get('price'))
+        minutes = parse_duration(row.get('travel_duration'))
+        route = '|'.join(str(row.get(field)) for field in ('airline_name', 'departure_airport', 'destination_airport'))
+        keys = [route, str(row.get('airline_name'))]
+
+        flags = []
+        checked = []
+        if price is None:
+            flags.append('missing_price')
+        elif not PRICE_RANGE[0] <= price <= PRICE_RANGE[1]:
+            flags.append('implausible_price')
+        else:
+            checked.append(('price', price, 'price_outlier'))
+        if minutes is None:
+            flags.append('missing_duration')
+        elif not DURATION_RANGE[0] <= minutes <= DURATION_RANGE[1]:
+            flags.append('implausible_duration')
+        else:
+            checked.append(('travel_minutes', minutes, 'duration_outlier'))
+
+        with self.lock:
+            for measure, value, flag in checked:
+                fences = self.fences(keys, measure)
+                if fences and not fences[0] <= value <= fences[1]:
+                    flags.append(flag)
+                for key in keys:
+                    self.sketch(key, measure).add(value)
+
+        row['quality_flag'] = ';'.join(flags) or 'ok'
+        return row['quality_flag']
+
+    def screen(self, rows):
+        """
+        Checks rows before they are written and stores the updated sketches.
+
+        Returns:
+            tuple: (rows for the results file, rows for the quarantine file)
+        """
+        accepted, quarantined = [], []
+        for row in rows:
+            flags = set(self.check(row).split(';'))
+            (quarantined if flags & QUARANTINE_FLAGS else accepted).append(row)
+        with self.lock:
+            self.save()
+        return accepted, quarantined
+
+
+def append_results(path, rows, fieldnames=RESULT_FIELDNAMES):
+    """
+    Appends rows to a results file, adding columns the file does not have yet.
+
+    Results files written before a column was introduced (e.g. quality_flag) are rewritten once with the
+    new column left empty for the old rows, so all rows of a file keep the same columns. Must be called
+    while holding the file lock of the writers.
+    """
+    file_exists = os.path.isfile(path) and os.path.getsize(path) > 0
+    if file_exists:
+        with open(path, 'r', newline='', encoding=ENCODING, errors=LEGACY_BYTES) as csvfile:
+            header = next(csv.reader(csvfile))
+        missing = [field for field in fieldnames if field not in header]
+        if missing:
+            migrate_header(path, header + missing)
+        fieldnames = header + missing
+
+    with open(path, 'a', newline='', encoding=ENCODING) as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+        if not file_exists:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def migrate_header(path, fieldnames):
+    """
+    Rewrites a results file with the given columns. Values in other encodings than UTF-8 are kept byte
+    for byte.
+    """
+    temporary = path + '.tmp'
+    with open(path, 'r', newline='', encoding=ENCODING, errors=LEGACY_BYTES) as source, \
+            open(temporary, 'w', newline='', encoding=ENCODING, errors=LEGACY_BYTES) as target:
+        writer = csv.DictWriter(target, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(csv.DictReader(source))
+    os.replace(temporary, path)
+
+
+def rebuild(files, state_file, backup=True):
+    """
+    Builds the sketches from scratch by replaying the results files and flags their rows.
+
+    Rows are replayed in the order they were crawled, so every row is judged only by the rows before it,
+    like during crawling. Rows are flagged but never moved to the quarantine file. With backup, a copy of
+    every results file is kept as '<path>.bak' before it is overwritten the first time.
+
+    Returns:
+        dict: {file: {flag: number of rows}}
+    """
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    gate = QualityGate(state_file)
+    summary = {}
+    for path in files:
+        with open(path, 'r', newline='', encoding=ENCODING, errors=LEGACY_BYTES) as csvfile:
+            reader = csv.DictReader(csvfile)
+            header = reader.fieldnames
+            rows = list(reader)
+        counts = summary.setdefault(path, {})
+        for row in rows:
+            for flag in gate.check(row).split(';'):
+                counts[flag] = counts.get(flag, 0) + 1
+        fieldnames = header + [field for field in RESULT_FIELDNAMES if field not in header]
+        if backup and not os.path.exists(path + '.bak'):
+            shutil.copyfile(path, path + '.bak')
+        temporary = path + '.tmp'
+        with open(temporary, 'w', newline='', encoding=ENCODING, errors=LEGACY_BYTES) as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(temporary, path)
+    gate.save()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuilds the price and duration sketches of the quality gate from the results files.')
+    parser.add_argument('files', nargs='*', help='Results files to replay (default: results/results_*.csv)')
+    parser.add_argument('--state', default=os.path.join('logs', 'quality_sketches.json'), help='File of the sketches')
+    parser.add_argument('--no-backup', action='store_true', help='Do not keep a .bak copy of overwritten files')
+    args = parser.parse_args(argv)
+
+    files = args.files or sorted(glob.glob(os.path.join('results', 'results_*.csv')))
+    for path, counts in rebuild(files, args.state, not args.no_backup).items():
+        print(f"{path}: " + ', '.join(f"{flag} {count}" for flag, count in sorted(counts.items())))
+    print(f"------------------ Sketches saved to {args.state} ------------------")
+
+
+if __name__ == "__main__":
+    main()
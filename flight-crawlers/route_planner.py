@@ -0,0 +1,281 @@
+import csv
+import heapq
+import math
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+from circuit_breaker import CircuitBreaker
+from crawl_jobs import create_crawler, run_crawler_with_expected_results
+
+DURATION_FIELDNAMES = [
+    'date', 'time', 'airline', 'departure_airport', 'destination_airport', 'departure_date',
+    'session_reused', 'seconds', 'success'
+]
+
+DEFAULT_JOB_SECONDS = 180.0
+DEFAULT_REUSE_FACTOR = 0.7
+DEFAULT_MAX_SESSION_JOBS = 10
+
+_write_lock = threading.Lock()
+
+
+class RoutePlan:
+    """
+    The assignment of crawling jobs to workers.
+
+    Every worker gets a queue of sessions. A session is a list of jobs of the same airline and origin, ordered
+    by departure date, that run one after another in the same browser: only the first job starts Chrome and
+    accepts the cookies, the following ones continue in the open browser.
+    """
+
+    def __init__(self, workers):
+        self.queues = [[] for _ in range(workers)]
+        self.loads = [0.0] * workers
+
+    @property
+    def sessions(self):
+        """ All sessions of the plan """
+        return [session for queue in self.queues for session in queue]
+
+    @property
+    def jobs(self):
+        """ All jobs of the plan """
+        return [job for session in self.sessions for job in session]
+
+    @property
+    def estimated_seconds(self):
+        """ The estimated duration of the cycle, i.e. the load of the busiest worker """
+        return max(self.loads) if self.loads else 0.0
+
+    def describe(self):
+        """ Prints the sessions per worker and the estimated duration """
+        for index, queue in enumerate(self.queues, start=1):
+            print(f"Worker {index} ({len(queue)} sessions, ~{self.loads[index - 1] / 60:.0f} min):")
+            for session in queue:
+                first, last = session[0], session[-1]
+                print(f"  {first.airline} from {first.departure_airport}: {len(session)} routes, "
+                      f"{first.date} to {last.date}")
+        print(f"{len(self.jobs)} jobs in {len(self.sessions)} sessions, "
+              f"estimated cycle duration {format_duration(self.estimated_seconds)}")
+
+
+def format_duration(seconds):
+    """ Formats a number of seconds as 'Xh YYmin' """
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60}h {minutes % 60:02d}min"
+
+
+def group_jobs(jobs):
+    """
+    Groups the jobs by airline and origin, the browser state that consecutive jobs can share.
+
+    Returns:
+        dict: {(airline, departure_airport): [jobs ordered by date and destination]}
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job.airline, job.departure_airport), []).append(job)
+    return {key: sorted(group, key=lambda job: (job.date, job.destination_airport)) for key, group in groups.items()}
+
+
+def split_sessions(jobs, workers, max_session_jobs=DEFAULT_MAX_SESSION_JOBS):
+    """
+    Splits the jobs into sessions of at most max_session_jobs jobs sharing one browser.
+
+    A group is cut into smaller sessions when it holds more than its share of all jobs, so that a single
+    large group can still be spread over all workers.
+
+    Returns:
+        list: The sessions, each a list of jobs.
+    """
+    size = max(1, min(max_session_jobs, math.ceil(len(jobs) / max(workers, 1))))
+    sessions = []
+    for group in group_jobs(jobs).values():
+        sessions += [group[start:start + size] for start in range(0, len(group), size)]
+    return sessions
+
+
+def load_job_estimates(log_dir='logs'):
+    """
+    Estimates the duration of a job per airline from previous cycles.
+
+    The durations recorded by the planner (logs/job_durations.csv) are used if present, otherwise the wall
+    times of single jobs in logs/resource_usage.csv.
+
+    Returns:
+        dict: {airline: {'fresh': seconds, 'reused': seconds}} with the median duration of a job in a new
+              browser and of a job continuing in an open one. 'reused' is missing if it was never measured.
+    """
+    samples = {}
+    durations_file = os.path.join(log_dir, 'job_durations.csv')
+    if os.path.exists(durations_file):
+        with open(durations_file, 'r', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                if row.get('success') != 'True':
+                    continue
+                kind = 'reused' if row.get('session_reused') == 'True' else 'fresh'
+                samples.setdefault(row['airline'], {}).setdefault(kind, []).append(float(row['seconds']))
+
+    usage_file = os.path.join(log_dir, 'resource_usage.csv')
+    if os.path.exists(usage_file):
+        usage = {}
+        with open(usage_file, 'r', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                # Only single jobs ('KLM Frankfurt - Berlin') without a killed browser describe one route
+                if ' - ' not in row['job'] or row['killed']:
+                    continue
+                usage.setdefault(row['job'].split(' ', 1)[0], []).append(float(row['wall_seconds']))
+        for airline, values in usage.items():
+            samples.setdefault(airline, {}).setdefault('fresh', values)
+
+    return {
+        airline: {kind: statistics.median(values) for kind, values in kinds.items() if values}
+        for airline, kinds in samples.items()
+    }
+
+
+def estimate_session_seconds(session, estimates):
+    """
+    Estimates how long a session takes: one job in a new browser plus the jobs continuing in it.
+    """
+    airline_estimate = estimates.get(session[0].airline, {})
+    fresh = airline_estimate.get('fresh', DEFAULT_JOB_SECONDS)
+    reused = airline_estimate.get('reused', fresh * DEFAULT_REUSE_FACTOR)
+    return fresh + (len(session) - 1) * reused
+
+
+def plan_jobs(jobs, workers=1, max_session_jobs=DEFAULT_MAX_SESSION_JOBS, estimates=None, log_dir='logs'):
+    """
+    Groups the jobs into browser sessions and distributes them over the workers.
+
+    The sessions are assigned longest first to the worker with the least estimated load (LPT scheduling),
+    which keeps the workers evenly busy and the cycle short.
+
+    Parameters:
+        jobs (list): The CrawlJobs to plan.
+        workers (int): The number of browsers running at the same time.
+        max_session_jobs (int): The maximum number of jobs sharing one browser, 1 starts a new browser per job.
+        estimates (dict): Job durations per airline as returned by load_job_estimates(), loaded if not given.
+        log_dir (str): The directory holding the duration history.
+
+    Returns:
+        RoutePlan: The sessions per worker with their estimated load.
+    """
+    estimates = load_job_estimates(log_dir) if estimates is None else estimates
+    plan = RoutePlan(workers)
+    sessions = [(estimate_session_seconds(session, estimates), session)
+                for session in split_sessions(jobs, workers, max_session_jobs)]
+    sessions.sort(key=lambda item: -item[0])
+
+    heap = [(0.0, index) for index in range(workers)]
+    for seconds, session in sessions:
+        load, index = heapq.heappop(heap)
+        plan.queues[index].append(session)
+        plan.loads[index] = load + seconds
+        heapq.heappush(heap, (load + seconds, index))
+
+    for queue in plan.queues:
+        queue.sort(key=lambda session: (session[0].airline, session[0].departure_airport, session[0].date))
+    return plan
+
+
+def record_job_duration(job, success, seconds, session_reused, log_dir='logs'):
+    """
+    Appends the duration of a finished job to logs/job_durations.csv, the basis of the next estimates.
+    """
+    now = datetime.now()
+    with _write_lock:
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        path = os.path.join(log_dir, 'job_durations.csv')
+        file_exists = os.path.isfile(path)
+        with open(path, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=DURATION_FIELDNAMES)
+            if not file_exists:
+                writer.writeheader()
+            writer.writerow({
+                'date': now.strftime('%Y-%m-%d'),
+                'time': now.strftime('%H:%M:%S'),
+                'airline': job.airline,
+                'departure_airport': job.departure_airport,
+                'destination_airport': job.destination_airport,
+                'departure_date': job.date.strftime('%Y-%m-%d'),
+                'session_reused': session_reused,
+                'seconds': f'{seconds:.1f}',
+                'success': success
+            })
+
+
+def run_session(session, breaker, supervisor=None, configure=None, log_dir='logs'):
+    """
+    Runs the jobs of a session one after another in the same browser.
+
+    The browser is handed from crawler to crawler and only closed after the last job. After a failed job it is
+    closed as well, so the next job starts from a clean browser. Jobs skipped by the circuit breaker leave it open.
+
+    Returns:
+        list: One (job, success, seconds) tuple per job.
+    """
+    first = session[0]
+    name = f"{first.airline} {first.departure_airport}: {len(session)} routes"
+    budget = supervisor.max_wall_time * len(session) if supervisor else None
+    outcomes = []
+    driver = None
+    crawler = None
+    with supervisor.job(name, budget) if supervisor else nullcontext():
+        for index, job in enumerate(session):
+            # A job skipped by the circuit breaker never touches the browser, which stays with the session
+            if not breaker.allow(job.airline):
+                print(f"Circuit for {job.airline} is open, skipping {job.departure_airport} - {job.destination_airport}")
+                outcomes.append((job, False, 0.0))
+                continue
+            crawler = create_crawler(job)
+            if configure:
+                configure(crawler)
+            if driver is not None:
+                crawler.adopt_session(driver)
+            crawler.keep_session = index < len(session) - 1
+
+            start = time.monotonic()
+            success = run_crawler_with_expected_results(crawler, 1, breaker, admitted=True)
+            seconds = time.monotonic() - start
+            if not success:
+                crawler.stop_driver(force=True)
+            driver = crawler.driver
+
+            record_job_duration(job, success, seconds, crawler.session_reused, log_dir)
+            outcomes.append((job, success, seconds))
+        if crawler is not None:
+            crawler.stop_driver(force=True)
+    return outcomes
+
+
+def run_plan(plan, breaker=None, supervisor=None, configure=None, log_dir='logs'):
+    """
+    Runs a RoutePlan, one thread per worker working through its sessions.
+
+    Parameters:
+        plan (RoutePlan): The plan to run.
+        breaker (CircuitBreaker): The circuit breaker shared by all workers.
+        supervisor (BrowserSupervisor): The supervisor of the browser processes, if any.
+        configure (callable): Called with every crawler before it runs, e.g. to point it to a mock website.
+        log_dir (str): The directory for the duration history.
+
+    Returns:
+        list: One (job, success, seconds) tuple per job.
+    """
+    breaker = breaker or CircuitBreaker()
+
+    def run_queue(queue):
+        outcomes = []
+        for session in queue:
+            outcomes += run_session(session, breaker, supervisor, configure, log_dir)
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=max(len(plan.queues), 1)) as executor:
+        return [outcome for outcomes in executor.map(run_queue, plan.queues) for outcome in outcomes]
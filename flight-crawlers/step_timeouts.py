@@ -0,0 +1,198 @@
+import csv
+import json
+import math
+import os
+import threading
+from datetime import datetime
+
+LATENCY_FIELDNAMES = ['date', 'time', 'step', 'seconds', 'outcome']
+
+DEFAULT_PERCENTILE = 0.99
+DEFAULT_MARGIN = 1.5
+DEFAULT_FLOOR = 3.0
+DEFAULT_CEILING = 60.0
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_HISTORY = 500
+
+_write_lock = threading.Lock()
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile (0 <= q <= 1) of a list of numbers using the nearest-rank method.
+
+    Parameters:
+        values (list): The sample values.
+        q (float): The requested quantile.
+
+    Returns:
+        float: The percentile value, or None if no values are given.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(max(1, math.ceil(q * len(ordered))), len(ordered))
+    return ordered[rank - 1]
+
+
+class StepTimeouts:
+    """
+    Keeps per-step timeout budgets for one airline, learned from the recorded latencies of previous crawls.
+
+    Every wait of a crawler is recorded in logs/step_latencies_<airline>.csv. After each crawling cycle
+    update_step_timeouts() derives a budget per step (p99 x margin, clamped to floor and ceiling) and stores
+    it in logs/step_timeouts.json, which is read again by the next crawler instances.
+    """
+
+    def __init__(self, airline_name, log_dir='logs'):
+        """
+        Initializes the StepTimeouts for an airline and loads the stored budgets.
+
+        Parameters:
+            airline_name (str): The name of the airline.
+            log_dir (str): The directory holding the latency history and the budget file.
+        """
+        self.airline_name = airline_name
+        self.log_dir = log_dir
+        self.latency_file = latency_file_path(airline_name, log_dir)
+        self.budgets = load_budgets(log_dir).get(airline_name, {})
+
+    def get(self, step, default):
+        """
+        Returns the timeout budget in seconds for a step, or the default if nothing has been learned yet.
+
+        Parameters:
+            step (str): The name of the crawling step.
+            default (float): The constant timeout the crawler used before.
+
+        Returns:
+            float: The timeout in seconds.
+        """
+        return self.budgets.get(step, default)
+
+    def record(self, step, seconds, outcome='ok'):
+        """
+        Appends a measured wait to the latency history of the airline.
+
+        Parameters:
+            step (str): The name of the crawling step.
+            seconds (float): The time the wait took.
+            outcome (str): 'ok' if the condition was met, 'timeout' otherwise.
+        """
+        now = datetime.now()
+        with _write_lock:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+            file_exists = os.path.isfile(self.latency_file)
+            with open(self.latency_file, 'a', newline='') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=LATENCY_FIELDNAMES)
+                if not file_exists:
+                    writer.writeheader()
+                writer.writerow({
+                    'date': now.strftime('%Y-%m-%d'),
+                    'time': now.strftime('%H:%M:%S'),
+                    'step': step,
+                    'seconds': f'{seconds:.3f}',
+                    'outcome': outcome
+                })
+
+
+def latency_file_path(airline_name, log_dir='logs'):
+    """ Returns the path of the latency history file of an airline """
+    return os.path.join(log_dir, f'step_latencies_{airline_name}.csv')
+
+
+def budget_file_path(log_dir='logs'):
+    """ Returns the path of the file holding the learned budgets of all airlines """
+    return os.path.join(log_dir, 'step_timeouts.json')
+
+
+def load_budgets(log_dir='logs'):
+    """
+    Loads the learned budgets of all airlines.
+
+    Returns:
+        dict: {airline_name: {step: seconds}}, empty if no budgets have been computed yet.
+    """
+    path = budget_file_path(log_dir)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_latencies(airline_name, log_dir='logs', history=DEFAULT_HISTORY):
+    """
+    Reads the latest successful wait durations per step for an airline.
+
+    Parameters:
+        airline_name (str): The name of the airline.
+        log_dir (str): The directory holding the latency history.
+        history (int): The number of most recent samples kept per step.
+
+    Returns:
+        dict: {step: [seconds, ...]}
+    """
+    path = latency_file_path(airline_name, log_dir)
+    latencies = {}
+    if not os.path.exists(path):
+        return latencies
+    with open(path, 'r', newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            # Only successful waits describe how long a healthy step takes
+            if row.get('outcome') != 'ok':
+                continue
+            try:
+                seconds = float(row['seconds'])
+            except (TypeError, ValueError):
+                continue
+            latencies.setdefault(row['step'], []).append(seconds)
+    return {step: values[-history:] for step, values in latencies.items()}
+
+
+def compute_budgets(latencies, q=DEFAULT_PERCENTILE, margin=DEFAULT_MARGIN, floor=DEFAULT_FLOOR,
+                    ceiling=DEFAULT_CEILING, min_samples=DEFAULT_MIN_SAMPLES):
+    """
+    Derives a timeout budget per step from its latency samples.
+
+    Steps with fewer than min_samples samples get no budget, so the crawler keeps its constant timeout.
+
+    Returns:
+        dict: {step: seconds}
+    """
+    budgets = {}
+    for step, values in latencies.items():
+        if len(values) < min_samples:
+            continue
+        budget = percentile(values, q) * margin
+        budgets[step] = round(min(max(budget, floor), ceiling), 2)
+    return budgets
+
+
+def update_step_timeouts(airline_names, log_dir='logs', **kwargs):
+    """
+    Recomputes the budgets of the given airlines from their latency history and stores them.
+    Meant to be called once after every crawling cycle.
+
+    Parameters:
+        airline_names (list): The airlines whose budgets should be updated.
+        log_dir (str): The directory holding the latency history and the budget file.
+        **kwargs: Passed on to compute_budgets (q, margin, floor, ceiling, min_samples).
+
+    Returns:
+        dict: The budgets of all airlines after the update.
+    """
+    budgets = load_budgets(log_dir)
+    for airline_name in airline_names:
+        budgets[airline_name] = compute_budgets(read_latencies(airline_name, log_dir), **kwargs)
+
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    path = budget_file_path(log_dir)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(budgets, file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return budgets
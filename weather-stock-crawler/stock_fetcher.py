@@ -0,0 +1,235 @@
+import argparse
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from weather_fetcher import SCRIPT_DIR, START_DATE, append_frame, date_range
+
+# Incremental version of the stock part of weather_stock_crawler.ipynb. combined_stocks.csv is the cache:
+# only the trading days after the last stored day of every airline are requested, with one request for all
+# tickers, and appended to it and to the <Airline>_stock_data.csv files.
+
+STOCKS_DIR = os.path.join(SCRIPT_DIR, 'stocks')
+COMBINED_FILE = 'combined_stocks.csv'
+
+STOCK_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+# Airline -> Yahoo Finance ticker. KLM is listed as part of Air France-KLM.
+AIRLINE_TICKERS = {
+    'KLM': 'AF.PA',
+    'Lufthansa': 'LHA.DE',
+    'Turkish': 'THYAO.IS'
+}
+
+# Airlines without own shares, analysed with the stock of their group. Qatar Airways is state-owned and has
+# no stock data at all.
+STOCK_PROXIES = {
+    'AustrianAirlines': 'Lufthansa',
+    'Austrian': 'Lufthansa'
+}
+
+
+def stock_airline(airline):
+    """ Returns the airline whose stock data is used for an airline, None if there is none """
+    airline = STOCK_PROXIES.get(airline, airline)
+    return airline if airline in AIRLINE_TICKERS else None
+
+
+def ticker_for(airline):
+    """ Returns the ticker used for an airline, e.g. 'LHA.DE' for 'AustrianAirlines', None if there is none """
+    return AIRLINE_TICKERS.get(stock_airline(airline))
+
+
+class YahooSource:
+    """ Daily prices from Yahoo Finance, as fetched by the notebook, but for all tickers in one request """
+
+    def fetch(self, tickers, start, end):
+        """
+        Fetches the prices of several tickers.
+
+        Parameters:
+            tickers (list): The tickers.
+            start (date): The first day to fetch.
+            end (date): The last day to fetch.
+
+        Returns:
+            dict: Ticker -> DataFrame with one row per trading day indexed by 'Date', with the STOCK_COLUMNS.
+        """
+        import yfinance as yf
+
+        # The end date of yfinance is exclusive
+        data = yf.download(tickers, start=start, end=end + timedelta(days=1), group_by='ticker',
+                           auto_adjust=False, progress=False)
+        prices = {}
+        for ticker in tickers:
+            df = data[ticker] if isinstance(data.columns, pd.MultiIndex) else data
+            df = df.reindex(columns=STOCK_COLUMNS).dropna(how='all')
+            df.index = pd.to_datetime(df.index).tz_localize(None).normalize()
+            df.index.name = 'Date'
+            prices[ticker] = df
+        return prices
+
+
+class FakeStockSource:
+    """
+    Offline stock source for tests.
+
+    Returns made up but reproducible prices for every ticker and weekday and records the requests, so a
+    test can check that all tickers are fetched at once and only for the missing days.
+
+    Parameters:
+        published_until (date): The last day with prices.
+    """
+
+    def __init__(self, published_until=None):
+        self.published_until = published_until
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def fetch(self, tickers, start, end):
+        with self.lock:
+            self.requests.append((tuple(tickers), start, end))
+        if self.published_until is not None:
+            end = min(end, self.published_until)
+        prices = {}
+        for ticker in tickers:
+            rows = []
+            for day in date_range(start, end) if start <= end else []:
+                if day.weekday() >= 5:
+                    continue
+                rng = random.Random(f'{ticker}|{day.isoformat()}')
+                close = round(rng.uniform(5, 10), 3)
+                rows.append({
+                    'Date': pd.Timestamp(day),
+                    'Open': round(close * rng.uniform(0.98, 1.02), 3),
+                    'High': round(close * rng.uniform(1.0, 1.03), 3),
+                    'Low': round(close * rng.uniform(0.97, 1.0), 3),
+                    'Close': close,
+                    'Adj Close': close,
+                    'Volume': rng.randint(500000, 10000000)
+                })
+            prices[ticker] = pd.DataFrame(rows, columns=['Date'] + STOCK_COLUMNS).set_index('Date')
+        return prices
+
+
+def airline_file(airline, stocks_dir=STOCKS_DIR):
+    return os.path.join(stocks_dir, f"{airline}_stock_data.csv")
+
+
+def last_rows(combined_path):
+    """ Returns the last stored row of every airline in the combined file, indexed by airline """
+    if not os.path.exists(combined_path) or os.path.getsize(combined_path) == 0:
+        return pd.DataFrame(columns=['Date'] + STOCK_COLUMNS)
+    combined = pd.read_csv(combined_path, parse_dates=['Date'])
+    return combined.sort_values('Date', kind='stable').groupby('Airline').tail(1).set_index('Airline')
+
+
+def fill_weekends(prices, last_row, start, end):
+    """
+    Returns the rows of all calendar days from start to end: the trading days, and Saturday and Sunday with
+    the prices of Friday, as the notebook did. Weekdays without trading (holidays) are left out.
+
+    Parameters:
+        prices (pandas.DataFrame): The new trading days, indexed by 'Date'.
+        last_row (pandas.Series): The last stored row of the airline, None if there is none.
+    """
+    rows = {}
+    previous = None
+    if last_row is not None:
+        previous = (last_row['Date'].date(), last_row[STOCK_COLUMNS])
+    for day in date_range(start, end) if start <= end else []:
+        timestamp = pd.Timestamp(day)
+        if timestamp in prices.index:
+            rows[timestamp] = prices.loc[timestamp, STOCK_COLUMNS]
+        elif day.weekday() >= 5 and previous is not None and previous[0] == day - timedelta(days=1):
+            rows[timestamp] = previous[1]
+        else:
+            continue
+        previous = (day, rows[timestamp])
+    if not rows:
+        return pd.DataFrame(columns=STOCK_COLUMNS)
+    return pd.DataFrame(rows.values(), index=pd.DatetimeIndex(list(rows), name='Date'))[STOCK_COLUMNS]
+
+
+def update_stocks(airlines=None, source=None, end=None, stocks_dir=STOCKS_DIR):
+    """
+    Fetches the trading days after the last stored day of every airline in one request and appends them to
+    combined_stocks.csv and the airline files.
+
+    Parameters:
+        airlines (list): The airlines to update, all airlines of AIRLINE_TICKERS if not given.
+        source: The stock source, a YahooSource if not given.
+        end (date): The last day to fetch, yesterday if not given (the prices of today are not final yet).
+        stocks_dir (str): The folder of the airline files and the combined file.
+
+    Returns:
+        dict: Airline -> number of new trading days.
+    """
+    source = source or YahooSource()
+    end = end or datetime.now().date() - timedelta(days=1)
+    airlines = sorted({stock_airline(airline) for airline in airlines or AIRLINE_TICKERS} - {None})
+    os.makedirs(stocks_dir, exist_ok=True)
+    combined_path = os.path.join(stocks_dir, COMBINED_FILE)
+
+    last = last_rows(combined_path)
+    starts = {}
+    for airline in airlines:
+        starts[airline] = last.loc[airline, 'Date'].date() + timedelta(days=1) if airline in last.index else START_DATE
+    missing = [airline for airline in airlines if starts[airline] <= end]
+    if not missing:
+        return {airline: 0 for airline in airlines}
+
+    tickers = [AIRLINE_TICKERS[airline] for airline in missing]
+    prices = source.fetch(tickers, min(starts[airline] for airline in missing), end)
+
+    new_rows = []
+    trading_days = {airline: 0 for airline in airlines}
+    for airline in missing:
+        df = prices.get(AIRLINE_TICKERS[airline], pd.DataFrame(columns=STOCK_COLUMNS))
+        df = df[(df.index >= pd.Timestamp(starts[airline])) & (df.index <= pd.Timestamp(end))]
+        trading_days[airline] = len(df)
+        if df.empty:
+            continue
+        # The airline files hold the trading days only, numbered on from the last row
+        path = airline_file(airline, stocks_dir)
+        offset = len(pd.read_csv(path, usecols=[0])) if os.path.exists(path) else 0
+        append_frame(path, df.reset_index().set_axis(range(offset, offset + len(df))))
+
+        last_row = last.loc[airline] if airline in last.index else None
+        filled = fill_weekends(df, last_row, starts[airline], end)
+        new_rows.append(filled.reset_index().assign(Airline=airline))
+
+    if new_rows:
+        combined = pd.concat(new_rows).sort_values(['Date', 'Airline'], kind='stable')
+        # Volume is stored as float, as in the combined file written by the notebook
+        combined['Volume'] = combined['Volume'].astype(float)
+        append_frame(combined_path, combined[['Date'] + STOCK_COLUMNS + ['Airline']], index=False)
+    return trading_days
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fetches the missing trading days of the airline stocks.')
+    parser.add_argument('--end', default=None, help='Last day to fetch as YYYY-MM-DD (default: yesterday)')
+    parser.add_argument('--airlines', nargs='+', default=None, help='Airlines to update (default: all)')
+    parser.add_argument('--stocks-dir', default=None, help='Folder of the airline files and combined_stocks.csv (default: stocks)')
+    parser.add_argument('--fake', action='store_true', help='Use made up offline prices instead of Yahoo Finance (for tests)')
+    args = parser.parse_args(argv)
+    # Made up data must not end up in the real files
+    if args.fake and args.stocks_dir is None:
+        parser.error('--fake needs an explicit --stocks-dir')
+    args.stocks_dir = args.stocks_dir or STOCKS_DIR
+
+    end = datetime.strptime(args.end, '%Y-%m-%d').date() if args.end else None
+    source = FakeStockSource() if args.fake else YahooSource()
+    start = time.monotonic()
+    for airline, count in update_stocks(args.airlines, source, end, args.stocks_dir).items():
+        print(f"{airline} ({AIRLINE_TICKERS[airline]}): {count} new trading days")
+    print(f"------------------ Stocks updated in {time.monotonic() - start:.2f}s ------------------")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import argparse
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+# Incremental version of the weather part of weather_stock_crawler.ipynb. The <City>_weather.csv files are
+# the cache: for every city only the days after its last cached day are requested, all cities are fetched
+# at the same time, and the new days are appended to the city files and to combined_weather.csv instead of
+# rewriting them.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+WEATHER_DIR = os.path.join(SCRIPT_DIR, 'weather')
+COMBINED_FILE = 'combined_weather.csv'
+
+# First day of the weather history, as in the notebook
+START_DATE = date(2024, 8, 1)
+
+WEATHER_COLUMNS = ['tavg', 'tmin', 'tmax', 'prcp', 'snow', 'wdir', 'wspd', 'wpgt', 'pres', 'tsun']
+
+LOCATIONS = {
+    "Frankfurt": {"latitude": 50.1109, "longitude": 8.6821},
+    "Berlin": {"latitude": 52.5200, "longitude": 13.4050},
+    "Hamburg": {"latitude": 53.5511, "longitude": 9.9937},
+    "Munich": {"latitude": 48.1351, "longitude": 11.5820},
+    "London": {"latitude": 51.5074, "longitude": -0.1278},
+    "Palma": {"latitude": 39.5696, "longitude": 2.6502},
+    "Istanbul": {"latitude": 41.0082, "longitude": 28.9784},
+    "Dubai": {"latitude": 25.276987, "longitude": 55.296249},
+    "New_York": {"latitude": 40.7128, "longitude": -74.0060},
+    "Shanghai": {"latitude": 31.2304, "longitude": 121.4737}
+}
+
+# Number of cities fetched at the same time
+DEFAULT_WORKERS = 4
+
+
+def date_range(start, end):
+    """ Returns all dates from start to end, both included """
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+class MeteostatSource:
+    """ Daily weather data of the Meteostat API, as fetched by the notebook """
+
+    def fetch(self, city, coordinates, start, end):
+        """
+        Fetches the weather of a city.
+
+        Parameters:
+            city (str): The name of the city.
+            coordinates (dict): Its 'latitude' and 'longitude'.
+            start (date): The first day to fetch.
+            end (date): The last day to fetch.
+
+        Returns:
+            pandas.DataFrame: One row per day indexed by 'time', with the WEATHER_COLUMNS.
+        """
+        from meteostat import Point, Daily
+
+        point = Point(coordinates['latitude'], coordinates['longitude'])
+        return Daily(point, datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time())).fetch()
+
+
+class FakeWeatherSource:
+    """
+    Offline weather source for tests.
+
+    Returns made up but reproducible values for every city and day and records the requested ranges, so a
+    test can check that only the missing days are fetched.
+
+    Parameters:
+        published_until (date): The last day with data, later days are not returned yet (like Meteostat,
+                                which publishes the data of a day with some delay).
+    """
+
+    def __init__(self, published_until=None):
+        self.published_until = published_until
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def fetch(self, city, coordinates, start, end):
+        with self.lock:
+            self.requests.append((city, start, end))
+        if self.published_until is not None:
+            end = min(end, self.published_until)
+        rows = []
+        for day in date_range(start, end) if start <= end else []:
+            rng = random.Random(f'{city}|{day.isoformat()}')
+            tavg = round(rng.uniform(-5, 35), 1)
+            wspd = round(rng.uniform(2, 30), 1)
+            rows.append({
+                'time': pd.Timestamp(day),
+                'tavg': tavg,
+                'tmin': round(tavg - rng.uniform(2, 8), 1),
+                'tmax': round(tavg + rng.uniform(2, 8), 1),
+                'prcp': round(rng.expovariate(1), 1),
+                'snow': 0.0,
+                'wdir': float(rng.randint(0, 359)),
+                'wspd': wspd,
+                'wpgt': round(wspd * rng.uniform(1.5, 2.5), 1),
+                'pres': round(rng.uniform(995, 1030), 1),
+                'tsun': math.nan
+            })
+        return pd.DataFrame(rows, columns=['time'] + WEATHER_COLUMNS).set_index('time')
+
+
+def city_file(city, weather_dir=WEATHER_DIR):
+    return os.path.join(weather_dir, f"{city}_weather.csv")
+
+
+def last_cached_day(path):
+    """ Returns the last day in a cache file, None if the file does not exist or is empty """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    days = pd.read_csv(path, usecols=[0]).iloc[:, 0]
+    if days.empty:
+        return None
+    return pd.to_datetime(days).max().date()
+
+
+def append_frame(path, df, index=True):
+    """
+    Appends a DataFrame to a CSV file, with header if the file is new.
+
+    Files written by other programs may lack the line break after their last row, it is added first.
+    """
+    exists = os.path.exists(path) and os.path.getsize(path) > 0
+    if exists:
+        with open(path, 'rb+') as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                file.write(b'\n')
+    df.to_csv(path, mode='a' if exists else 'w', header=not exists, index=index, encoding='utf-8')
+
+
+def update_city(city, coordinates, source, end, weather_dir=WEATHER_DIR):
+    """
+    Fetches the days after the last cached day of a city and appends them to its cache file.
+
+    Days without any value have not been published yet. They are not cached, so they are requested again
+    in the next run.
+
+    Returns:
+        pandas.DataFrame: The new days, indexed by 'time'.
+    """
+    path = city_file(city, weather_dir)
+    last = last_cached_day(path)
+    start = last + timedelta(days=1) if last else START_DATE
+    if start > end:
+        return pd.DataFrame(columns=WEATHER_COLUMNS)
+
+    df = source.fetch(city, coordinates, start, end)
+    df = df.reindex(columns=WEATHER_COLUMNS).dropna(how='all')
+    df = df[(df.index >= pd.Timestamp(start)) & (df.index <= pd.Timestamp(end))]
+    df.index.name = 'time'
+    if not df.empty:
+        append_frame(path, df)
+    return df
+
+
+def update_weather(locations=LOCATIONS, source=None, end=None, weather_dir=WEATHER_DIR, workers=DEFAULT_WORKERS):
+    """
+    Brings the weather cache of every city up to date and appends the new days to combined_weather.csv.
+
+    Parameters:
+        locations (dict): City -> coordinates.
+        source: The weather source, a MeteostatSource if not given.
+        end (date): The last day to fetch, today if not given.
+        weather_dir (str): The folder of the city files and the combined file.
+        workers (int): The number of cities fetched at the same time.
+
+    Returns:
+        dict: City -> number of new days.
+    """
+    source = source or MeteostatSource()
+    end = end or datetime.now().date()
+    os.makedirs(weather_dir, exist_ok=True)
+
+    def fetch_city(city):
+        return update_city(city, locations[city], source, end, weather_dir)
+
+    cities = list(locations)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        new_days = dict(zip(cities, executor.map(fetch_city, cities)))
+
+    combined_path = os.path.join(weather_dir, COMBINED_FILE)
+    if os.path.exists(combined_path):
+        frames = new_days
+    else:
+        # Without a combined file it is built from the complete caches
+        frames = {city: pd.read_csv(city_file(city, weather_dir), index_col='time', parse_dates=['time'])
+                  for city in cities if os.path.exists(city_file(city, weather_dir))}
+    combined = [df.reset_index().assign(City=city) for city, df in frames.items() if not df.empty]
+    if combined:
+        combined = pd.concat(combined).rename(columns={'time': 'Date'})
+        combined = combined.sort_values(by='Date', kind='stable')[['Date'] + WEATHER_COLUMNS + ['City']]
+        append_frame(combined_path, combined, index=False)
+    return {city: len(df) for city, df in new_days.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fetches the missing days of weather data for every city.')
+    parser.add_argument('--end', default=None, help='Last day to fetch as YYYY-MM-DD (default: today)')
+    parser.add_argument('--cities', nargs='+', default=list(LOCATIONS), help='Cities to update')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of cities fetched at the same time')
+    parser.add_argument('--weather-dir', default=None, help='Folder of the city files and combined_weather.csv (default: weather)')
+    parser.add_argument('--fake', action='store_true', help='Use made up offline data instead of Meteostat (for tests)')
+    args = parser.parse_args(argv)
+    # Made up data must not end up in the real files
+    if args.fake and args.weather_dir is None:
+        parser.error('--fake needs an explicit --weather-dir')
+    args.weather_dir = args.weather_dir or WEATHER_DIR
+
+    end = datetime.strptime(args.end, '%Y-%m-%d').date() if args.end else None
+    source = FakeWeatherSource() if args.fake else MeteostatSource()
+    locations = {city: LOCATIONS[city] for city in args.cities}
+    start = time.monotonic()
+    for city, count in update_weather(locations, source, end, args.weather_dir, args.workers).items():
+        print(f"{city}: {count} new days")
+    print(f"------------------ Weather updated in {time.monotonic() - start:.2f}s ------------------")
+
+
+if __name__ == "__main__":
+    main()